@@ -7,17 +7,37 @@ import random
 import math
 import asyncio
 import io
+import functools
+import threading
 import csv
+import bisect
+import heapq
+import signal
+import sqlite3
+import sys
 from flask import Flask
 from threading import Thread
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
 import pytz
+from collections import OrderedDict, deque, namedtuple
 
 # =========================
 # Config
 # =========================
 DECAY_PERCENT = 0.05
 LAST_DECAY_KEY = "last_decay"
+# 減衰は遅延適用：サーバーの減衰回数（meta）とユーザーごとの適用済み回数の差だけ、読み書き時にまとめて減らす
+DECAY_EPOCH_KEY = "decay_epoch"
+# 週間カウンタも同様：サーバーの週番号（meta）より古い週のカウンタは0として扱い、読み書き時に前週分へ移す
+WEEK_EPOCH_KEY = "week_epoch"
+WEEKLY_COUNTERS = {
+    "weekly_xp": 0,
+    "weekly_chat_xp": 0,
+    "weekly_vc_xp": 0,
+    "weekly_active_days": 0,  # アクティブ日のビット列（UserRecord・0は記録なし）
+    "coin_daily_earned": 0,  # 日次上限も週の切り替えでリセット
+}
 DATA_DIR = "/data"
 JST = pytz.timezone("Asia/Tokyo")
 
@@ -118,48 +138,419 @@ intents.voice_states = True
 
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-vc_users = {}
+# =========================
+# 期限つきマップ（一定時間触られなかったキーを自動で消す）
+# =========================
+TTL_SWEEP_SECONDS = 5
+ttl_maps = []  # ttl_sweep_task が回す TtlMap
+
+class TtlMap:
+    """ttl 秒読み書きされなかったキーが消える dict
+
+    ・キーは期限の tick ごとにタイマーホイールのスロットへ入れ、ttl_sweep_task が期限の来たスロットだけ見る
+    ・max_size を超えたら最も長く触られていないキーから消す
+    ・hits / misses / expired（期限切れ） / evicted（上限超え）を数える
+    """
+
+    def __init__(self, name, ttl, max_size, tick=1.0):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.tick = tick
+        self._data = OrderedDict()  # { key: [value, 期限tick] }（古く触られた順）
+        self._slots = [set() for _ in range(int(ttl // tick) + 2)]
+        self._swept = int(time.time() // tick)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        ttl_maps.append(self)
+
+    def _touch(self, key, entry):
+        t = int((time.time() + self.ttl) // self.tick)
+        if entry[1] != t:
+            self._slots[entry[1] % len(self._slots)].discard(key)
+            self._slots[t % len(self._slots)].add(key)
+            entry[1] = t
+        self._data.move_to_end(key)
+
+    def _entry(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] < int(time.time() // self.tick):
+            # スイープ前の期限切れ
+            self._remove(key, entry)
+            self.stats["expired"] += 1
+            entry = None
+        return entry
+
+    def _remove(self, key, entry):
+        self._slots[entry[1] % len(self._slots)].discard(key)
+        del self._data[key]
+
+    def __contains__(self, key):
+        return self._entry(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._entry(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return default
+        self.stats["hits"] += 1
+        self._touch(key, entry)
+        return entry[0]
+
+    def __getitem__(self, key):
+        entry = self._entry(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            raise KeyError(key)
+        self.stats["hits"] += 1
+        self._touch(key, entry)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        entry = self._entry(key)
+        if entry is None:
+            entry = self._data[key] = [value, 0]
+            self._slots[0].add(key)
+        entry[0] = value
+        self._touch(key, entry)
+        while len(self._data) > self.max_size:
+            old_key, old_entry = next(iter(self._data.items()))
+            self._remove(old_key, old_entry)
+            self.stats["evicted"] += 1
+
+    def setdefault(self, key, default=None):
+        entry = self._entry(key)
+        if entry is None:
+            self[key] = default
+            return default
+        self._touch(key, entry)
+        return entry[0]
+
+    def pop(self, key, default=None):
+        entry = self._entry(key)
+        if entry is None:
+            return default
+        self._remove(key, entry)
+        return entry[0]
+
+    def touch(self, key):
+        """キーがあれば値を読まずに期限だけ延ばす（hits / misses には数えない）"""
+        entry = self._entry(key)
+        if entry is not None:
+            self._touch(key, entry)
+
+    def sweep(self):
+        """期限の来たスロットのキーを消す"""
+        now = int(time.time() // self.tick)
+        start = max(self._swept + 1, now - len(self._slots) + 1)
+        for t in range(start, now + 1):
+            slot = self._slots[t % len(self._slots)]
+            expired = [key for key in slot if self._data[key][1] <= now]
+            for key in expired:
+                slot.discard(key)
+                del self._data[key]
+            self.stats["expired"] += len(expired)
+        self._swept = now
+
+class SlidingWindowCounter:
+    """キーごとの直近 window 秒のイベント数（deque に時刻を持つ）
+
+    max_events 件まで数えれば十分な用途（「3回以上か」など）では古い時刻を持たない。
+    window 秒イベントのなかったキーは TtlMap ごと消える。
+    """
+
+    def __init__(self, name, window, max_events, max_keys):
+        self.window = window
+        self.max_events = max_events
+        self._times = TtlMap(name, window, max_keys)
+
+    @property
+    def stats(self):
+        return self._times.stats
+
+    def hit(self, key, now=None):
+        """イベントを1回記録し、直近 window 秒のイベント数を返す"""
+        now = time.time() if now is None else now
+        times = self._times.get(key)
+        if times is None:
+            times = deque(maxlen=self.max_events)
+        while times and now - times[0] > self.window:
+            times.popleft()
+        times.append(now)
+        self._times[key] = times
+        return len(times)
+
+# 状態を持つキーの上限（「guild_id:user_id」単位）
+STATE_MAP_MAX_KEYS = int(os.environ.get("STATE_MAP_MAX_KEYS", "200000"))
+# VC状態は tick（30秒）ごとに触るので、1時間触られなければ退出済みとみなして消す
+VC_STATE_TTL = 3600
+
+# VC参加中のメンバー: { "guild_id:user_id": 前回の寝落ちチェックからの経過秒数 }
+vc_users = TtlMap("vc_users", VC_STATE_TTL, STATE_MAP_MAX_KEYS)
 
 # =========================
 # スパム対策（レートリミット）
 # =========================
-# { "guild_id:user_id": [timestamp, timestamp, ...] }
-spam_message_times = {}
+# 10秒以内に3メッセージ以上でXP無効
+SPAM_WINDOW_SECONDS = 10
+SPAM_MAX_MESSAGES = 3
+spam_message_times = SlidingWindowCounter("spam", SPAM_WINDOW_SECONDS, SPAM_MAX_MESSAGES, STATE_MAP_MAX_KEYS)
 
 # 寝落ち管理: { "guild_id:user_id": True } → XP停止フラグ
-vc_afk_flags = {}
+vc_afk_flags = TtlMap("vc_afk_flags", VC_STATE_TTL, STATE_MAP_MAX_KEYS)
 # 最後にVCでXPを獲得した時刻（90分チェック用）: { "guild_id:user_id": timestamp }
-vc_last_xp_time = {}
+vc_last_xp_time = TtlMap("vc_last_xp_time", VC_STATE_TTL, STATE_MAP_MAX_KEYS)
+# 寝落ちチェックの応答待ち: { "guild_id:user_id" }
+vc_afk_checking = set()
 
 # =========================
 # XP BOOST SYSTEM（サーバーごと・独立管理）
 # =========================
-# 時間帯ブースト: { guild_id: multiplier }  1=無効
-guild_time_boost = {}
-# ボス討伐ブースト: { guild_id: multiplier }  1=無効
-guild_boss_boost = {}
-
+# ブーストはサーバー設定に { 種類: {"multiplier", "expires_at", "end_message"} } として保存する。
+#   "time": 時間帯ブースト / "boss": ボス討伐・イベント討伐ブースト
+# 期限切れは get_boost() がその場で無視し、終了通知はタイマーホイールが送る。
 def get_boost(guild_id):
-    """2つのブーストを掛け合わせた最終倍率を返す"""
-    time_m = guild_time_boost.get(guild_id, 1)
-    boss_m = guild_boss_boost.get(guild_id, 1)
-    total = time_m * boss_m
+    """期限内のブーストを掛け合わせた最終倍率を返す"""
+    now = time.time()
+    total = 1
+    for multiplier, expires_at in get_guild_config(guild_id).boosts.values():
+        if expires_at > now:
+            total *= multiplier
     return {"multiplier": total, "active": total > 1}
 
-def set_time_boost(guild_id, multiplier):
-    """時間帯ブーストをセット（1=無効）"""
-    guild_time_boost[guild_id] = multiplier
+def set_boost(guild_id, kind, multiplier, expires_at, end_message=None, save=True):
+    """ブーストをセットして保存し、期限に終了通知を予約する（同じ種類は上書き）
+
+    save=False ならメモリ上の設定だけ更新する（複数サーバーにまとめてセットし、最後に1回 save_config() する用）。
+    """
+    config = load_config()
+    gid = str(guild_id)
+    config.setdefault(gid, {}).setdefault("boosts", {})[kind] = {
+        "multiplier": multiplier,
+        "expires_at": expires_at,
+        "end_message": end_message,
+    }
+    if save:
+        save_config(config, guild_id)
+    else:
+        _guild_config_cache.pop(int(guild_id), None)
+    schedule_boost_end(guild_id, kind, expires_at)
+
+async def end_boost(guild_id, kind, expires_at=None, save=True):
+    """ブーストを終了し、終了メッセージを送る。終了したら True
 
-def set_boss_boost(guild_id, multiplier):
-    """ボス討伐ブーストをセット（1=無効）"""
-    guild_boss_boost[guild_id] = multiplier
+    expires_at を指定した場合は、その期限で保存されているブーストのときだけ終了する
+    （上書き・終了済みのブーストに対する予約は何もしない）。
+    save=False は set_boost() と同じく、まとめて終了して最後に1回 save_config() する用。
+    """
+    config = load_config()
+    boosts = config.get(str(guild_id), {}).get("boosts", {})
+    entry = boosts.get(kind)
+    if entry is None or (expires_at is not None and entry["expires_at"] != expires_at):
+        return False
+    del boosts[kind]
+    if save:
+        save_config(config, guild_id)
+    else:
+        _guild_config_cache.pop(int(guild_id), None)
+
+    guild = bot.get_guild(int(guild_id))
+    ch_id = get_level_channel_id(guild_id)
+    channel = guild.get_channel(ch_id) if guild and ch_id else None
+    if channel and entry.get("end_message"):
+        outbox_send(channel, entry["end_message"], priority=PRIORITY_BONUS)
+    return True
+
+class TimerWheel:
+    """ハッシュ化タイマーホイール
+
+    期限を tick 秒単位に丸めてスロットに振り分け、1つのタスクがスロットを順に回して期限の来たものを実行する。
+    予約が1件もない間は眠ったまま起きない。
+    """
+
+    def __init__(self, tick=1.0, slots=3600):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.count = 0
+        self._current = None
+        self._wakeup = None
+        self._task = None
+
+    def schedule(self, expires_at, callback):
+        """expires_at（UNIX秒）に callback()（コルーチン関数）を実行する。過去の時刻なら次のtickで実行"""
+        # 過去の期限は今のtickに寄せる（そのままだとスロットが一周するまで待たされる）。
+        # 予約がなく眠っている間は _current が古いままなので、_current だけでなく今の時刻でも寄せる
+        t = max(int(expires_at // self.tick), int(time.time() // self.tick))
+        if self._current is not None:
+            t = max(t, self._current + 1)
+        self.slots[t % len(self.slots)].append((t, callback))
+        self.count += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        self._current = int(time.time() // self.tick) - 1
+        while True:
+            if self.count == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # 眠っていた間のスロットは空なので飛ばす
+                self._current = max(self._current, int(time.time() // self.tick) - 1)
+            now = int(time.time() // self.tick)
+            while self._current < now:
+                self._current += 1
+                slot = self.slots[self._current % len(self.slots)]
+                due = [cb for t, cb in slot if t <= self._current]
+                if due:
+                    slot[:] = [(t, cb) for t, cb in slot if t > self._current]
+                    self.count -= len(due)
+                    for callback in due:
+                        asyncio.create_task(callback())
+            await asyncio.sleep(self.tick)
+
+boost_timers = TimerWheel()
+
+def schedule_boost_end(guild_id, kind, expires_at):
+    boost_timers.schedule(expires_at, lambda: end_boost(guild_id, kind, expires_at))
+
+def start_boost_timers():
+    """保存済みのブーストの終了通知を予約し直してホイールを回す（起動時用・再接続では何もしない）
+
+    停止中に期限の過ぎたブーストは、終了メッセージを送らずに設定から消すだけにする。
+    """
+    if boost_timers.running:
+        return
+    config = load_config()
+    now = time.time()
+    expired = False
+    for gid, cfg in config.items():
+        boosts = cfg.get("boosts", {})
+        for kind, entry in list(boosts.items()):
+            if entry["expires_at"] <= now:
+                del boosts[kind]
+                expired = True
+            else:
+                schedule_boost_end(int(gid), kind, entry["expires_at"])
+    if expired:
+        save_config(config)
+    boost_timers.start()
 
 # =========================
-# 二重実行防止フラグ（サーバーごと）
+# 定期処理スケジューラ（JST・ヒープで次の発火時刻を管理）
 # =========================
-_weekly_announced = {}    # { guild_id: date_str }
-_mid_announced_today = {} # { guild_id: date_str }
-_boss_spawn_announced = {} # { guild_id: date_str }
+# 各ジョブの最後の発火時刻をファイルに残すので、再起動しても同じ回を二度実行しない。
+# 停止中に過ぎた回は、最新の1回だけ猶予時間内なら起動直後に実行する。
+ScheduledJob = namedtuple("ScheduledJob", ["name", "next_fire", "fn", "grace"])
+
+def scheduler_log_file():
+    return f"{DATA_DIR}/scheduler_fired.json"
+
+def jst_at(day, hour, minute=0):
+    return JST.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+def daily_at(*hours, minute=0):
+    """毎日 hours 時 minute 分（JST）に発火する next_fire 関数"""
+    def next_fire(after):
+        after = after.astimezone(JST)
+        for d in range(2):
+            day = after.date() + timedelta(days=d)
+            for hour in sorted(hours):
+                t = jst_at(day, hour, minute)
+                if t > after:
+                    return t
+    return next_fire
+
+def weekly_at(weekday, hour, minute=0):
+    """毎週 weekday（0=月曜）の hour 時 minute 分（JST）に発火する next_fire 関数"""
+    def next_fire(after):
+        after = after.astimezone(JST)
+        for d in range(8):
+            day = after.date() + timedelta(days=d)
+            t = jst_at(day, hour, minute)
+            if day.weekday() == weekday and t > after:
+                return t
+    return next_fire
+
+class Scheduler:
+    """登録したジョブを次の発火時刻順のヒープに積み、先頭の時刻まで眠って実行する"""
+
+    def __init__(self):
+        self.jobs = {}
+        self._heap = []   # [(発火時刻, 連番, ScheduledJob)]
+        self._seq = 0
+        self._fired = None  # { ジョブ名: 最後に発火した時刻（ISO） }
+        self._task = None
+
+    def add(self, name, next_fire, fn, grace=timedelta(minutes=5)):
+        """fn(発火時刻) を next_fire(直前の発火時刻) が返す時刻ごとに実行する"""
+        self.jobs[name] = ScheduledJob(name, next_fire, fn, grace)
+
+    def _push(self, fire_time, job):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_time, self._seq, job))
+
+    def _save_log(self):
+        storage_io.write(
+            ("scheduler",), lambda log: write_json_atomic(scheduler_log_file(), log), dict(self._fired)
+        )
+
+    async def start(self):
+        """発火ログを読み込んでスケジューラを動かす（再接続で呼ばれても1回だけ）"""
+        if self._task is not None:
+            return
+        self._fired = await storage_io.run(read_json, scheduler_log_file(), {})
+        now = datetime.now(JST)
+        for job in self.jobs.values():
+            last = self._fired.get(job.name)
+            if last is None:
+                # 初めてのジョブは今を起点にする（過去の回はさかのぼらない）
+                self._fired[job.name] = now.isoformat()
+                self._push(job.next_fire(now), job)
+                continue
+            missed = None
+            t = job.next_fire(datetime.fromisoformat(last))
+            while t <= now:
+                missed, t = t, job.next_fire(t)
+            if missed is not None and now - missed <= job.grace:
+                self._push(missed, job)
+            else:
+                self._push(t, job)
+        self._save_log()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._heap:
+            fire_time, _, job = self._heap[0]
+            delay = (fire_time - datetime.now(JST)).total_seconds()
+            if delay > 0:
+                # 時計の補正に備えて最長1時間ごとに見直す
+                await asyncio.sleep(min(delay, 3600))
+                continue
+            heapq.heappop(self._heap)
+            # 実行前に発火ログを書くので、途中で落ちても同じ回は二度実行しない
+            self._fired[job.name] = fire_time.isoformat()
+            self._save_log()
+            self._push(job.next_fire(fire_time), job)
+            asyncio.create_task(self._run_job(job, fire_time))
+
+    async def _run_job(self, job, fire_time):
+        try:
+            await job.fn(fire_time)
+        except Exception as e:
+            print(f"[scheduler] {job.name} ({fire_time.isoformat()}): {e}")
+
+scheduler = Scheduler()
 
 # =========================
 # 週ボスシステム Config
@@ -198,24 +589,50 @@ def config_file():
 # =========================
 # Config read/write（通知チャンネルID保存）
 # =========================
-def load_config():
-    path = config_file()
-    if not os.path.exists(path):
-        return {}
-    with open(path, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+# config.json はプロセス内にキャッシュし、書き込み時（/setchannel・/set getchannel）だけ更新する
+_config_cache = None
 
-def save_config(config):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(config_file(), "w") as f:
-        json.dump(config, f, indent=4)
+# サーバーごとの設定（xp_channels は frozenset で O(1) 判定）
+GuildConfig = namedtuple("GuildConfig", ["level_channel_id", "xp_channels", "boosts", "digest_seconds"])
+_guild_config_cache = {}  # { guild_id: GuildConfig }
+
+def load_config():
+    global _config_cache
+    if _config_cache is None:
+        _config_cache = store.backend.load_config()
+    return _config_cache
+
+async def preload_config():
+    """起動時にI/Oスレッドで config を読み込んでおく"""
+    global _config_cache
+    if _config_cache is None:
+        _config_cache = await storage_io.read(("config",), store.backend.load_config)
+
+def save_config(config, guild_id=None):
+    global _config_cache
+    _config_cache = config
+    storage_io.write(("config",), store.backend.save_config, snapshot(config))
+    if guild_id is None:
+        _guild_config_cache.clear()
+    else:
+        _guild_config_cache.pop(int(guild_id), None)
+
+def get_guild_config(guild_id):
+    guild_id = int(guild_id)
+    cfg = _guild_config_cache.get(guild_id)
+    if cfg is None:
+        raw = load_config().get(str(guild_id), {})
+        cfg = GuildConfig(
+            raw.get("level_channel_id"),
+            frozenset(raw.get("xp_channels", [])),
+            {kind: (b["multiplier"], b["expires_at"]) for kind, b in raw.get("boosts", {}).items()},
+            raw.get("digest_seconds", 0),
+        )
+        _guild_config_cache[guild_id] = cfg
+    return cfg
 
 def get_level_channel_id(guild_id):
-    config = load_config()
-    return config.get(str(guild_id), {}).get("level_channel_id")
+    return get_guild_config(guild_id).level_channel_id
 
 def set_level_channel_id(guild_id, channel_id):
     config = load_config()
@@ -223,13 +640,18 @@ def set_level_channel_id(guild_id, channel_id):
     if gid not in config:
         config[gid] = {}
     config[gid]["level_channel_id"] = channel_id
-    save_config(config)
+    save_config(config, guild_id)
 
 def get_xp_channel_ids(guild_id):
     """XPを獲得できるチャンネルIDリストを返す（空=全チャンネル許可）"""
     config = load_config()
     return config.get(str(guild_id), {}).get("xp_channels", [])
 
+def is_xp_channel(guild_id, channel_id):
+    """XPを獲得できるチャンネルか（制限なしなら常にTrue）"""
+    xp_channels = get_guild_config(guild_id).xp_channels
+    return not xp_channels or channel_id in xp_channels
+
 def add_xp_channel_id(guild_id, channel_id):
     config = load_config()
     gid = str(guild_id)
@@ -238,7 +660,7 @@ def add_xp_channel_id(guild_id, channel_id):
     channels = config[gid].setdefault("xp_channels", [])
     if channel_id not in channels:
         channels.append(channel_id)
-    save_config(config)
+    save_config(config, guild_id)
 
 def remove_xp_channel_id(guild_id, channel_id):
     config = load_config()
@@ -247,7 +669,7 @@ def remove_xp_channel_id(guild_id, channel_id):
     if channel_id in channels:
         channels.remove(channel_id)
         config[gid]["xp_channels"] = channels
-        save_config(config)
+        save_config(config, guild_id)
         return True
     return False
 
@@ -256,50 +678,1081 @@ def clear_xp_channels(guild_id):
     gid = str(guild_id)
     if gid in config:
         config[gid]["xp_channels"] = []
-        save_config(config)
+        save_config(config, guild_id)
+
+def set_digest_seconds(guild_id, seconds):
+    """ダイジェストモードのまとめる秒数を保存（0=オフ）"""
+    config = load_config()
+    gid = str(guild_id)
+    if gid not in config:
+        config[gid] = {}
+    config[gid]["digest_seconds"] = seconds
+    save_config(config, guild_id)
 
 # =========================
 # Data read/write（サーバーごと）
 # =========================
-def load_data(guild_id):
-    path = data_file(guild_id)
+# 書き戻し間隔（秒）と、即時書き戻しするダーティユーザー数
+STORE_FLUSH_INTERVAL = int(os.environ.get("STORE_FLUSH_INTERVAL", "60"))
+STORE_DIRTY_THRESHOLD = int(os.environ.get("STORE_DIRTY_THRESHOLD", "500"))
+# ランキングインデックスを差分更新せず作り直す変更人数の下限（これ以上かつ全体の1/4超のとき）
+RANK_REBUILD_MIN = 64
+
+def write_json_atomic(path, obj):
+    """一時ファイルに書いてから置き換える（書き込み途中で落ちても壊れない）"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp, path)
+
+def read_json(path, default):
     if not os.path.exists(path):
-        return {}
+        return default
     with open(path, "r") as f:
         try:
             return json.load(f)
         except json.JSONDecodeError:
-            return {}
+            return default
+
+class JsonBackend:
+    """levels_{gid}.json などにサーバー単位で丸ごと保存するバックエンド"""
+
+    # save_users() でファイル全体を書き直すか（False なら変更ユーザーだけ渡せばよい）
+    rewrites_all = True
+
+    def load_users(self, guild_id):
+        """(ユーザーデータ, メタ情報) を返す。メタ情報はユーザーID以外のキー"""
+        raw = read_json(data_file(guild_id), {})
+        users = {k: v for k, v in raw.items() if k.isdigit()}
+        meta = {k: v for k, v in raw.items() if not k.isdigit()}
+        return users, meta
+
+    def save_users(self, guild_id, users, meta, dirty_uids):
+        """meta は変更がなければ None（ファイル全体を書き直すバックエンドには常に渡される）"""
+        # JSONは部分更新できないのでファイル全体を書き直す
+        write_json_atomic(data_file(guild_id), {**users, **meta})
+
+    def load_boss(self, guild_id):
+        return read_json(boss_file(guild_id), default_boss())
+
+    def save_boss(self, guild_id, boss):
+        write_json_atomic(boss_file(guild_id), ranked_damage(boss))
+
+    def load_event_boss(self, guild_id):
+        return read_json(event_boss_file(guild_id), default_event_boss())
+
+    def save_event_boss(self, guild_id, boss):
+        write_json_atomic(event_boss_file(guild_id), ranked_damage(boss))
+
+    def load_config(self):
+        return read_json(config_file(), {})
+
+    def save_config(self, config):
+        write_json_atomic(config_file(), config)
+
+# =========================
+# SQLite（WAL）バックエンド
+# =========================
+# STORAGE_BACKEND=sqlite で有効化。既存JSONからの移行は `python main.py migrate`
+def sqlite_file():
+    return f"{DATA_DIR}/bot.db"
+
+# users テーブルに列として持つキー（それ以外は extra にJSONで格納）
+USER_COLUMNS = ("level", "xp", "weekly_xp", "coins")
+# ボスは列名と、ボスの dict にその値がないときの既定値
+BOSS_COLUMNS = {"active": False, "hp": 0, "max_hp": 0, "week": 0, "cleared": 0}
+EVENT_BOSS_COLUMNS = {"active": False, "hp": 0, "max_hp": 0, "name": "", "consecutive_clears": 0}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    guild_id  INTEGER NOT NULL,
+    user_id   TEXT    NOT NULL,
+    level     INTEGER NOT NULL DEFAULT 1,
+    xp        INTEGER NOT NULL DEFAULT 0,
+    weekly_xp INTEGER NOT NULL DEFAULT 0,
+    coins     INTEGER NOT NULL DEFAULT 0,
+    extra     TEXT    NOT NULL DEFAULT '{}',
+    PRIMARY KEY (guild_id, user_id)
+);
+-- weekly_xp 列は週番号（week_epoch）で解決する前の値で、古い週のユーザーも残るので並べ替えには使えない
+DROP INDEX IF EXISTS idx_users_weekly_xp;
+CREATE INDEX IF NOT EXISTS idx_users_level_xp ON users (guild_id, level DESC, xp DESC);
+
+CREATE TABLE IF NOT EXISTS guild_meta (
+    guild_id INTEGER NOT NULL,
+    key      TEXT    NOT NULL,
+    value    TEXT    NOT NULL,
+    PRIMARY KEY (guild_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS boss (
+    guild_id INTEGER PRIMARY KEY,
+    active   INTEGER NOT NULL DEFAULT 0,
+    hp       INTEGER NOT NULL DEFAULT 0,
+    max_hp   INTEGER NOT NULL DEFAULT 0,
+    week     INTEGER NOT NULL DEFAULT 0,
+    cleared  INTEGER NOT NULL DEFAULT 0,
+    extra    TEXT    NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS boss_damage (
+    guild_id INTEGER NOT NULL,
+    user_id  TEXT    NOT NULL,
+    damage   INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS event_boss (
+    guild_id           INTEGER PRIMARY KEY,
+    active             INTEGER NOT NULL DEFAULT 0,
+    hp                 INTEGER NOT NULL DEFAULT 0,
+    max_hp             INTEGER NOT NULL DEFAULT 0,
+    name               TEXT    NOT NULL DEFAULT '',
+    consecutive_clears INTEGER NOT NULL DEFAULT 0,
+    extra              TEXT    NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS event_boss_damage (
+    guild_id INTEGER NOT NULL,
+    user_id  TEXT    NOT NULL,
+    damage   INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id TEXT PRIMARY KEY,
+    config   TEXT NOT NULL
+);
+"""
+
+class SqliteBackend:
+    """1つのSQLiteファイル（WALモード）に全サーバーの状態を保存するバックエンド
+
+    XP獲得などの変更は、変更のあったユーザーの行だけを UPSERT する。
+    """
+
+    rewrites_all = False
+
+    def __init__(self, path=None):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        self.path = path or sqlite_file()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.conn.commit()
+        # 前回保存したダメージ（差分だけ書くため）{ (table, guild_id): { user_id: damage } }
+        self._saved_damage = {}
+
+    # ---- users ----
+    def load_users(self, guild_id):
+        users = {}
+        rows = self.conn.execute(
+            "SELECT user_id, level, xp, weekly_xp, coins, extra FROM users WHERE guild_id = ?",
+            (guild_id,)
+        )
+        for user_id, level, xp, weekly_xp, coins, extra in rows:
+            info = json.loads(extra)
+            info.update(level=level, xp=xp, weekly_xp=weekly_xp, coins=coins)
+            users[user_id] = info
+        meta = {
+            key: json.loads(value)
+            for key, value in self.conn.execute(
+                "SELECT key, value FROM guild_meta WHERE guild_id = ?", (guild_id,)
+            )
+        }
+        return users, meta
+
+    def _user_row(self, guild_id, user_id, info):
+        extra = {k: v for k, v in info.items() if k not in USER_COLUMNS}
+        return (
+            guild_id, user_id,
+            info.get("level", 1), info.get("xp", 0),
+            info.get("weekly_xp", 0), info.get("coins", 0),
+            json.dumps(extra, ensure_ascii=False),
+        )
+
+    def save_users(self, guild_id, users, meta, dirty_uids):
+        rows = [self._user_row(guild_id, uid, users[uid]) for uid in dirty_uids if uid in users]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (guild_id, user_id, level, xp, weekly_xp, coins, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET "
+                "level = excluded.level, xp = excluded.xp, weekly_xp = excluded.weekly_xp, "
+                "coins = excluded.coins, extra = excluded.extra",
+                rows
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO guild_meta (guild_id, key, value) VALUES (?, ?, ?)",
+                [(guild_id, k, json.dumps(v, ensure_ascii=False)) for k, v in (meta or {}).items()]
+            )
+
+    # ---- boss / event boss ----
+    def _load_boss_row(self, table, columns, guild_id, default):
+        row = self.conn.execute(
+            f"SELECT {', '.join(columns)}, extra FROM {table} WHERE guild_id = ?", (guild_id,)
+        ).fetchone()
+        if row is None:
+            self._saved_damage[(table, guild_id)] = {}
+            return default
+        boss = json.loads(row[-1])
+        boss.update(zip(columns, row[:-1]))
+        boss["active"] = bool(boss["active"])
+        boss["damage"] = dict(self.conn.execute(
+            f"SELECT user_id, damage FROM {table}_damage WHERE guild_id = ? ORDER BY damage DESC, user_id",
+            (guild_id,)
+        ).fetchall())
+        self._saved_damage[(table, guild_id)] = dict(boss["damage"])
+        return boss
+
+    def _save_boss_row(self, table, columns, guild_id, boss):
+        extra = {k: v for k, v in boss.items() if k not in columns and k != "damage"}
+        damage = boss.get("damage", {})
+        saved = self._saved_damage.get((table, guild_id))
+        with self.conn:
+            if saved is None:
+                # 未読み込みのサーバーは差分が取れないので丸ごと書き直す
+                self.conn.execute(f"DELETE FROM {table}_damage WHERE guild_id = ?", (guild_id,))
+                saved = {}
+            changed = [(guild_id, uid, dmg) for uid, dmg in damage.items() if saved.get(uid) != dmg]
+            removed = [(guild_id, uid) for uid in saved if uid not in damage]
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {table} (guild_id, {', '.join(columns)}, extra) "
+                f"VALUES (?, {', '.join('?' for _ in columns)}, ?)",
+                (guild_id, *(boss.get(c, default) for c, default in columns.items()), json.dumps(extra, ensure_ascii=False))
+            )
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {table}_damage (guild_id, user_id, damage) VALUES (?, ?, ?)",
+                changed
+            )
+            self.conn.executemany(
+                f"DELETE FROM {table}_damage WHERE guild_id = ? AND user_id = ?", removed
+            )
+        self._saved_damage[(table, guild_id)] = dict(damage)
+
+    def load_boss(self, guild_id):
+        return self._load_boss_row("boss", BOSS_COLUMNS, guild_id, default_boss())
+
+    def save_boss(self, guild_id, boss):
+        self._save_boss_row("boss", BOSS_COLUMNS, guild_id, boss)
+
+    def load_event_boss(self, guild_id):
+        return self._load_boss_row("event_boss", EVENT_BOSS_COLUMNS, guild_id, default_event_boss())
+
+    def save_event_boss(self, guild_id, boss):
+        self._save_boss_row("event_boss", EVENT_BOSS_COLUMNS, guild_id, boss)
+
+    # ---- config ----
+    def load_config(self):
+        return {
+            gid: json.loads(config)
+            for gid, config in self.conn.execute("SELECT guild_id, config FROM guild_config")
+        }
+
+    def save_config(self, config):
+        with self.conn:
+            # 設定から消えたサーバーの行も消す
+            stored = {gid for (gid,) in self.conn.execute("SELECT guild_id FROM guild_config")}
+            self.conn.executemany(
+                "DELETE FROM guild_config WHERE guild_id = ?", [(gid,) for gid in stored - set(config)]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO guild_config (guild_id, config) VALUES (?, ?)",
+                [(gid, json.dumps(c, ensure_ascii=False)) for gid, c in config.items()]
+            )
+
+def migrate_json_to_sqlite(legacy_guild_id=None, legacy_path="levels.json"):
+    """既存のJSONファイルをSQLiteへ一括移行する（何度実行しても同じ結果になる）
+
+    legacy_guild_id を指定すると、サーバー分割前の levels.json をそのサーバーへ取り込む
+    （すでに同じユーザーがいる場合は上書きしない）。
+    """
+    src = JsonBackend()
+    dst = SqliteBackend()
+    guild_ids = set()
+    for name in os.listdir(DATA_DIR):
+        for prefix in ("levels_", "boss_", "event_boss_"):
+            if name.startswith(prefix) and name.endswith(".json"):
+                gid = name[len(prefix):-len(".json")]
+                if gid.isdigit():
+                    guild_ids.add(int(gid))
+
+    for gid in sorted(guild_ids):
+        users, meta = src.load_users(gid)
+        dst.save_users(gid, users, meta, users.keys())
+        dst.save_boss(gid, src.load_boss(gid))
+        dst.save_event_boss(gid, src.load_event_boss(gid))
+        print(f"[migrate] guild {gid}: {len(users)} users")
+
+    dst.save_config(src.load_config())
+
+    if legacy_guild_id and os.path.exists(legacy_path):
+        legacy = read_json(legacy_path, {})
+        users, meta = dst.load_users(legacy_guild_id)
+        added = []
+        for uid, info in legacy.items():
+            if uid.isdigit() and uid not in users:
+                users[uid] = info
+                added.append(uid)
+        dst.save_users(legacy_guild_id, users, meta, added)
+        print(f"[migrate] {legacy_path} -> guild {legacy_guild_id}: {len(added)} users")
+
+def snapshot(obj):
+    """別スレッドで書き出すためのコピー（dict / list を再帰的に複製、UserRecord は保存形式の dict に）"""
+    if isinstance(obj, UserRecord):
+        return snapshot(obj.to_dict())
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [snapshot(v) for v in obj]
+    if isinstance(obj, set):
+        return set(obj)
+    return obj
+
+class StorageExecutor:
+    """ストレージI/O専用のスレッド（1本）でファイル・DB操作を実行する
+
+    ・同じキーへの書き込みが実行待ちの間に次の書き込みが来たら1回にまとめる
+    ・読み込みは実行待ちの書き込みがあればその内容を返す（ファイルを読まない）
+    ・1本のスレッドで順番に実行するので、同じファイルへの書き込み順序は保たれる
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-io")
+        self._lock = threading.Lock()
+        self._pending = {}  # { key: [fn, value, future] }
+
+    def _run_write(self, key):
+        with self._lock:
+            fn, value, _ = self._pending.pop(key)
+        fn(value)
+
+    def write(self, key, fn, value, merge=None):
+        """fn(value) をI/Oスレッドで実行する。concurrent.futures.Future を返す
+
+        merge を渡すと、実行待ちの値と新しい値を merge(old, new) で合成する（差分書き込み用）。
+        渡さなければ新しい値で置き換える（全体書き込み用）。
+        """
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry[1] = merge(entry[1], value) if merge else value
+                return entry[2]
+            entry = [fn, value, None]
+            self._pending[key] = entry
+            entry[2] = self._executor.submit(self._run_write, key)
+            return entry[2]
+
+    def pending_value(self, key):
+        with self._lock:
+            entry = self._pending.get(key)
+            return snapshot(entry[1]) if entry is not None else None
+
+    async def run(self, fn, *args):
+        """fn(*args) をI/Oスレッドで実行して結果を返す"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def read(self, key, fn, *args):
+        pending = self.pending_value(key)
+        if pending is not None:
+            return pending
+        return await self.run(fn, *args)
+
+    def read_sync(self, key, fn, *args):
+        """read() の同期版（終了時などイベントループの外から使う）。I/Oスレッドの完了を待って返す"""
+        pending = self.pending_value(key)
+        if pending is not None:
+            return pending
+        return self._executor.submit(fn, *args).result()
+
+    def shutdown(self):
+        """実行待ちの書き込みをすべて終えてから止める"""
+        self._executor.shutdown(wait=True)
+
+storage_io = StorageExecutor()
+
+def merge_user_writes(old, new):
+    old_users, old_meta, old_dirty = old
+    new_users, meta, new_dirty = new
+    for uid, sources in new_dirty.items():
+        old_dirty.setdefault(uid, set()).update(sources)
+    old_users.update(new_users)
+    return old_users, meta if meta is not None else old_meta, old_dirty
+
+# =========================
+# ランキングインデックス
+# =========================
+def total_xp_key(info):
+    """累計XP順のキー (レベル, 減衰を正規化したXPの対数)
+
+    XPは未適用の減衰を抱えていることがあるので、xp × (1-DECAY_PERCENT)^(-適用済み回数) で比べる。
+    同じ時点では全員に同じ係数が掛かるため、減衰が進んでも並び順は変わらない。
+    （レベルは減衰しないので、レベル→XPの辞書順は累計XP順と同じ）
+    キーは float を含むので、RankIndex は古いキーを再計算せず _keys に覚えた値で探す（計算し直すと誤差で一致しないことがある）。
+    """
+    xp = info.xp
+    if xp <= 0:
+        return (info.level, float("-inf"))
+    return (info.level, math.log(xp) - info.decay_epoch * math.log(1 - DECAY_PERCENT))
+
+def weekly_xp_key(info, week):
+    """今週（week）の weekly_xp。古い週のカウンタは0"""
+    return info.weekly_xp if info.week_epoch == week else 0
+
+def last_weekly_xp_key(info, week):
+    """前週の weekly_xp（まだ繰り越していないユーザーは weekly_xp がそのまま前週分）"""
+    user_week = info.week_epoch
+    if user_week == week:
+        return info.last_weekly_xp
+    return info.weekly_xp if user_week == week - 1 else 0
+
+def descending(key):
+    """昇順リストに降順で並べるためのキー（タプルは要素ごとに反転）"""
+    return tuple(-k for k in key) if isinstance(key, tuple) else -key
+
+class RankIndex:
+    """(反転したキー, user_id) を昇順に保つ順序付きリスト
+
+    順位は二分探索で O(log n)、上位k件はスライスで O(k)。
+    同じキーのユーザーは user_id 順に並ぶ。
+    """
+
+    def __init__(self, key, users=None):
+        self.key = key
+        self._entries = []
+        # { user_id: 現在のキー }。_entries のキーはこの値の符号を反転しただけ（誤差なし）なので、float のキーでも
+        # update() / remove() の二分探索で必ず同じ要素に当たる（古いキーは必ずここから取り出して使う）
+        self._keys = {}
+        if users:
+            self._keys = {uid: key(info) for uid, info in users.items()}
+            self._entries = sorted((descending(k), uid) for uid, k in self._keys.items())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def changed(self, user_id, info):
+        """info（None なら削除）を反映するとこのユーザーの並びが変わるか"""
+        new_key = self.key(info) if info is not None else None
+        return self._keys.get(user_id) != new_key
+
+    def update(self, user_id, info):
+        new_key = self.key(info)
+        old_key = self._keys.get(user_id)
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            del self._entries[bisect.bisect_left(self._entries, (descending(old_key), user_id))]
+        bisect.insort(self._entries, (descending(new_key), user_id))
+        self._keys[user_id] = new_key
+
+    def remove(self, user_id):
+        old_key = self._keys.pop(user_id, None)
+        if old_key is not None:
+            del self._entries[bisect.bisect_left(self._entries, (descending(old_key), user_id))]
+
+    def rank(self, user_id):
+        """1始まりの順位（未登録なら None）"""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._entries, (descending(key), user_id)) + 1
+
+    def top(self, k=None):
+        """上位k件の [(user_id, キー)]（k=None なら全員）"""
+        entries = self._entries if k is None else self._entries[:k]
+        return [(uid, descending(neg)) for neg, uid in entries]
+
+    def iter_top(self):
+        """上位から順に (user_id, キー) を返すイテレータ（途中で打ち切る用）"""
+        for neg, uid in self._entries:
+            yield uid, descending(neg)
+
+class WeeklyTotals:
+    """サーバーの週間XP合計と参加人数（weekly_xp > 0 の人数）を差分更新で保つ"""
+
+    def __init__(self, users, week):
+        self.week = week
+        self._xp = {uid: weekly_xp_key(info, week) for uid, info in users.items()}
+        self.total = sum(self._xp.values())
+        self.active = sum(1 for xp in self._xp.values() if xp > 0)
+
+    def update(self, user_id, info):
+        old = self._xp.get(user_id, 0)
+        new = weekly_xp_key(info, self.week) if info is not None else 0
+        self._xp[user_id] = new
+        self.total += new - old
+        self.active += (new > 0) - (old > 0)
+
+class GuildStore:
+    """サーバーごとのユーザーデータをメモリに常駐させ、変更分をまとめて書き戻す
+
+    ・読み取りは常にメモリ上のdictから（初回のみI/Oスレッドで読み込む）
+    ・変更したら mark_dirty() でユーザーを記録
+    ・定期フラッシュ / ダーティ数が閾値超え / 終了時 にバックエンドへ書き戻す
+      （書き込み自体はI/Oスレッドで行い、イベントループは止めない）
+    """
+
+    def __init__(self, backend, dirty_threshold=STORE_DIRTY_THRESHOLD):
+        self.backend = backend
+        self.dirty_threshold = dirty_threshold
+        self._users = {}   # { guild_id: { user_id: info } }
+        self._meta = {}    # { guild_id: { key: value } }
+        self._dirty = {}   # { guild_id: { user_id: set(source) } }
+        self._meta_dirty = set()
+        self._loading = {}  # { guild_id: asyncio.Future }
+        self._ranks = {}    # { guild_id: { "total" / "weekly" / "last_week": RankIndex } }（作り直し待ちの名前は欠ける）
+        self._weekly = {}   # { guild_id: WeeklyTotals }
+
+    def _set_loaded(self, guild_id, users, meta):
+        users = {uid: UserRecord.from_dict(info) for uid, info in users.items()}
+        self._users[guild_id] = users
+        self._meta[guild_id] = meta
+        self._ranks.pop(guild_id, None)
+        self._weekly[guild_id] = WeeklyTotals(users, meta.get(WEEK_EPOCH_KEY, 0))
+
+    async def load(self, guild_id):
+        """{ user_id: info } を返す。未読み込みならI/Oスレッドで読み込む"""
+        guild_id = int(guild_id)
+        if guild_id in self._users:
+            return self._users[guild_id]
+        if guild_id in self._loading:
+            await self._loading[guild_id]
+            return self._users[guild_id]
+        future = asyncio.get_running_loop().create_future()
+        self._loading[guild_id] = future
+        try:
+            users, meta = await storage_io.run(self.backend.load_users, guild_id)
+            if guild_id not in self._users:
+                self._set_loaded(guild_id, users, meta)
+        finally:
+            del self._loading[guild_id]
+            future.set_result(None)
+        return self._users[guild_id]
+
+    async def load_user(self, guild_id, user_id):
+        """ユーザーデータを既定値つきで返す（未適用の減衰・週の繰り越しは反映済み）"""
+        await self.load(guild_id)
+        return self.user(guild_id, user_id)
+
+    def users(self, guild_id):
+        """読み込み済みの { user_id: info } を返す（返り値を直接書き換えたら mark_dirty すること）
+
+        コルーチンからは load() を使う。未読み込みの場合だけ同期で読み込む。
+        """
+        guild_id = int(guild_id)
+        if guild_id not in self._users:
+            self._set_loaded(guild_id, *self.backend.load_users(guild_id))
+        return self._users[guild_id]
+
+    def user(self, guild_id, user_id):
+        """ユーザーデータを既定値つきで返す（未適用の減衰・週の繰り越しは反映済み）"""
+        guild_id = int(guild_id)
+        user_id = str(user_id)
+        users = self.users(guild_id)
+        if user_id not in users:
+            # 新規ユーザーは今の減衰回数・週番号から始める
+            meta = self._meta[guild_id]
+            info = ensure_user_data(users, user_id)
+            info.decay_epoch = meta.get(DECAY_EPOCH_KEY, 0)
+            info.week_epoch = meta.get(WEEK_EPOCH_KEY, 0)
+            # ランキングには常に全ユーザーが入る（作り直したときと差分更新のときで顔ぶれを変えない）
+            self._update_indexes(guild_id, [user_id])
+            return info
+        info = ensure_user_data(users, user_id)
+        self._settle_decay(guild_id, user_id, info)
+        self._settle_week(guild_id, user_id, info)
+        return info
+
+    def _settle_week(self, guild_id, user_id, info):
+        """週が進んでいたら、週間カウンタを前週分として保存してからリセットする"""
+        week = self._meta[guild_id].get(WEEK_EPOCH_KEY, 0)
+        user_week = info.week_epoch
+        if user_week >= week:
+            return
+        info.last_weekly_rank = self.ranks(guild_id)["last_week"].rank(user_id) or 0
+        info.last_weekly_xp = info.weekly_xp if user_week == week - 1 else 0
+        for field, default in WEEKLY_COUNTERS.items():
+            setattr(info, field, default)
+        info.week_epoch = week
+        self.mark_dirty(guild_id, user_id, source="weekly_reset")
+
+    def advance_week(self, guild_id):
+        """週番号を1つ進める（週間リセット）。各ユーザーへの反映は次に読み書きしたとき
+
+        今週のランキングはそのまま前週のランキングになり、今週分は全員0から始まる
+        （どのインデックスにも常に全ユーザーが入っているようにする）。
+        """
+        guild_id = int(guild_id)
+        self.users(guild_id)
+        meta = self._meta[guild_id]
+        meta[WEEK_EPOCH_KEY] = meta.get(WEEK_EPOCH_KEY, 0) + 1
+        self.mark_meta_dirty(guild_id)
+        self._weekly[guild_id] = WeeklyTotals({}, meta[WEEK_EPOCH_KEY])
+        ranks = self._ranks.get(guild_id)
+        if ranks is not None:
+            keys = self._rank_keys(guild_id)
+            ranks.pop("last_week", None)
+            if "weekly" in ranks:
+                ranks["last_week"] = ranks["weekly"]
+                ranks["last_week"].key = keys["last_week"]
+            ranks["weekly"] = RankIndex(keys["weekly"], self._users[guild_id])
+
+    def reset_weekly_counters(self, guild_id):
+        """週番号は進めずに、今週の週間XP・活動日だけを0に戻す（/startbattle 用）
+
+        前週の記録（last_weekly_xp / last_weekly_rank）と日次のコイン獲得量はそのまま残す。
+        """
+        guild_id = int(guild_id)
+        users = self.users(guild_id)
+        for uid in list(users):
+            info = self.user(guild_id, uid)
+            for field, default in WEEKLY_COUNTERS.items():
+                if field != "coin_daily_earned":
+                    setattr(info, field, default)
+        self.mark_dirty(guild_id, *users, source="weekly_reset")
+
+    def _settle_decay(self, guild_id, user_id, info):
+        """サーバーの減衰回数に追いつくまでの減衰をまとめて反映する"""
+        epoch = self._meta[guild_id].get(DECAY_EPOCH_KEY, 0)
+        behind = epoch - info.decay_epoch
+        if behind <= 0:
+            return
+        info.decay_epoch = epoch
+        # XPが0なら減らすものがないので、回数だけ合わせて書き戻しは次の変更に任せる
+        if info.xp > 0:
+            info.xp = max(0, int(info.xp * (1 - DECAY_PERCENT) ** behind))
+            self.mark_dirty(guild_id, user_id, source="decay")
+
+    def meta(self, guild_id):
+        guild_id = int(guild_id)
+        self.users(guild_id)
+        return self._meta[guild_id]
+
+    def loaded_guilds(self):
+        return list(self._users.keys())
+
+    def _rank_keys(self, guild_id):
+        """インデックス名とキー関数（週間系はそのサーバーの現在の週番号で評価する）"""
+        meta = self._meta[guild_id]
+        return {
+            "total": total_xp_key,
+            "weekly": lambda info: weekly_xp_key(info, meta.get(WEEK_EPOCH_KEY, 0)),
+            "last_week": lambda info: last_weekly_xp_key(info, meta.get(WEEK_EPOCH_KEY, 0)),
+        }
+
+    def ranks(self, guild_id):
+        """読み込み済みサーバーのランキングインデックス { "total" / "weekly" / "last_week": RankIndex }
+
+        初回は全員から作り、以降は mark_dirty() のたびに変更ユーザーだけ更新する。
+        """
+        guild_id = int(guild_id)
+        users = self.users(guild_id)
+        ranks = self._ranks.setdefault(guild_id, {})
+        for name, key in self._rank_keys(guild_id).items():
+            if name not in ranks:
+                ranks[name] = RankIndex(key, users)
+        return ranks
+
+    def weekly_totals(self, guild_id):
+        """(今週の総XP, 参加人数) を返す。ファイルは読まない（未読み込みのサーバーのみ読み込む）"""
+        guild_id = int(guild_id)
+        self.users(guild_id)
+        totals = self._weekly[guild_id]
+        return totals.total, totals.active
+
+    def _update_indexes(self, guild_id, user_ids):
+        totals = self._weekly.get(guild_id)
+        if totals is not None:
+            users = self._users[guild_id]
+            for uid in user_ids:
+                totals.update(uid, users.get(uid))
+
+        ranks = self._ranks.get(guild_id)
+        if not ranks:
+            return
+        users = self._users[guild_id]
+        for name, index in list(ranks.items()):
+            changed = [uid for uid in user_ids if index.changed(uid, users.get(uid))]
+            # 一括更新などで大半のユーザーの並びが変わったインデックスだけ、次に使うときに作り直す
+            if len(changed) > max(RANK_REBUILD_MIN, len(index) // 4):
+                del ranks[name]
+                continue
+            for uid in changed:
+                info = users.get(uid)
+                if info is None:
+                    index.remove(uid)
+                else:
+                    index.update(uid, info)
+
+    def mark_dirty(self, guild_id, *user_ids, source=None):
+        """変更したユーザーを記録する。source は変更元（"message" / "vc" / "buy" など）"""
+        guild_id = int(guild_id)
+        dirty = self._dirty.setdefault(guild_id, {})
+        for uid in user_ids:
+            sources = dirty.setdefault(str(uid), set())
+            if source:
+                sources.add(source)
+        self._update_indexes(guild_id, [str(uid) for uid in user_ids])
+        if len(dirty) >= self.dirty_threshold:
+            self.flush(guild_id)
+
+    def mark_meta_dirty(self, guild_id):
+        self._meta_dirty.add(int(guild_id))
+
+    def dirty_count(self):
+        return sum(len(d) for d in self._dirty.values())
+
+    def flush(self, guild_id):
+        """変更分の書き込みをI/Oスレッドに積む"""
+        guild_id = int(guild_id)
+        dirty = self._dirty.pop(guild_id, {})
+        meta_dirty = guild_id in self._meta_dirty
+        self._meta_dirty.discard(guild_id)
+        if not dirty and not meta_dirty:
+            return
+        users = self._users[guild_id]
+        if self.backend.rewrites_all:
+            payload = (snapshot(users), snapshot(self._meta[guild_id]), dirty)
+            merge = None
+        else:
+            changed = {uid: snapshot(users[uid]) for uid in dirty if uid in users}
+            payload = (changed, snapshot(self._meta[guild_id]) if meta_dirty else None, dirty)
+            merge = merge_user_writes
+        storage_io.write(
+            ("users", guild_id),
+            lambda v: self.backend.save_users(guild_id, *v),
+            payload,
+            merge
+        )
+
+    def flush_all(self):
+        for guild_id in set(self._dirty) | set(self._meta_dirty):
+            self.flush(guild_id)
+
+    def compact(self, guild_id):
+        """ジャーナル型バックエンドのスナップショットを作り直す"""
+        guild_id = int(guild_id)
+        if not hasattr(self.backend, "compact") or guild_id not in self._users:
+            return
+        # スナップショットはI/Oスレッド側で、それまでの書き込みをすべて終えたディスクの内容から作る
+        self.flush(guild_id)
+        storage_io.write(("compact", guild_id), lambda _: self.backend.compact(guild_id), None)
+
+# =========================
+# ジャーナル（追記型）バックエンド
+# =========================
+# STORAGE_BACKEND=journal で有効化。
+# 変更はサーバーごとの *.journal に1行ずつ追記し、定期的にスナップショット（従来のJSON）へ畳み込む。
+# 起動時はスナップショットを読んでから、ジャーナルの残りを再生する。
+JOURNAL_COMPACT_INTERVAL = int(os.environ.get("JOURNAL_COMPACT_INTERVAL", "30"))  # 分
+JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+def journal_file(snapshot_path):
+    return snapshot_path[:-len(".json")] + ".journal"
 
-def save_data(guild_id, data):
+def append_journal(path, entries):
+    if not entries:
+        return
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(data_file(guild_id), "w") as f:
-        json.dump(data, f, indent=4)
+    with open(journal_file(path), "a") as f:
+        f.write("".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries))
+
+def read_journal(path):
+    jpath = journal_file(path)
+    if not os.path.exists(jpath):
+        return []
+    entries = []
+    with open(jpath, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 書き込み途中で落ちた最終行は捨てる
+                break
+    return entries
+
+def journal_size(path):
+    jpath = journal_file(path)
+    return os.path.getsize(jpath) if os.path.exists(jpath) else 0
+
+class JournalBackend(JsonBackend):
+    """スナップショット（levels_{gid}.json など）＋追記ジャーナルで保存するバックエンド
+
+    ジャーナルの1行は変更後のユーザーレコード（またはボスの差分）なので、
+    同じ行を2回再生しても結果は変わらない。
+    """
+
+    rewrites_all = False
+
+    def __init__(self):
+        # 最後に書いたボス状態 { (path): boss }（差分を取るため & コンパクション用）
+        self._boss_state = {}
+
+    # ---- users ----
+    def load_users(self, guild_id):
+        users, meta = super().load_users(guild_id)
+        for entry in read_journal(data_file(guild_id)):
+            if entry.get("op") == "user":
+                users[entry["uid"]] = entry["v"]
+            elif entry.get("op") == "meta":
+                meta.update(entry["v"])
+        return users, meta
+
+    def save_users(self, guild_id, users, meta, dirty_uids):
+        ts = now_ts()
+        entries = [
+            {"op": "user", "t": ts, "uid": uid, "src": sorted(dirty_uids[uid]), "v": users[uid]}
+            for uid in dirty_uids if uid in users
+        ]
+        if meta is not None:
+            entries.append({"op": "meta", "t": ts, "v": meta})
+        append_journal(data_file(guild_id), entries)
+
+    def compact(self, guild_id):
+        """スナップショット＋ジャーナルを読み直して1つのスナップショットに畳み込む（I/Oスレッドで呼ぶ）
+
+        メモリ上の状態ではなくディスク上の内容から作るので、
+        それまでにジャーナルへ追記された書き込みはすべてスナップショットに入る。
+        """
+        users, meta = self.load_users(guild_id)
+        write_json_atomic(data_file(guild_id), {**users, **meta})
+        open(journal_file(data_file(guild_id)), "w").close()
+        for path in (boss_file(guild_id), event_boss_file(guild_id)):
+            if path in self._boss_state:
+                write_json_atomic(path, ranked_damage(self._boss_state[path]))
+                open(journal_file(path), "w").close()
+
+    def needs_compaction(self, guild_id):
+        return any(
+            journal_size(path) >= JOURNAL_COMPACT_BYTES
+            for path in (data_file(guild_id), boss_file(guild_id), event_boss_file(guild_id))
+        )
+
+    # ---- boss / event boss ----
+    def _load_boss(self, path, default):
+        boss = read_json(path, default)
+        for entry in read_journal(path):
+            boss.update(entry["v"])
+            damage = boss.setdefault("damage", {})
+            if entry.get("reset"):
+                damage.clear()
+            damage.update(entry.get("damage", {}))
+        self._boss_state[path] = json.loads(json.dumps(boss))
+        return boss
+
+    def _save_boss(self, path, boss):
+        saved = self._boss_state.get(path)
+        damage = boss.get("damage", {})
+        fields = {k: v for k, v in boss.items() if k != "damage"}
+        saved_damage = saved.get("damage", {}) if saved else {}
+        reset = saved is None or any(uid not in damage for uid in saved_damage)
+        if reset:
+            changed = dict(damage)
+        else:
+            changed = {uid: dmg for uid, dmg in damage.items() if saved_damage.get(uid) != dmg}
+        entry = {"op": "boss", "t": now_ts(), "v": fields, "damage": changed}
+        if reset:
+            entry["reset"] = True
+        append_journal(path, [entry])
+        self._boss_state[path] = {**fields, "damage": dict(damage)}
+
+    def load_boss(self, guild_id):
+        return self._load_boss(boss_file(guild_id), default_boss())
+
+    def save_boss(self, guild_id, boss):
+        self._save_boss(boss_file(guild_id), boss)
+
+    def load_event_boss(self, guild_id):
+        return self._load_boss(event_boss_file(guild_id), default_event_boss())
+
+    def save_event_boss(self, guild_id, boss):
+        self._save_boss(event_boss_file(guild_id), boss)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+
+def create_backend():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend()
+    if STORAGE_BACKEND == "journal":
+        return JournalBackend()
+    return JsonBackend()
+
+store = GuildStore(create_backend())
 # =========================
 # Coin / Buff helpers
 # =========================
 def now_ts():
     return int(time.time())
 
+# =========================
+# ユーザーレコード（__slots__ で項目を固定）
+# =========================
+# 項目名と既定値（保存形式の dict のキーと同じ）。buffs は使うまで None のまま持つ
+USER_FIELDS = {
+    "xp": 0,
+    "level": 1,
+    "last_daily": "",
+    "weekly_xp": 0,
+    "login_streak": 0,
+    "weekly_chat_xp": 0,
+    "weekly_vc_xp": 0,
+    "weekly_active_days": 0,
+    "last_weekly_xp": 0,
+    "last_weekly_rank": 0,
+    "coins": 0,
+    "buffs": None,
+    "coin_daily_earned": 0,
+    "coin_total_spent": 0,
+    DECAY_EPOCH_KEY: 0,
+    WEEK_EPOCH_KEY: 0,
+}
+
+# weekly_active_days はメモリ上では (最初のアクティブ日の通し番号 << 8) | その日から何日目かのビット の int で持つ。
+# 週の区切りは月曜18時なので1週に日付は最大8日（月〜翌月）あり、8ビットで両方の月曜を区別できる。
+# 保存形式は従来どおり "YYYY-MM-DD" のリスト。
+ACTIVE_DAY_SPAN = 8
+
+def add_active_day(value, day):
+    """weekly_active_days の値に日付（date または "YYYY-MM-DD"）を足した値を返す
+
+    8日の範囲に収まらない場合は、新しい日付が入るように古い側の日を捨てる。
+    """
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    n = day.toordinal()
+    if not value:
+        return (n << 8) | 1
+    base, bits = value >> 8, value & 0xFF
+    if n < base:
+        bits = (bits << (base - n)) & 0xFF
+        base = n
+    elif n - base >= ACTIVE_DAY_SPAN:
+        shift = n - base - (ACTIVE_DAY_SPAN - 1)
+        bits >>= shift
+        base += shift
+    return (base << 8) | bits | (1 << (n - base))
+
+def current_week_start(now=None):
+    """今の週（週間ランキングと同じ月曜18時 JST 区切り）が始まった月曜の日付"""
+    now = (now or datetime.now(JST)).astimezone(JST)
+    day = now.date() - timedelta(days=now.weekday())
+    if now < jst_at(day, 18):
+        day -= timedelta(days=7)
+    return day
+
+def decode_active_days(value, now=None):
+    """保存形式の weekly_active_days（日付文字列のリスト）をメモリ上の int にする
+
+    一時期の保存形式だった曜日だけの7ビットマスク（月曜=1）は、今の週のその曜日の日付として読む。
+    """
+    if isinstance(value, int):
+        if value >> 8:
+            return value
+        start = current_week_start(now)
+        encoded = 0
+        for weekday in range(7):
+            if value >> weekday & 1:
+                encoded = add_active_day(encoded, start + timedelta(days=weekday))
+        return encoded
+    encoded = 0
+    for day in value:
+        encoded = add_active_day(encoded, day)
+    return encoded
+
+def encode_active_days(value):
+    """メモリ上の weekly_active_days を保存形式（日付文字列のリスト）に戻す"""
+    if not value:
+        return []
+    base, bits = value >> 8, value & 0xFF
+    return [date.fromordinal(base + i).isoformat() for i in range(ACTIVE_DAY_SPAN) if bits >> i & 1]
+
+class UserRecord:
+    """1ユーザー分のデータ
+
+    ・USER_FIELDS の項目は __slots__ の属性（info.xp）で持ち、それ以外の項目は extra に入れる
+    ・weekly_active_days はその週のアクティブ日を int にまとめて持つ（保存時は従来の日付リストに戻す）
+    ・既存の処理のため info["xp"] / info.get("xp") の dict 形式でも読み書きできる
+    ・保存は to_dict()（snapshot() が呼ぶ）、読み込みは from_dict() で従来の dict と相互に変換する
+    """
+
+    __slots__ = (*USER_FIELDS, "extra")
+
+    def __init__(self):
+        for field, default in USER_FIELDS.items():
+            setattr(self, field, default)
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, raw):
+        record = cls()
+        for key, value in raw.items():
+            record[key] = value
+        return record
+
+    def to_dict(self):
+        raw = {field: getattr(self, field) for field in USER_FIELDS}
+        raw["weekly_active_days"] = encode_active_days(self.weekly_active_days)
+        if raw["buffs"] is None:
+            raw["buffs"] = {}
+        if self.extra:
+            raw.update(self.extra)
+        return raw
+
+    def mark_active_day(self, day):
+        """その日をアクティブ日として記録する。新しく記録したら True"""
+        value = add_active_day(self.weekly_active_days, day)
+        if value == self.weekly_active_days:
+            return False
+        self.weekly_active_days = value
+        return True
+
+    def active_day_count(self):
+        return bin(self.weekly_active_days & 0xFF).count("1")
+
+    # ---- dict 互換 ----
+    def __getitem__(self, key):
+        if key in USER_FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                value = self.buffs = {}
+            return value
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "weekly_active_days":
+            self.weekly_active_days = decode_active_days(value)
+        elif key in USER_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in USER_FIELDS or bool(self.extra and key in self.extra)
+
+    def get(self, key, default=None):
+        if key in USER_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def setdefault(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            self[key] = value = default
+        return value
+
 def ensure_user_data(data, user_id):
-    if user_id not in data:
-        data[user_id] = {}
-
-    info = data[user_id]
-    info.setdefault("xp", 0)
-    info.setdefault("level", 1)
-    info.setdefault("last_daily", "")
-    info.setdefault("weekly_xp", 0)
-    info.setdefault("login_streak", 0)
-    info.setdefault("weekly_chat_xp", 0)
-    info.setdefault("weekly_vc_xp", 0)
-    info.setdefault("weekly_active_days", [])
-    info.setdefault("last_weekly_xp", 0)
-    info.setdefault("last_weekly_rank", 0)
-    info.setdefault("coins", 0)
-    info.setdefault("buffs", {})
-    info.setdefault("coin_daily_earned", 0)
-    info.setdefault("coin_total_spent", 0)
+    """ユーザーのレコードを返す（なければ既定値で作る）"""
+    info = data.get(user_id)
+    if info is None:
+        info = data[user_id] = UserRecord()
     return info
 
 def spend_coins(data, user_id, amount, reason="spend"):
@@ -313,14 +1766,16 @@ def spend_coins(data, user_id, amount, reason="spend"):
     return True
 
 def cleanup_expired_buffs(info):
+    buffs = info.get("buffs")
+    if not buffs:
+        return
     current = now_ts()
-    buffs = info.setdefault("buffs", {})
     expired = [key for key, buff in buffs.items() if buff.get("expires_at", 0) <= current]
     for key in expired:
         del buffs[key]
 
 def add_timed_buff(info, buff_type, value, duration_seconds, item_id):
-    cleanup_expired_buffs(info)
+    """バフを付与（同じ種類が有効なら期限を延長）し、その期限を返す"""
     current = now_ts()
     buffs = info.setdefault("buffs", {})
     old = buffs.get(buff_type)
@@ -332,24 +1787,266 @@ def add_timed_buff(info, buff_type, value, duration_seconds, item_id):
         "expires_at": expires_at,
         "item_id": item_id,
     }
+    return expires_at
+
+# メッセージ処理で使うバフの効果と、次にどれかのバフが切れる時刻
+BuffEffects = namedtuple("BuffEffects", ["xp_multiplier", "crit_bonus", "boss_damage_multiplier", "next_expiry"])
+NO_BUFFS = BuffEffects(1.0, False, 1.0, math.inf)
+
+def compute_buff_effects(info):
+    """期限切れを掃除し、有効なバフから BuffEffects を作る"""
+    cleanup_expired_buffs(info)
+    buffs = info.get("buffs")
+    if not buffs:
+        return NO_BUFFS
+    return BuffEffects(
+        buffs.get("xp_multiplier", {}).get("value", 1.0),
+        bool(buffs.get("crit_bonus")),
+        buffs.get("boss_damage_multiplier", {}).get("value", 1.0),
+        min(buff.get("expires_at", 0) for buff in buffs.values()),
+    )
+
+class BuffEngine:
+    """サーバー内ユーザーのバフ効果を前計算して持つ（アクター内で使う）
+
+    作り直すのは next_expiry を過ぎたときと、invalidate()（バフ購入）のときだけ。
+    バフのないユーザー（NO_BUFFS）は持たないので、有効なバフがある人数分しか溜まらない。
+    """
+
+    def __init__(self):
+        self._effects = {}  # { user_id: BuffEffects }（NO_BUFFS 以外）
+
+    def effects(self, user_id, info):
+        effects = self._effects.get(user_id)
+        if effects is None or effects.next_expiry <= now_ts():
+            effects = compute_buff_effects(info)
+            if effects is NO_BUFFS:
+                self._effects.pop(user_id, None)
+            else:
+                self._effects[user_id] = effects
+        return effects
+
+    def invalidate(self, user_id):
+        self._effects.pop(user_id, None)
 
 # =========================
 # Boss read/write（サーバーごと）
 # =========================
-def load_boss(guild_id):
-    path = boss_file(guild_id)
-    if not os.path.exists(path):
-        return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "week": 0, "cleared": 0}
-    with open(path, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "week": 0, "cleared": 0}
+def default_boss():
+    return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "week": 0, "cleared": 0}
+
+def ranked_damage(boss):
+    """damage をランキング順に並べ直したボスのコピー（ファイルに書き出すときにI/Oスレッドで使う）
+
+    次回起動時はほぼ整列済みの順で読み込めるので、RankIndex の作成が速い。
+    """
+    damage = boss.get("damage", {})
+    return {**boss, "damage": dict(sorted(damage.items(), key=lambda kv: (-kv[1], kv[0])))}
+
+async def load_boss(guild_id):
+    return await storage_io.read(("boss", guild_id), store.backend.load_boss, guild_id)
 
 def save_boss(guild_id, boss):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(boss_file(guild_id), "w") as f:
-        json.dump(boss, f, indent=4)
+    storage_io.write(("boss", guild_id), lambda b: store.backend.save_boss(guild_id, b), snapshot(boss))
+
+# =========================
+# サーバーごとの状態アクター
+# =========================
+class GuildActor:
+    """サーバー1つにつき1つのタスクで、XP・ダメージ・コインの変更を順番に適用する
+
+    ハンドラは submit(fn) で変更関数を積むだけ。fn(actor) は同期関数で途中に await を挟まないので、
+    同じサーバーの変更同士が互いに上書きし合うことはない。
+    ユーザーデータ・週ボス・イベントボスはメモリ上の1つの状態を共有し、読み直さない。
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.users = None
+        self.boss = None
+        self.event_boss = None
+        self.boss_dirty = False
+        self.event_boss_dirty = False
+        self.boss_index = None        # 週ボスのダメージランキング（RankIndex）
+        self.event_boss_index = None  # イベントボスのダメージランキング
+        self.buff_engine = BuffEngine()
+        self._mailbox = asyncio.Queue()
+        self._task = None
+        self._inflight = None  # メールボックスから取り出して、まだ適用していない fn
+
+    async def ensure_loaded(self):
+        if self.users is not None:
+            return
+        users = await store.load(self.guild_id)
+        boss = await load_boss(self.guild_id)
+        event_boss = await load_event_boss(self.guild_id)
+        if self.users is None:
+            self.users = users
+            self.boss = boss
+            self.event_boss = event_boss
+            self.boss_index = damage_rank_index(boss)
+            self.event_boss_index = damage_rank_index(event_boss)
+
+    def load_sync(self):
+        """終了時用：ensure_loaded() をイベントループなしで行う"""
+        if self.users is not None:
+            return
+        gid = self.guild_id
+        self.users = store.users(gid)
+        self.boss = storage_io.read_sync(("boss", gid), store.backend.load_boss, gid)
+        self.event_boss = storage_io.read_sync(("event_boss", gid), store.backend.load_event_boss, gid)
+        self.boss_index = damage_rank_index(self.boss)
+        self.event_boss_index = damage_rank_index(self.event_boss)
+
+    def drain(self):
+        """終了時用：メールボックスに残った fn をすべて適用する（結果の Future には何も返さない）"""
+        fns = [self._inflight] if self._inflight is not None else []
+        self._inflight = None
+        while not self._mailbox.empty():
+            fn, _ = self._mailbox.get_nowait()
+            fns.append(fn)
+        if not fns:
+            return
+        self.load_sync()
+        for fn in fns:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"[shutdown] guild {self.guild_id}: {e}")
+
+    def submit(self, fn):
+        """fn(actor) をメールボックスに積む。結果を受け取る asyncio.Future を返す"""
+        future = asyncio.get_running_loop().create_future()
+        self._mailbox.put_nowait((fn, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self):
+        while True:
+            fn, future = await self._mailbox.get()
+            # 読み込み待ちの間に止められても、終了時の drain() で適用できるように残しておく
+            self._inflight = fn
+            try:
+                await self.ensure_loaded()
+                self._inflight = None
+                result = fn(self)
+            except Exception as e:
+                self._inflight = None
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    # ---- 以下は fn の中から呼ぶ同期ヘルパー ----
+    def user(self, user_id):
+        return store.user(self.guild_id, user_id)
+
+    def set_boss(self, boss):
+        self.boss = boss
+        self.boss_index = damage_rank_index(boss)
+        self.boss_dirty = True
+        self.flush()
+
+    def set_event_boss(self, event_boss):
+        self.event_boss = event_boss
+        self.event_boss_index = damage_rank_index(event_boss)
+        self.event_boss_dirty = True
+        self.flush()
+
+    def update_boss(self, **fields):
+        self.boss.update(fields)
+        if "damage" in fields:
+            self.boss_index = damage_rank_index(self.boss)
+        self.boss_dirty = True
+        self.flush()
+
+    def update_event_boss(self, **fields):
+        self.event_boss.update(fields)
+        if "damage" in fields:
+            self.event_boss_index = damage_rank_index(self.event_boss)
+        self.event_boss_dirty = True
+        self.flush()
+
+    def damage_index(self, boss):
+        """ボスのダメージランキング。現在のボスなら維持中のインデックスを、それ以外はその場で作って返す"""
+        if boss is self.boss:
+            return self.boss_index
+        if boss is self.event_boss:
+            return self.event_boss_index
+        return damage_rank_index(boss)
+
+    def damage_boss(self, user_id, amount):
+        """週ボスにダメージ。討伐したらTrue"""
+        boss = self.boss
+        if not boss.get("active"):
+            return False
+        boss["damage"][user_id] = boss["damage"].get(user_id, 0) + amount
+        self.boss_index.update(user_id, boss["damage"][user_id])
+        boss["hp"] = max(0, boss["hp"] - amount)
+        self.boss_dirty = True
+        if boss["hp"] <= 0:
+            boss["active"] = False
+            boss["cleared"] += 1
+            self.flush()
+            return True
+        return False
+
+    def damage_event_boss(self, user_id, amount):
+        """イベントボスにダメージ。討伐したらTrue"""
+        event_boss = self.event_boss
+        if not event_boss.get("active"):
+            return False
+        event_boss["damage"][user_id] = event_boss["damage"].get(user_id, 0) + amount
+        self.event_boss_index.update(user_id, event_boss["damage"][user_id])
+        event_boss["hp"] = max(0, event_boss["hp"] - amount)
+        self.event_boss_dirty = True
+        if event_boss["hp"] <= 0:
+            event_boss["active"] = False
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """ボス状態の変更をI/Oスレッドに積む（ユーザーデータは GuildStore が書き戻す）
+
+        damage の並べ直しは書き出し時にI/Oスレッド側で行う（ranked_damage）。
+        """
+        if self.boss_dirty:
+            save_boss(self.guild_id, self.boss)
+            self.boss_dirty = False
+        if self.event_boss_dirty:
+            save_event_boss(self.guild_id, self.event_boss)
+            self.event_boss_dirty = False
+
+def damage_rank_index(boss):
+    """boss["damage"] からダメージランキングの RankIndex を作る（保存順が整列済みならほぼ O(n)）"""
+    return RankIndex(int, boss.get("damage", {}))
+
+guild_actors = {}  # { guild_id: GuildActor }
+
+def guild_actor(guild_id):
+    guild_id = int(guild_id)
+    actor = guild_actors.get(guild_id)
+    if actor is None:
+        actor = guild_actors[guild_id] = GuildActor(guild_id)
+    return actor
+
+async def guild_state(guild_id):
+    """読み取り用：読み込み済みのアクター（.users / .boss / .event_boss）を返す"""
+    actor = guild_actor(guild_id)
+    await actor.ensure_loaded()
+    return actor
+
+def flush_guild_actors():
+    for actor in guild_actors.values():
+        actor.flush()
+
+def drain_guild_actors():
+    """終了時用：各アクターのメールボックスに残った変更を適用する"""
+    for actor in guild_actors.values():
+        actor.drain()
 
 # =========================
 # Flask keep alive
@@ -391,72 +2088,377 @@ weekly_roles = {
     3: "🥉週間三位"
 }
 
+# ランクロールの二分探索用（rank_roles は下限レベル順に並んでいる）
+RANK_ROLE_MIN_LEVELS = [min_lv for min_lv, _, _ in rank_roles]
+RANK_ROLE_NAMES = frozenset(role_name for _, _, role_name in rank_roles)
+
+def rank_role_name(level):
+    """レベルに対応するランクロール名（該当なしなら None）"""
+    i = bisect.bisect_right(RANK_ROLE_MIN_LEVELS, level) - 1
+    if i < 0:
+        return None
+    _, max_lv, role_name = rank_roles[i]
+    return role_name if level <= max_lv else None
+
 # =========================
-# Rank Role Updater
+# ロール名インデックス（サーバーごと）
 # =========================
-async def update_rank_role(member, level):
-    guild = member.guild
+# { guild_id: { ロール名: role_id } }  同名ロールは discord.utils.get と同じく guild.roles の先頭を使う
+guild_role_ids = {}
+
+def role_index(guild):
+    index = guild_role_ids.get(guild.id)
+    if index is None:
+        index = guild_role_ids[guild.id] = {}
+        for role in guild.roles:
+            index.setdefault(role.name, role.id)
+    return index
+
+def get_role(guild, name):
+    """ロール名からロールを返す（見つからなければ None）"""
+    role_id = role_index(guild).get(name)
+    return guild.get_role(role_id) if role_id else None
 
-    target_role = None
-    for min_lv, max_lv, role_name in rank_roles:
-        if min_lv <= level <= max_lv:
-            target_role = discord.utils.get(guild.roles, name=role_name)
-            break
+@bot.event
+async def on_guild_role_create(role):
+    if role.guild.id in guild_role_ids:
+        guild_role_ids[role.guild.id].setdefault(role.name, role.id)
 
-    current_rank_role = None
-    for role in member.roles:
-        for _, _, r_name in rank_roles:
-            if role.name == r_name:
-                current_rank_role = role
-                break
+@bot.event
+async def on_guild_role_update(before, after):
+    # 名前変更や並び替えで同名ロールの優先順が変わりうるので、そのサーバーだけ作り直す
+    guild_role_ids.pop(after.guild.id, None)
 
-    if current_rank_role == target_role:
-        return
-    if current_rank_role:
-        await member.remove_roles(current_rank_role)
-    if target_role:
-        await member.add_roles(target_role)
+@bot.event
+async def on_guild_role_delete(role):
+    guild_role_ids.pop(role.guild.id, None)
+
+# =========================
+# Rank Role Updater
+# =========================
+def rank_role_diff(member, level):
+    """(付与するロール or None, 外すランクロールのリスト) を返す。ロールを変える必要がなければ (None, [])"""
+    target_name = rank_role_name(level)
+    target_role = get_role(member.guild, target_name) if target_name else None
+    to_remove = [role for role in member.roles if role.name in RANK_ROLE_NAMES and role != target_role]
+    to_add = target_role if target_role and target_role not in member.roles else None
+    return to_add, to_remove
+
+async def update_rank_role(member, level):
+    """ランクロールを目標に合わせる。APIを呼んだら True"""
+    to_add, to_remove = rank_role_diff(member, level)
+    if to_remove:
+        await member.remove_roles(*to_remove)
+    if to_add:
+        await member.add_roles(to_add)
+    return bool(to_add or to_remove)
 
 # =========================
 # Level-up check
 # =========================
-async def check_level_up(member, data, user_id):
+# Lv L に到達するまでの累計必要XP（100 + 200 + … + 100(L-1)）
+def level_total_xp(level):
+    return 50 * level * (level - 1)
+
+def level_for_total_xp(total):
+    """累計XPから到達レベルを求める（level_total_xp(L) <= total を満たす最大のL）"""
+    return (math.isqrt(4 * (total // 50) + 1) + 1) // 2
+
+# レベルアップコインは 100 + 10×レベル、Lv40 以降は上限の500
+LEVEL_COIN_CAP_LEVEL = 40
+
+def level_coins_total(level):
+    """Lv2 〜 Lv level 到達時にもらえるレベルアップコインの合計"""
+    capped = min(level, LEVEL_COIN_CAP_LEVEL)
+    total = 100 * (capped - 1) + 5 * (capped * (capped + 1) - 2)
+    return total + 500 * max(0, level - LEVEL_COIN_CAP_LEVEL)
+
+def apply_level_ups(info):
+    """必要XPに達していれば最終レベルまで一度に上げる
+
+    (旧レベル, 新レベル, 獲得コイン合計) を返す。レベルが上がらなければ None。
+    """
+    old_level = info.level
+    if info.xp < old_level * 100:
+        return None
+    total = level_total_xp(old_level) + info.xp
+    new_level = level_for_total_xp(total)
+    coin_reward = level_coins_total(new_level) - level_coins_total(old_level)
+    info.level = new_level
+    info.xp = total - level_total_xp(new_level)
+    info.coins += coin_reward
+    return old_level, new_level, coin_reward
+
+async def announce_level_up(member, level_up):
+    """apply_level_ups() の結果をもとにロール更新・通知をまとめて1回ずつ行う"""
+    old_level, new_level, coin_reward = level_up
     guild = member.guild
     ch_id = get_level_channel_id(guild.id)
     notify_channel = guild.get_channel(ch_id) if ch_id else None
 
-    while True:
-        current_xp = data[user_id]["xp"]
-        current_level = data[user_id]["level"]
-        required_xp = current_level * 100
+    await update_rank_role(member, new_level)
 
-        if current_xp < required_xp:
-            break
+    # 飛び越えたレベルの永続ロールもまとめて付与
+    roles = [
+        get_role(guild, permanent_roles[lv])
+        for lv in sorted(permanent_roles) if old_level < lv <= new_level
+    ]
+    roles = [role for role in roles if role]
+    if roles:
+        await member.add_roles(*roles)
 
-        data[user_id]["xp"] -= required_xp
-        data[user_id]["level"] += 1
-        new_level = data[user_id]["level"]
+    if not notify_channel:
+        return
+    digest = get_digest(guild.id, notify_channel)
+    if digest:
+        role_text = f" 📸 {'・'.join(role.name for role in roles)}" if roles else ""
+        digest.add_level_up(member.id, f"{member.mention} Lv{old_level} → Lv{new_level} 💰 +{coin_reward}{role_text}")
+        return
 
-        await update_rank_role(member, new_level)
+    jump = f"（Lv{old_level} → Lv{new_level}）" if new_level - old_level > 1 else ""
+    outbox_send(
+        notify_channel, f"🎉 {member.mention} が Lv{new_level} になりました！{jump} 💰 +{coin_reward}コイン",
+        priority=PRIORITY_LEVEL
+    )
+    if roles:
+        outbox_send(notify_channel, f"📸 {'・'.join(role.name for role in roles)} を獲得しました！", priority=PRIORITY_LEVEL)
 
-        # レベルアップコイン付与（レベルに応じて増加、最大500）
-        coin_reward = min(100 + (new_level * 10), 500)
-        info = ensure_user_data(data, user_id)
-        info["coins"] = info.get("coins", 0) + coin_reward
+# =========================
+# XP付与（アクター内で適用）
+# =========================
+def apply_xp(actor, user_id, gain, source, boss_damage=None):
+    """XP付与・レベルアップ・ボスダメージをまとめて適用し、結果を返す
+
+    source は "message" / "vc"。boss_damage を省略すると週ボスにも gain をそのまま与える。
+    """
+    info = actor.user(user_id)
+    info.xp += gain
+    info.weekly_xp += gain
+    if source == "message":
+        info.weekly_chat_xp += gain
+    elif source == "vc":
+        info.weekly_vc_xp += gain
+
+    level_up = apply_level_ups(info)
+    store.mark_dirty(actor.guild_id, user_id, source=source)
+    if level_up:
+        store.mark_dirty(actor.guild_id, user_id, source="level_up")
+
+    boss_cleared = actor.damage_boss(user_id, gain if boss_damage is None else boss_damage)
+    event_boss_cleared = actor.damage_event_boss(user_id, gain)
+    return {
+        "level_up": level_up,
+        "boss": actor.boss if boss_cleared else None,
+        "event_boss": actor.event_boss if event_boss_cleared else None,
+    }
 
-        if notify_channel:
-            try:
-                await notify_channel.send(f"🎉 {member.mention} が Lv{new_level} になりました！ 💰 +{coin_reward}コイン")
-            except discord.DiscordServerError:
-                pass
+async def handle_xp_result(member, result):
+    """apply_xp() の結果の通知・討伐処理を行う"""
+    if result["level_up"]:
+        await announce_level_up(member, result["level_up"])
+    if result["boss"]:
+        await handle_boss_clear(member.guild, result["boss"])
+    if result["event_boss"]:
+        await handle_event_boss_clear(member.guild, result["event_boss"])
 
-        if new_level in permanent_roles:
-            role_name = permanent_roles[new_level]
-            role = discord.utils.get(guild.roles, name=role_name)
-            if role:
-                await member.add_roles(role)
-                if notify_channel:
-                    await notify_channel.send(f"📸 {role_name} を獲得しました！")
+def apply_login_bonus(actor, user_id):
+    """アクティブ日数を記録し、その日最初のメッセージならログインボーナスを付与する
+
+    ボーナスを付与した場合はその内容を、それ以外は None を返す。
+    """
+    info = actor.user(user_id)
+
+    # アクティブ日数を記録
+    if info.mark_active_day(datetime.now(JST).date()):
+        store.mark_dirty(actor.guild_id, user_id, source="message")
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    if info.last_daily == today:
+        return None
+
+    if info.last_daily == yesterday:
+        info.login_streak += 1
+    else:
+        info.login_streak = 1
+
+    streak = info.login_streak
+
+    if streak == 1:
+        bonus = 100
+    elif streak == 2:
+        bonus = 200
+    elif streak == 3:
+        bonus = 300
+    elif streak == 4:
+        bonus = 500
+    else:
+        bonus = 1000
+
+    info.xp += bonus
+    info.weekly_xp += bonus
+    info.last_daily = today
+
+    # ログインボーナスでボスにダメージ
+    boss_cleared = actor.damage_boss(user_id, bonus)
+
+    # ストリークボーナスコイン（100 + streak * 20、上限500）
+    streak_coins = min(100 + (streak * 20), 500)
+    today_earned = info.coin_daily_earned
+    if today_earned < COIN_DAILY_CAP:
+        add_amount = min(streak_coins, COIN_DAILY_CAP - today_earned)
+        info.coins += add_amount
+        info.coin_daily_earned = today_earned + add_amount
+    else:
+        streak_coins = 0
+
+    store.mark_dirty(actor.guild_id, user_id, source="login_bonus")
+    return {
+        "streak": streak,
+        "bonus": bonus,
+        "streak_coins": streak_coins,
+        "boss": actor.boss if boss_cleared else None,
+    }
+
+def active_buffs(actor, user_id):
+    """有効なバフのコピーを返す（期限切れは BuffEngine が作り直すときに掃除済み）"""
+    info = actor.user(user_id)
+    actor.buff_engine.effects(user_id, info)
+    return dict(info["buffs"])
+
+def roll_message_xp(actor, user_id, boost_multiplier):
+    """メッセージ1件分のログボ・バフ・クリティカルを判定し、付与するXPとボスダメージを返す"""
+    login = apply_login_bonus(actor, user_id)
+
+    # ショップバフ適用（xp_multiplier・crit_bonus・boss_damage_multiplier）
+    effects = actor.buff_engine.effects(user_id, actor.user(user_id))
+
+    base_xp = int(random.randint(5, 20) * boost_multiplier * effects.xp_multiplier)
+    xp_gain, crit_name, crit_multi = calc_crit(base_xp, effects.crit_bonus)
+    return {
+        "login": login,
+        "xp_gain": xp_gain,
+        "boss_damage": int(xp_gain * effects.boss_damage_multiplier),
+        "crit_name": crit_name,
+        "crit_multi": crit_multi,
+    }
+
+def apply_message(actor, user_id, boost_multiplier):
+    """メッセージ1件分の処理（ログボ・バフ・クリティカル・XP・ボスダメージ）を1回で適用する
+
+    同じメモリ上の状態だけを使い、ユーザーは1回の mark_dirty でまとめて書き戻す。
+    """
+    roll = roll_message_xp(actor, user_id, boost_multiplier)
+    result = apply_xp(actor, user_id, roll["xp_gain"], "message", boss_damage=roll["boss_damage"])
+
+    # ログボで討伐した場合も同じ結果にまとめる（討伐後のボスは非アクティブなので重複しない）
+    if roll["login"] and roll["login"]["boss"]:
+        result["boss"] = roll["login"]["boss"]
+    result.update(roll)
+    return result
+
+def apply_xp_batch(actor, entries):
+    """(user_id, source, value) のまとまりを適用し、entries と同じ順の結果リストを返す
+
+    value は "message" ならブースト倍率、"vc" なら付与XP。
+    XP・週間XP・レベルアップ・ボスHPはユーザー×ソースごとに合算して1回だけ計算し、
+    その結果はそのまとまりの最後のエントリに載せる。
+    """
+    results = []
+    totals = {}  # { (user_id, source): [xp, boss_damage, 最後のエントリ番号] }
+    for i, (user_id, source, value) in enumerate(entries):
+        if source == "message":
+            roll = roll_message_xp(actor, user_id, value)
+            gain, damage = roll["xp_gain"], roll["boss_damage"]
+            login_boss = roll["login"]["boss"] if roll["login"] else None
+            results.append(dict(roll, level_up=None, boss=login_boss, event_boss=None))
+        else:
+            gain = damage = value
+            results.append({"level_up": None, "boss": None, "event_boss": None})
+        total = totals.setdefault((user_id, source), [0, 0, i])
+        total[0] += gain
+        total[1] += damage
+        total[2] = i
+
+    for (user_id, source), (gain, damage, last) in totals.items():
+        applied = apply_xp(actor, user_id, gain, source, boss_damage=damage)
+        result = results[last]
+        result["level_up"] = applied["level_up"]
+        result["boss"] = result["boss"] or applied["boss"]
+        result["event_boss"] = applied["event_boss"]
+    return results
+
+# =========================
+# XPのまとめ適用（マイクロバッチ）
+# =========================
+# XP加算をまとめて適用する間隔（ミリ秒）。0 なら1件ずつ即時に適用する
+XP_BATCH_MS = int(os.environ.get("XP_BATCH_MS", "0"))
+
+class XpAccumulator:
+    """サーバーごとにXP加算を溜め、XP_BATCH_MS ごとにアクターへ1回で適用する"""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.entries = []
+        self.futures = []
+        self._timer = None
+
+    def push(self, user_id, source, value):
+        """エントリを積み、そのエントリの結果を受け取る asyncio.Future を返す"""
+        future = asyncio.get_running_loop().create_future()
+        self.entries.append((user_id, source, value))
+        self.futures.append(future)
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._commit_later())
+        return future
+
+    def take(self):
+        entries, futures = self.entries, self.futures
+        self.entries, self.futures = [], []
+        return entries, futures
+
+    async def _commit_later(self):
+        await asyncio.sleep(XP_BATCH_MS / 1000)
+        self._timer = None
+        entries, futures = self.take()
+        try:
+            results = await guild_actor(self.guild_id).submit(lambda st: apply_xp_batch(st, entries))
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+xp_accumulators = {}  # { guild_id: XpAccumulator }
+
+def submit_xp(guild_id, user_id, source, value):
+    """XP加算を積み、結果の Future を返す（value の意味は apply_xp_batch と同じ）
+
+    XP_BATCH_MS が 0 のときはアクターに1件ずつ即時に適用する。
+    """
+    if XP_BATCH_MS <= 0:
+        if source == "message":
+            return guild_actor(guild_id).submit(lambda st: apply_message(st, user_id, value))
+        return guild_actor(guild_id).submit(lambda st: apply_xp(st, user_id, value, source))
+
+    guild_id = int(guild_id)
+    accumulator = xp_accumulators.get(guild_id)
+    if accumulator is None:
+        accumulator = xp_accumulators[guild_id] = XpAccumulator(guild_id)
+    return accumulator.push(user_id, source, value)
+
+def flush_xp_accumulators():
+    """終了時用：まだ適用していないエントリをアクターへ直接適用する（未読み込みなら同期で読み込む）"""
+    for guild_id, accumulator in xp_accumulators.items():
+        entries, _ = accumulator.take()
+        if entries:
+            actor = guild_actor(guild_id)
+            actor.load_sync()
+            apply_xp_batch(actor, entries)
 
 # =========================
 # Message XP
@@ -476,14 +2478,10 @@ async def on_message(message):
     # スパムガード（XPブロック）
     # 10秒以内に3メッセージ以上でXP無効
     # =========================
-    times = spam_message_times.setdefault(ck, [])
-    times.append(current_time)
-    spam_message_times[ck] = [t for t in times if current_time - t <= 10]
-    xp_blocked = len(spam_message_times[ck]) >= 3
+    xp_blocked = spam_message_times.hit(ck, current_time) >= SPAM_MAX_MESSAGES
 
     # XP獲得チャンネル制限チェック（設定済みの場合のみ対象チャンネルでXP付与）
-    xp_channels = get_xp_channel_ids(guild_id)
-    if xp_channels and message.channel.id not in xp_channels:
+    if not is_xp_channel(guild_id, message.channel.id):
         await bot.process_commands(message)
         return
 
@@ -491,77 +2489,13 @@ async def on_message(message):
         await bot.process_commands(message)
         return
 
-    data = load_data(guild_id)
-    if user_id not in data:
-        data[user_id] = {}
-
-    data[user_id].setdefault("xp", 0)
-    data[user_id].setdefault("level", 1)
-    data[user_id].setdefault("last_daily", "")
-    data[user_id].setdefault("weekly_xp", 0)
-    data[user_id].setdefault("login_streak", 0)
-    data[user_id].setdefault("weekly_chat_xp", 0)
-    data[user_id].setdefault("weekly_vc_xp", 0)
-    data[user_id].setdefault("weekly_active_days", [])
-    data[user_id].setdefault("last_weekly_xp", 0)
-    data[user_id].setdefault("last_weekly_rank", 0)
-    data.setdefault(LAST_DECAY_KEY, "")
-
-    # アクティブ日数を記録
-    today_jst = datetime.now(JST).strftime("%Y-%m-%d")
-    if today_jst not in data[user_id]["weekly_active_days"]:
-        data[user_id]["weekly_active_days"].append(today_jst)
-
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
-
-    if data[user_id]["last_daily"] != today:
-        if data[user_id]["last_daily"] == yesterday:
-            data[user_id]["login_streak"] += 1
-        else:
-            data[user_id]["login_streak"] = 1
-
-        streak = data[user_id]["login_streak"]
-
-        if streak == 1:
-            bonus = 100
-        elif streak == 2:
-            bonus = 200
-        elif streak == 3:
-            bonus = 300
-        elif streak == 4:
-            bonus = 500
-        else:
-            bonus = 1000
-
-        data[user_id]["xp"] += bonus
-        data[user_id]["weekly_xp"] += bonus
-        data[user_id]["last_daily"] = today
-
-        # ログインボーナスでボスにダメージ
-        boss = load_boss(guild_id)
-        if boss.get("active"):
-            boss["damage"][user_id] = boss["damage"].get(user_id, 0) + bonus
-            boss["hp"] = max(0, boss["hp"] - bonus)
-            if boss["hp"] <= 0:
-                boss["active"] = False
-                boss["cleared"] += 1
-                save_boss(guild_id, boss)
-                await handle_boss_clear(message.guild, boss)
-            else:
-                save_boss(guild_id, boss)
-
-        # ストリークボーナスコイン（100 + streak * 20、上限500）
-        streak_coins = min(100 + (streak * 20), 500)
-        info = ensure_user_data(data, user_id)
-        today_earned = info.get("coin_daily_earned", 0)
-        if today_earned < COIN_DAILY_CAP:
-            add_amount = min(streak_coins, COIN_DAILY_CAP - today_earned)
-            info["coins"] = info.get("coins", 0) + add_amount
-            info["coin_daily_earned"] = today_earned + add_amount
-        else:
-            streak_coins = 0
+    boost = get_boost(guild_id)
+    result = await submit_xp(guild_id, user_id, "message", boost["multiplier"])
 
+    login = result["login"]
+    if login:
+        streak = login["streak"]
+        streak_coins = login["streak_coins"]
         if streak == 1:
             streak_msg = "🎁 **デイリーボーナス！**"
         elif streak < 5:
@@ -570,67 +2504,24 @@ async def on_message(message):
             streak_msg = f"🌟 **{streak}日連続ログイン！MAX ボーナス！**"
 
         coin_msg = f" 💰 +{streak_coins}コイン" if streak_coins > 0 else ""
-        await message.channel.send(
+        outbox_send(
+            message.channel,
             f"{streak_msg}\n"
-            f"{message.author.mention} **+{bonus}XP**{coin_msg} "
-            f"（連続{streak}日目）"
+            f"{message.author.mention} **+{login['bonus']}XP**{coin_msg} "
+            f"（連続{streak}日目）",
+            priority=PRIORITY_BONUS
         )
 
-    boost = get_boost(guild_id)
-
-    # ショップバフ適用（xp_multiplier・crit_bonus）
-    data_tmp = load_data(guild_id)
-    info_tmp = data_tmp.get(user_id, {})
-    cleanup_expired_buffs(info_tmp)
-    xp_buff = info_tmp.get("buffs", {}).get("xp_multiplier", {})
-    shop_xp_multi = xp_buff.get("value", 1.0) if xp_buff else 1.0
-    has_crit_buff = bool(info_tmp.get("buffs", {}).get("crit_bonus"))
-
-    base_xp = int(random.randint(5, 20) * boost["multiplier"] * shop_xp_multi)
-    xp_gain, crit_name, crit_multi = calc_crit(base_xp, has_crit_buff)
-    data[user_id]["xp"] += xp_gain
-    data[user_id]["weekly_xp"] += xp_gain
-    data[user_id]["weekly_chat_xp"] = data[user_id].get("weekly_chat_xp", 0) + xp_gain
-
     # クリティカル発生時に通知
-    if crit_name:
-        try:
-            await message.channel.send(
-                f"{crit_name} {message.author.display_name} **+{xp_gain:,}XP**（{crit_multi}倍！）"
-            )
-        except discord.DiscordServerError:
-            pass
-
-    await check_level_up(message.author, data, user_id)
-    save_data(guild_id, data)
-
-    boss = load_boss(guild_id)
-    if boss.get("active"):
-        # ボスダメージバフ適用
-        boss_dmg_buff = info_tmp.get("buffs", {}).get("boss_damage_multiplier", {})
-        boss_multi = boss_dmg_buff.get("value", 1.0) if boss_dmg_buff else 1.0
-        actual_dmg = int(xp_gain * boss_multi)
-        boss["damage"][user_id] = boss["damage"].get(user_id, 0) + actual_dmg
-        boss["hp"] = max(0, boss["hp"] - actual_dmg)
-        if boss["hp"] <= 0:
-            boss["active"] = False
-            boss["cleared"] += 1
-            save_boss(guild_id, boss)
-            await handle_boss_clear(message.guild, boss)
+    if result["crit_name"]:
+        crit_text = f"{result['crit_name']} {message.author.display_name} **+{result['xp_gain']:,}XP**（{result['crit_multi']}倍！）"
+        digest = get_digest(guild_id, message.channel)
+        if digest:
+            digest.add_crit(crit_text)
         else:
-            save_boss(guild_id, boss)
+            outbox_send(message.channel, crit_text, priority=PRIORITY_CRIT)
 
-    # イベントボスへのダメージ
-    event_boss = load_event_boss(guild_id)
-    if event_boss.get("active"):
-        event_boss["damage"][user_id] = event_boss["damage"].get(user_id, 0) + xp_gain
-        event_boss["hp"] = max(0, event_boss["hp"] - xp_gain)
-        if event_boss["hp"] <= 0:
-            event_boss["active"] = False
-            save_event_boss(guild_id, event_boss)
-            await handle_event_boss_clear(message.guild, event_boss)
-        else:
-            save_event_boss(guild_id, event_boss)
+    await handle_xp_result(message.author, result)
 
     await bot.process_commands(message)
 
@@ -700,86 +2591,94 @@ async def on_voice_state_update(member, before, after):
     if member.bot:
         return
 
-    guild_id = member.guild.id
-    user_id = str(member.id)
-    ck = f"{guild_id}:{user_id}"
+    ck = f"{member.guild.id}:{member.id}"
 
     if after.channel and not before.channel:
-        vc_users[ck] = True
+        vc_users[ck] = 0
         vc_last_xp_time[ck] = time.time()
-        vc_xp_elapsed = 0  # 最後のチェックからの経過秒数カウント
 
-        while vc_users.get(ck):
-            await asyncio.sleep(30)
-            vc_xp_elapsed += 30
+    if before.channel and not after.channel:
+        vc_users.pop(ck, None)
+        vc_afk_flags.pop(ck, None)
+        vc_last_xp_time.pop(ck, None)
 
-            if not member.voice or not member.voice.channel:
-                break
-            if len(member.voice.channel.members) < 2:
+# =========================
+# VC XP TICK（全サーバー）
+# メンバーごとにループを持たず、30秒ごとに全VCをまとめて処理する
+# =========================
+VC_TICK_SECONDS = 30
+# この秒数ごとに寝落ちチェック（45分）
+VC_AFK_CHECK_SECONDS = 2700
+
+async def afk_check_task(member, ck):
+    """寝落ちチェックをバックグラウンドで行う（応答待ちの間はXPを止める）"""
+    try:
+        await run_afk_check(member, member.guild.id, str(member.id), ck)
+    finally:
+        vc_afk_checking.discard(ck)
+
+async def vc_tick_guild(guild):
+    """サーバー内の全VCを見て、対象メンバーのXPを1回のバッチで適用する"""
+    boost = get_boost(guild.id)
+    members = []
+    entries = []
+
+    for channel in guild.voice_channels + guild.stage_channels:
+        if len(channel.members) < 2:
+            # 1人だけのVCはXPなし（経過時間だけ進める）
+            for member in channel.members:
+                if member.bot:
+                    continue
+                ck = f"{guild.id}:{member.id}"
+                # XPは出なくても寝落ちフラグ・最終XP時刻の期限は延ばす
+                # （1人の間に期限切れで消えると、誰かが来たときに /return なしでXPが戻ってしまう）
+                vc_afk_flags.touch(ck)
+                vc_last_xp_time.touch(ck)
+                if ck in vc_users:
+                    vc_users[ck] += VC_TICK_SECONDS
+            continue
+
+        for member in channel.members:
+            if member.bot or not member.voice:
+                continue
+            ck = f"{guild.id}:{member.id}"
+            # 起動前から参加していたメンバーもここで登録する
+            vc_users[ck] = vc_users.get(ck, 0) + VC_TICK_SECONDS
+            vc_last_xp_time.setdefault(ck, time.time())
+
+            # AFKフラグが立っている・チェックの応答待ちならXP停止
+            if vc_afk_flags.get(ck) or ck in vc_afk_checking:
                 continue
 
-            # AFKフラグが立っていたらXP停止
-            if vc_afk_flags.get(ck):
+            # 45分ごとにAFKチェック
+            if vc_users[ck] >= VC_AFK_CHECK_SECONDS:
+                vc_users[ck] = 0
+                vc_afk_checking.add(ck)
+                asyncio.create_task(afk_check_task(member, ck))
                 continue
 
-            # 45分（2700秒）ごとにAFKチェック
-            if vc_xp_elapsed >= 2700:
-                vc_xp_elapsed = 0
-                afk_confirmed = await run_afk_check(member, guild_id, user_id, ck)
-                if afk_confirmed:
-                    continue  # フラグON → XP停止
-
-            data = load_data(guild_id)
-            if user_id not in data:
-                data[user_id] = {}
-            data[user_id].setdefault("xp", 0)
-            data[user_id].setdefault("level", 1)
-            data[user_id].setdefault("last_daily", "")
-            data[user_id].setdefault("weekly_xp", 0)
-
-            boost = get_boost(guild_id)
             # ミュート中は2XP、ミュート解除（発言中）は15XP
             is_muted = member.voice.self_mute or member.voice.mute
             base_xp_vc = 2 if is_muted else 15
 
             # VCはクリティカルなし・ブーストのみ適用
-            gain = int(base_xp_vc * boost["multiplier"])
-
-            data[user_id]["xp"] += gain
-            data[user_id]["weekly_xp"] += gain
-            data[user_id]["weekly_vc_xp"] = data[user_id].get("weekly_vc_xp", 0) + gain
-
-            await check_level_up(member, data, user_id)
-            save_data(guild_id, data)
-
-            boss = load_boss(guild_id)
-            if boss.get("active"):
-                boss["damage"][user_id] = boss["damage"].get(user_id, 0) + gain
-                boss["hp"] = max(0, boss["hp"] - gain)
-                if boss["hp"] <= 0:
-                    boss["active"] = False
-                    boss["cleared"] += 1
-                    save_boss(guild_id, boss)
-                    await handle_boss_clear(member.guild, boss)
-                else:
-                    save_boss(guild_id, boss)
-
-            # イベントボスへのダメージ
-            event_boss = load_event_boss(guild_id)
-            if event_boss.get("active"):
-                event_boss["damage"][user_id] = event_boss["damage"].get(user_id, 0) + gain
-                event_boss["hp"] = max(0, event_boss["hp"] - gain)
-                if event_boss["hp"] <= 0:
-                    event_boss["active"] = False
-                    save_event_boss(guild_id, event_boss)
-                    await handle_event_boss_clear(member.guild, event_boss)
-                else:
-                    save_event_boss(guild_id, event_boss)
+            members.append(member)
+            entries.append((str(member.id), "vc", int(base_xp_vc * boost["multiplier"])))
+
+    if not entries:
+        return
 
-    if before.channel and not after.channel:
-        vc_users[ck] = False
-        vc_afk_flags.pop(ck, None)
-        vc_last_xp_time.pop(ck, None)
+    results = await guild_actor(guild.id).submit(lambda st: apply_xp_batch(st, entries))
+    for member, result in zip(members, results):
+        await handle_xp_result(member, result)
+
+@tasks.loop(seconds=VC_TICK_SECONDS)
+async def vc_xp_tick():
+    for guild in bot.guilds:
+        try:
+            await vc_tick_guild(guild)
+        except Exception as e:
+            print(f"[{guild.name}] VC XP処理でエラー: {e}")
 
 
 # =========================
@@ -787,10 +2686,7 @@ async def on_voice_state_update(member, before, after):
 # =========================
 @bot.tree.command(name="coins", description="\u6240\u6301\u30b3\u30a4\u30f3\u3092\u78ba\u8a8d\u3057\u307e\u3059")
 async def coins(interaction: discord.Interaction):
-    data = load_data(interaction.guild.id)
-    user_id = str(interaction.user.id)
-    info = ensure_user_data(data, user_id)
-    save_data(interaction.guild.id, data)
+    info = await store.load_user(interaction.guild.id, interaction.user.id)
 
     embed = discord.Embed(title="\U0001f4b0 \u6240\u6301\u30b3\u30a4\u30f3", color=discord.Color.gold())
     embed.add_field(name="\u73fe\u5728\u306e\u6240\u6301\u30b3\u30a4\u30f3", value=f"{info.get('coins', 0):,}\u30b3\u30a4\u30f3", inline=False)
@@ -799,19 +2695,16 @@ async def coins(interaction: discord.Interaction):
 
 @bot.tree.command(name="buffs", description="\u6709\u52b9\u306a\u30a2\u30a4\u30c6\u30e0\u52b9\u679c\u3092\u78ba\u8a8d\u3057\u307e\u3059")
 async def buffs(interaction: discord.Interaction):
-    data = load_data(interaction.guild.id)
     user_id = str(interaction.user.id)
-    info = ensure_user_data(data, user_id)
-    cleanup_expired_buffs(info)
-    save_data(interaction.guild.id, data)
+    active = await guild_actor(interaction.guild.id).submit(lambda st: active_buffs(st, user_id))
 
-    if not info.get("buffs"):
+    if not active:
         await interaction.response.send_message("\u73fe\u5728\u6709\u52b9\u306a\u30d0\u30d5\u306f\u3042\u308a\u307e\u305b\u3093\u3002", ephemeral=True)
         return
 
     lines = []
     current = now_ts()
-    for buff_type, buff in info["buffs"].items():
+    for buff_type, buff in active.items():
         remain = max(0, buff.get("expires_at", 0) - current)
         minutes = math.ceil(remain / 60)
         item = SHOP_ITEMS.get(buff.get("item_id"), {})
@@ -837,6 +2730,17 @@ async def shop(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+def apply_purchase(actor, user_id, item_id):
+    """コインを消費してバフを付与する（アクター内で呼ぶ）。成功したらバフの期限、コイン不足なら None"""
+    info = actor.user(user_id)
+    item = SHOP_ITEMS[item_id]
+    if not spend_coins(actor.users, user_id, item["price"], f"buy_{item_id}"):
+        return None
+    expires_at = add_timed_buff(info, item["buff_type"], item["value"], item["duration"], item_id)
+    actor.buff_engine.invalidate(user_id)
+    store.mark_dirty(actor.guild_id, user_id, source="buy")
+    return expires_at
+
 @bot.tree.command(name="buy", description="\u30b7\u30e7\u30c3\u30d7\u306e\u5546\u54c1\u3092\u8cfc\u5165\u3057\u307e\u3059")
 async def buy(interaction: discord.Interaction, item_id: str):
     item_id = item_id.lower().strip()
@@ -848,12 +2752,12 @@ async def buy(interaction: discord.Interaction, item_id: str):
         )
         return
 
-    data = load_data(interaction.guild.id)
     user_id = str(interaction.user.id)
-    info = ensure_user_data(data, user_id)
     item = SHOP_ITEMS[item_id]
 
-    if not spend_coins(data, user_id, item["price"], f"buy_{item_id}"):
+    expires_at = await guild_actor(interaction.guild.id).submit(lambda st: apply_purchase(st, user_id, item_id))
+    if expires_at is None:
+        info = await store.load_user(interaction.guild.id, user_id)
         await interaction.response.send_message(
             f"\u30b3\u30a4\u30f3\u304c\u8db3\u308a\u307e\u305b\u3093\u3002\n"
             f"\u5fc5\u8981: **{item['price']:,}\u30b3\u30a4\u30f3**\n"
@@ -862,9 +2766,6 @@ async def buy(interaction: discord.Interaction, item_id: str):
         )
         return
 
-    add_timed_buff(info, item["buff_type"], item["value"], item["duration"], item_id)
-    save_data(interaction.guild.id, data)
-
     duration_min = item["duration"] // 60
     await interaction.response.send_message(
         f"✅ **{item['name']}** を購入しました！\n"
@@ -876,26 +2777,74 @@ async def buy(interaction: discord.Interaction, item_id: str):
     ch_id = get_level_channel_id(interaction.guild.id)
     notify_ch = interaction.guild.get_channel(ch_id) if ch_id else None
     if notify_ch:
-        await notify_ch.send(
+        outbox_send(
+            notify_ch,
             f"✨ **{interaction.user.display_name}** が **{item['name']}** を使用しました！"
-            f"（有効時間　{duration_min}分）"
+            f"（有効時間　{duration_min}分）",
+            priority=PRIORITY_BONUS
         )
 
-    # バフ終了通知タスク
-    asyncio.create_task(notify_buff_end(
-        interaction.guild, interaction.user.display_name,
-        item["name"], item["duration"]
-    ))
+    # バフ終了通知
+    buff_expiry.push(
+        expires_at, interaction.guild.id, user_id, item["buff_type"],
+        interaction.user.display_name, item["name"]
+    )
 
 # =========================
 # バフ終了通知
 # =========================
-async def notify_buff_end(guild, user_name, item_name, duration_seconds):
-    await asyncio.sleep(duration_seconds)
-    ch_id = get_level_channel_id(guild.id)
-    notify_ch = guild.get_channel(ch_id) if ch_id else None
+def notify_buff_end(guild_id, user_id, buff_type, expires_at, user_name, item_name):
+    """バフ終了を通知する。買い足しで期限が延びていたら、延びた方の通知に任せる"""
+    info = store.users(guild_id).get(user_id, {})
+    buff = info.get("buffs", {}).get(buff_type)
+    if buff and buff.get("expires_at", 0) > expires_at:
+        return
+    guild = bot.get_guild(int(guild_id))
+    ch_id = get_level_channel_id(guild_id)
+    notify_ch = guild.get_channel(ch_id) if guild and ch_id else None
     if notify_ch:
-        await notify_ch.send(f"⏱ **{user_name}** の **{item_name}** の効果が終了しました。")
+        outbox_send(notify_ch, f"⏱ **{user_name}** の **{item_name}** の効果が終了しました。", priority=PRIORITY_BONUS)
+
+class BuffExpiryHeap:
+    """バフの終了通知を期限順のヒープで持ち、1つのタスクが先頭の期限まで眠って順に通知する"""
+
+    def __init__(self):
+        self.heap = []  # [(expires_at, seq, guild_id, user_id, buff_type, user_name, item_name)]
+        self._seq = 0
+        self._wakeup = None
+        self._task = None
+
+    def push(self, expires_at, guild_id, user_id, buff_type, user_name, item_name):
+        self._seq += 1
+        heapq.heappush(self.heap, (expires_at, self._seq, guild_id, user_id, buff_type, user_name, item_name))
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            # 先頭より早い期限が入ったかもしれないので起こす
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            expires_at, _, guild_id, user_id, buff_type, user_name, item_name = heapq.heappop(self.heap)
+            try:
+                await store.load(guild_id)
+                notify_buff_end(guild_id, user_id, buff_type, expires_at, user_name, item_name)
+            except Exception as e:
+                print(f"[buff expiry] guild {guild_id}: {e}")
+
+buff_expiry = BuffExpiryHeap()
 
 
 # =========================
@@ -934,14 +2883,15 @@ async def vc_return(interaction: discord.Interaction):
 @bot.tree.command(name="rank", description="自分のレベルを確認")
 async def rank(interaction: discord.Interaction):
     await interaction.response.defer()
-    data = load_data(interaction.guild.id)
+    data = await store.load(interaction.guild.id)
     user_id = str(interaction.user.id)
     if user_id not in data:
         await interaction.followup.send("まだデータがありません！")
         return
 
-    xp = data[user_id].get("xp", 0)
-    level = data[user_id].get("level", 1)
+    info = store.user(interaction.guild.id, user_id)
+    xp = info.get("xp", 0)
+    level = info.get("level", 1)
     required_xp = level * 100
     progress = xp / required_xp
     filled = int(20 * progress)
@@ -959,19 +2909,15 @@ async def rank(interaction: discord.Interaction):
 @bot.tree.command(name="top", description="XPランキングTOP10")
 async def top(interaction: discord.Interaction):
     await interaction.response.defer()
-    users = load_data(interaction.guild.id)
-
-    ranking = sorted(
-        [(uid, info) for uid, info in users.items() if uid != LAST_DECAY_KEY],
-        key=lambda x: (x[1].get("level", 1), x[1].get("xp", 0)),
-        reverse=True
-    )
+    await store.load(interaction.guild.id)
+    ranking = store.ranks(interaction.guild.id)["total"].top(10)
 
     embed = discord.Embed(title="🏆 XPランキング TOP10", color=discord.Color.gold())
     medals = ["🥇", "🥈", "🥉"]
     text = ""
 
-    for i, (user_id, info) in enumerate(ranking[:10], start=1):
+    for i, (user_id, _) in enumerate(ranking, start=1):
+        info = store.user(interaction.guild.id, user_id)
         level = info.get("level", 1)
         xp = info.get("xp", 0)
         icon = medals[i-1] if i <= 3 else f"{i}."
@@ -985,13 +2931,13 @@ async def top(interaction: discord.Interaction):
 # =========================
 @bot.tree.command(name="myxp", description="自分のXPやレベルを確認")
 async def myxp(interaction: discord.Interaction):
-    data = load_data(interaction.guild.id)
+    data = await store.load(interaction.guild.id)
     user_id = str(interaction.user.id)
     if user_id not in data:
         await interaction.response.send_message("まだデータがありません！")
         return
 
-    info = data[user_id]
+    info = store.user(interaction.guild.id, user_id)
     streak = info.get("login_streak", 0)
 
     if streak >= 5:
@@ -1030,23 +2976,19 @@ async def weeklynote(interaction: discord.Interaction):
     await interaction.response.defer()
     guild_id = interaction.guild.id
     user_id = str(interaction.user.id)
-    data = load_data(guild_id)
+    data = await store.load(guild_id)
 
     if user_id not in data:
         await interaction.followup.send("まだデータがありません！メッセージを送ってからお試しください。")
         return
 
-    info = data[user_id]
+    info = store.user(guild_id, user_id)
 
-    # 今週のXP・順位
+    # 今週のXP・順位（今週まだ変動のないユーザーは最下位タイ）
     weekly_xp = info.get("weekly_xp", 0)
-    sorted_users = sorted(
-        [(uid, d) for uid, d in data.items() if uid != LAST_DECAY_KEY],
-        key=lambda x: x[1].get("weekly_xp", 0),
-        reverse=True
-    )
-    current_rank = next((i+1 for i, (uid, _) in enumerate(sorted_users) if uid == user_id), 0)
-    total_users = len(sorted_users)
+    weekly_index = store.ranks(guild_id)["weekly"]
+    current_rank = weekly_index.rank(user_id) or len(weekly_index) + 1
+    total_users = len(data)
 
     # 前週比
     last_xp = info.get("last_weekly_xp", 0)
@@ -1066,7 +3008,7 @@ async def weeklynote(interaction: discord.Interaction):
             rank_diff_str = "→ 変動なし"
 
     # アクティブ日数
-    active_days = len(info.get("weekly_active_days", []))
+    active_days = info.active_day_count()
 
     # チャット・VC比率
     chat_xp = info.get("weekly_chat_xp", 0)
@@ -1079,11 +3021,11 @@ async def weeklynote(interaction: discord.Interaction):
         chat_pct = vc_pct = 0
 
     # ボスダメージ
-    boss = load_boss(guild_id)
+    state = await guild_state(guild_id)
+    boss = state.boss
     boss_dmg = boss.get("damage", {}).get(user_id, 0) if boss.get("active") else 0
     if boss.get("active") and boss_dmg > 0:
-        sorted_dmg = sorted(boss["damage"].items(), key=lambda x: x[1], reverse=True)
-        boss_rank = next((i+1 for i, (uid, _) in enumerate(sorted_dmg) if uid == user_id), 0)
+        boss_rank = state.boss_index.rank(user_id) or 0
         boss_str = f"{boss_dmg:,} ({boss_rank}位)"
     elif boss.get("active"):
         boss_str = "未参加"
@@ -1134,14 +3076,14 @@ async def weeklynote(interaction: discord.Interaction):
 @bot.tree.command(name="userdata", description="ユーザーのデータを確認（管理者用）")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def userdata(interaction: discord.Interaction, member: discord.Member):
-    data = load_data(interaction.guild.id)
+    data = await store.load(interaction.guild.id)
     user_id = str(member.id)
 
     if user_id not in data:
         await interaction.response.send_message(f"{member.name} のデータはまだありません！", ephemeral=True)
         return
 
-    info = data[user_id]
+    info = store.user(interaction.guild.id, user_id)
     level = info.get("level", 1)
     xp = info.get("xp", 0)
     required_xp = level * 100
@@ -1155,7 +3097,7 @@ async def userdata(interaction: discord.Interaction, member: discord.Member):
             current_rank = role_name
             break
 
-    boss = load_boss(interaction.guild.id)
+    boss = (await guild_state(interaction.guild.id)).boss
     boss_dmg = boss.get("damage", {}).get(user_id, 0) if boss.get("active") else 0
 
     streak = info.get("login_streak", 0)
@@ -1189,16 +3131,15 @@ async def userdata_error(interaction: discord.Interaction, error):
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def alldata(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    data = load_data(interaction.guild.id)
+    data = await store.load(interaction.guild.id)
     guild = interaction.guild
 
     output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(["UserID", "Username", "Level", "XP", "WeeklyXP", "LastDaily", "LoginStreak"])
 
-    for uid, info in data.items():
-        if uid == LAST_DECAY_KEY:
-            continue
+    for uid in list(data):
+        info = store.user(guild.id, uid)
         member = guild.get_member(int(uid))
         username = member.name if member else f"Unknown({uid})"
         writer.writerow([
@@ -1218,7 +3159,7 @@ async def alldata(interaction: discord.Interaction):
         fp=io.BytesIO(output.getvalue().encode("utf-8-sig")),
         filename=filename
     )
-    user_count = sum(1 for k in data if k != LAST_DECAY_KEY)
+    user_count = len(data)
     await interaction.followup.send(
         f"📊 全ユーザーデータです！（{user_count}人分）",
         file=file,
@@ -1231,52 +3172,306 @@ async def alldata_error(interaction: discord.Interaction, error):
         await interaction.response.send_message("このコマンドは管理者のみ使用できます！", ephemeral=True)
 
 # =========================
-# 週間ランキング（全サーバー）
+# 全サーバーへの一斉処理（ファンアウト）
 # =========================
-@tasks.loop(minutes=1)
-async def weekly_ranking_task():
-    now = datetime.now(JST)
-    today = now.strftime("%Y-%m-%d")
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "8"))  # 同時に処理するサーバー数
+FANOUT_RETRIES = int(os.environ.get("FANOUT_RETRIES", "3"))          # 429 のときのやり直し回数
+
+route_resume = {}  # { route: 再開してよい loop.time() }  429 を受けたルート（チャンネル / サーバーのロール操作）
+
+async def call_on_route(route, fn, retries=FANOUT_RETRIES):
+    """fn() を route のレート制限を守って実行し、結果を返す
+
+    429 を受けたら route 全体を retry_after だけ止め（同じ route の他の呼び出しも待つ）、やり直す。
+    429 以外の失敗・やり直し切れは例外をそのまま投げる。
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        wait = route_resume.get(route, 0) - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await fn()
+        except discord.RateLimited as e:
+            if attempt == retries:
+                raise
+            retry_after = e.retry_after
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == retries:
+                raise
+            retry_after = 5
+        route_resume[route] = max(route_resume.get(route, 0), loop.time() + retry_after)
+
+class FanoutRun:
+    """1回のファンアウトの送信・ロール操作と、その成功/失敗数
+
+    success / failed は送信・ロール操作（API呼び出し）の数、errors は job 自体が例外で止まったサーバーの数。
+    """
+
+    def __init__(self):
+        self.success = 0
+        self.failed = 0
+        self.errors = 0
+
+    async def call(self, route, fn):
+        """call_on_route() で fn() を実行する。失敗したら None"""
+        try:
+            result = await call_on_route(route, fn)
+        except Exception:
+            self.failed += 1
+            return None
+        self.success += 1
+        return result
 
-    if not (now.weekday() == 0 and now.hour == 18 and now.minute == 0):
-        return
+    async def send(self, channel, *args, **kwargs):
+        return await self.call(("channel", channel.id), lambda: channel.send(*args, **kwargs))
 
-    for guild in bot.guilds:
-        gid = guild.id
-        if _weekly_announced.get(gid) == today:
-            continue
-        _weekly_announced[gid] = today
+    async def add_roles(self, member, *roles):
+        return await self.call(("guild", member.guild.id), lambda: member.add_roles(*roles))
+
+    async def remove_roles(self, member, *roles):
+        return await self.call(("guild", member.guild.id), lambda: member.remove_roles(*roles))
+
+class GuildFanout:
+    """全サーバーへの送信・ロール操作を、同時実行数を絞って並行に行う
+
+    ・同時に処理するサーバーは全ファンアウト合わせて FANOUT_CONCURRENCY 件まで
+    ・429 はルート（チャンネル / サーバーのロール操作）単位で待つ
+    ・1つのサーバーで失敗しても他のサーバーは続ける
+    """
+
+    def __init__(self, concurrency=FANOUT_CONCURRENCY):
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(self, guilds, job, name="fanout"):
+        """各サーバーについて await job(guild, run) を実行し、FanoutRun（成功/失敗/エラー数）を返す"""
+        run = FanoutRun()
+
+        async def one(guild):
+            async with self.semaphore:
+                try:
+                    await job(guild, run)
+                except Exception as e:
+                    run.errors += 1
+                    print(f"[{name}] guild {guild.id}: {e}")
+
+        await asyncio.gather(*(one(guild) for guild in guilds))
+        if run.failed or run.errors:
+            print(f"[{name}] 成功: {run.success} / 失敗: {run.failed} / エラー: {run.errors}サーバー")
+        return run
+
+guild_fanout = GuildFanout()
+
+# =========================
+# 送信キュー（チャンネルごと・優先度つき）
+# XP処理からは積むだけで、送信はチャンネルごとのタスクが行う
+# =========================
+PRIORITY_BOSS = 0   # ボス・イベントボスの出現 / 討伐
+PRIORITY_LEVEL = 1  # レベルアップ・ロール獲得
+PRIORITY_BONUS = 2  # ログインボーナス・ブースト・バフ（ここから下は混雑時にまとめる / 捨てる）
+PRIORITY_CRIT = 3   # クリティカル
+
+OUTBOX_MAX_PENDING = int(os.environ.get("OUTBOX_MAX_PENDING", "20"))  # チャンネルごとの待ち件数の上限
+OUTBOX_COALESCE_AT = int(os.environ.get("OUTBOX_COALESCE_AT", "3"))   # この件数以上たまったら低優先度をまとめる
+MESSAGE_MAX_LEN = 2000
+
+class ChannelOutbox:
+    """1チャンネル分の送信待ちメッセージ（優先度順・同じ優先度なら積んだ順）
+
+    ・OUTBOX_COALESCE_AT 件以上たまっている間は、低優先度のテキストを同じ優先度の待ちメッセージに追記する
+    ・OUTBOX_MAX_PENDING 件を超えたら低優先度のうち一番新しいものを捨てる（ボス・レベルアップは捨てない）
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = []  # heap of [priority, seq, content, kwargs]
+        self.dropped = 0
+        self._seq = 0
+        self._task = None
+
+    def push(self, priority, content, kwargs):
+        low = priority >= PRIORITY_BONUS
+        if low and not kwargs and content and len(self.pending) >= OUTBOX_COALESCE_AT:
+            # 順番が入れ替わらないよう、同じ優先度で一番新しいメッセージに追記する
+            last = max((entry for entry in self.pending if entry[0] == priority), default=None)
+            if last is not None and not last[3] and last[2] and len(last[2]) + len(content) + 1 <= MESSAGE_MAX_LEN:
+                last[2] += "\n" + content
+                return
+
+        if len(self.pending) >= OUTBOX_MAX_PENDING:
+            droppable = [entry for entry in self.pending if entry[0] >= PRIORITY_BONUS]
+            worst = max(droppable, default=None)
+            if low and (worst is None or worst[0] <= priority):
+                self.dropped += 1
+                return
+            if worst is not None:
+                self.pending.remove(worst)
+                heapq.heapify(self.pending)
+                self.dropped += 1
+
+        self._seq += 1
+        heapq.heappush(self.pending, [priority, self._seq, content, kwargs])
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        try:
+            while self.pending:
+                _, _, content, kwargs = heapq.heappop(self.pending)
+                channel = self.channel
+                try:
+                    await call_on_route(("channel", channel.id), lambda: channel.send(content, **kwargs))
+                except Exception as e:
+                    print(f"[outbox] channel {channel.id}: {e}")
+        finally:
+            self._task = None
+
+outboxes = {}  # { channel_id: ChannelOutbox }
+
+def outbox_send(channel, content=None, *, priority=PRIORITY_BONUS, **kwargs):
+    """channel.send() の代わりにチャンネルの送信キューへ積む（待たない）"""
+    outbox = outboxes.get(channel.id)
+    if outbox is None:
+        outbox = outboxes[channel.id] = ChannelOutbox(channel)
+    outbox.channel = channel
+    outbox.push(priority, content, kwargs)
+
+# =========================
+# ダイジェストモード（レベルアップ・クリティカル通知をまとめて送る）
+# /set digest で有効にしたサーバーだけ
+# =========================
+DIGEST_SECONDS = int(os.environ.get("DIGEST_SECONDS", "60"))  # /set digest で秒数を省略したときの既定値
+EMBED_FIELD_MAX_LEN = 1024
+
+def digest_lines(lines, limit=EMBED_FIELD_MAX_LEN):
+    """Embedのフィールドに収まるだけ行を並べ、あふれた分は「ほかN件」にする"""
+    text = ""
+    for i, line in enumerate(lines):
+        rest = f"\n…ほか{len(lines) - i}件"
+        if len(text) + len(line) + 1 + len(rest) > limit:
+            return text + rest
+        text += line + "\n"
+    return text
+
+class NotificationDigest:
+    """1チャンネル分のレベルアップ・クリティカル通知を window 秒ためて、1つのEmbedで送る"""
+
+    def __init__(self, channel, window):
+        self.channel = channel
+        self.window = window
+        self.level_ups = []  # [(user_id, 行)]（同じ人が window 内に何度も上がることがある）
+        self.crits = []
+        self._timer = None
+
+    def add_level_up(self, user_id, line):
+        self.level_ups.append((user_id, line))
+        self._arm()
+
+    def add_crit(self, line):
+        self.crits.append(line)
+        self._arm()
+
+    def _arm(self):
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self.flush()
+
+    def flush(self):
+        level_ups, crits = self.level_ups, self.crits
+        self.level_ups, self.crits = [], []
+        if not level_ups and not crits:
+            return
+
+        summary = []
+        if level_ups:
+            summary.append(f"{len({uid for uid, _ in level_ups})}人がレベルアップ")
+        if crits:
+            summary.append(f"クリティカル{len(crits)}回")
+        embed = discord.Embed(title=f"📣 {'・'.join(summary)}", color=discord.Color.blurple())
+        if level_ups:
+            embed.add_field(name="🎉 レベルアップ", value=digest_lines([line for _, line in level_ups]), inline=False)
+        if crits:
+            embed.add_field(name="✨ クリティカル", value=digest_lines(crits), inline=False)
+        embed.set_footer(text=f"{self.window}秒間の通知をまとめて表示")
+        outbox_send(self.channel, embed=embed, priority=PRIORITY_LEVEL if level_ups else PRIORITY_CRIT)
+
+digests = {}  # { channel_id: NotificationDigest }
+
+def get_digest(guild_id, channel):
+    """ダイジェストモードのサーバーならチャンネルの NotificationDigest を、そうでなければ None を返す"""
+    window = get_guild_config(guild_id).digest_seconds
+    if not window:
+        return None
+    digest = digests.get(channel.id)
+    if digest is None:
+        digest = digests[channel.id] = NotificationDigest(channel, window)
+    digest.channel = channel
+    digest.window = window
+    return digest
 
-        data = load_data(gid)
+# =========================
+# 週間ランキング（全サーバー）
+# =========================
+def apply_weekly_reset(actor):
+    """週間報酬を付与し、週番号を進める（アクター内で呼ぶ）
+
+    各ユーザーの前週データの保存・週間データのリセットは、次にそのユーザーを読み書きしたときに行われる。
+    (TOP3 [(user_id, weekly_xp, コイン)], 活動量ボーナス対象 [user_id]) を返す。
+    """
+    weekly = store.ranks(actor.guild_id)["weekly"]
+
+    weekly_coin_rewards = {1: 3000, 2: 2000, 3: 1000}
+    top3 = []
+    for i, (user_id, weekly_xp) in enumerate(weekly.top(3), start=1):
+        coin_r = weekly_coin_rewards.get(i, 0)
+        info = actor.user(user_id)
+        info["coins"] = info.get("coins", 0) + coin_r
+        top3.append((user_id, weekly_xp, coin_r))
+
+    # 活動量ボーナス（週1000XP以上 → 500コイン）。ランキング順に見て1000XP未満で打ち切る
+    activity_bonus = []
+    for user_id, weekly_xp in weekly.iter_top():
+        if weekly_xp < 1000:
+            break
+        activity_bonus.append(user_id)
+    for user_id in activity_bonus:
+        info = actor.user(user_id)
+        info["coins"] = info.get("coins", 0) + 500
+
+    store.mark_dirty(actor.guild_id, *(uid for uid, _, _ in top3), *activity_bonus, source="weekly_reset")
+    store.advance_week(actor.guild_id)
+    return top3, activity_bonus
+
+async def weekly_ranking_task(fire_time):
+    """毎週月曜18時：週間ランキング発表と週間データのリセット"""
+    async def job(guild, run):
+        gid = guild.id
+        data = await store.load(gid)
         if not data:
-            continue
+            return
 
         ch_id = get_level_channel_id(gid)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
 
-        sorted_users = sorted(
-            [(uid, info) for uid, info in data.items() if uid != LAST_DECAY_KEY],
-            key=lambda x: x[1].get("weekly_xp", 0),
-            reverse=True
-        )
-        top3 = sorted_users[:3]
+        top3, activity_bonus = await guild_actor(gid).submit(apply_weekly_reset)
 
         for role_name in weekly_roles.values():
-            role = discord.utils.get(guild.roles, name=role_name)
+            role = get_role(guild, role_name)
             if role:
                 for member in role.members:
-                    await member.remove_roles(role)
+                    await run.remove_roles(member, role)
 
-        weekly_coin_rewards = {1: 3000, 2: 2000, 3: 1000}
         text = ""
-        for i, (user_id, info) in enumerate(top3, start=1):
-            role = discord.utils.get(guild.roles, name=weekly_roles[i])
+        for i, (user_id, weekly_xp, coin_r) in enumerate(top3, start=1):
+            role = get_role(guild, weekly_roles[i])
             member = guild.get_member(int(user_id))
             if role and member:
-                await member.add_roles(role)
-            coin_r = weekly_coin_rewards.get(i, 0)
-            info["coins"] = info.get("coins", 0) + coin_r
-            text += f"{['🥇','🥈','🥉'][i-1]} <@{user_id}> - {info.get('weekly_xp', 0)} XP 💰 +{coin_r:,}コイン\n"
+                await run.add_roles(member, role)
+            text += f"{['🥇','🥈','🥉'][i-1]} <@{user_id}> - {weekly_xp} XP 💰 +{coin_r:,}コイン\n"
 
         if notify_channel:
             embed = discord.Embed(
@@ -1284,156 +3479,109 @@ async def weekly_ranking_task():
                 description=text,
                 color=discord.Color.gold()
             )
-            await notify_channel.send(embed=embed)
-
-        # 前週データを保存してリセット
-        for i, (uid, info) in enumerate(sorted_users, start=1):
-            info["last_weekly_xp"] = info.get("weekly_xp", 0)
-            info["last_weekly_rank"] = i
-
-        # 活動量ボーナス（週1000XP以上 → 500コイン）
-        activity_bonus_users = ""
-        for uid, info in data.items():
-            if uid == LAST_DECAY_KEY:
-                continue
-            if info.get("weekly_xp", 0) >= 1000:
-                info["coins"] = info.get("coins", 0) + 500
-                activity_bonus_users += f"<@{uid}> +500コイン\n"
+            await run.send(notify_channel, embed=embed)
 
+        activity_bonus_users = "".join(f"<@{uid}> +500コイン\n" for uid in activity_bonus)
         if notify_channel and activity_bonus_users:
             embed_act = discord.Embed(
                 title="🎯 週間活動ボーナス！",
                 description=f"今週1000XP以上獲得したメンバーへ💰\n\n{activity_bonus_users}",
                 color=discord.Color.green()
             )
-            await notify_channel.send(embed=embed_act)
+            await run.send(notify_channel, embed=embed_act)
 
-        for uid in data:
-            if uid != LAST_DECAY_KEY:
-                data[uid]["weekly_xp"] = 0
-                data[uid]["weekly_chat_xp"] = 0
-                data[uid]["weekly_vc_xp"] = 0
-                data[uid]["weekly_active_days"] = []
-                data[uid]["coin_daily_earned"] = 0  # 日次上限もリセット
-        save_data(gid, data)
+    await guild_fanout.run(bot.guilds, job, "weekly_ranking")
 
 # =========================
 # XP Decay Task
 # =========================
-@tasks.loop(hours=24)
-async def decay_task():
-    await bot.wait_until_ready()
-    today = datetime.now(JST).strftime("%Y-%m-%d")
+def apply_decay(actor, today):
+    """XP減衰を1回進める（1日1回・アクター内で呼ぶ）
+
+    サーバーの減衰回数を増やすだけで、各ユーザーには次に読み書きしたときに反映される。
+    """
+    meta = store.meta(actor.guild_id)
+    if meta.get(LAST_DECAY_KEY) == today:
+        return
+
+    meta[DECAY_EPOCH_KEY] = meta.get(DECAY_EPOCH_KEY, 0) + 1
+    meta[LAST_DECAY_KEY] = today
+    store.mark_meta_dirty(actor.guild_id)
+
+async def decay_task(fire_time):
+    """毎日0時：XP減衰"""
+    today = fire_time.strftime("%Y-%m-%d")
 
     for guild in bot.guilds:
         gid = guild.id
-        data = load_data(gid)
+        data = await store.load(gid)
         if not data:
             continue
-
-        if data.get(LAST_DECAY_KEY) == today:
-            continue
-
-        for uid, info in data.items():
-            if uid == LAST_DECAY_KEY or not isinstance(info, dict):
-                continue
-            current_xp = info.get("xp", 0)
-            if current_xp > 0:
-                info["xp"] = max(0, int(current_xp * (1 - DECAY_PERCENT)))
-
-        data[LAST_DECAY_KEY] = today
-        save_data(gid, data)
+        await guild_actor(gid).submit(lambda st: apply_decay(st, today))
 # =========================
 # XP BOOST TASK（全サーバー）
 # 毎日ランダムな時間帯に2回発動（朝8-11時・夜18-22時）
 # =========================
 
-# 当日のブースト予定時刻を保持 { "YYYY-MM-DD": [hour1, hour2] }
-_boost_schedule = {}
-# 発動済みフラグ { "YYYY-MM-DD_hour": True }
-_boost_fired = {}
-
-@tasks.loop(minutes=1)
-async def xp_boost_scheduler():
-    now = datetime.now(JST)
-    today = now.strftime("%Y-%m-%d")
-
-    # 当日のスケジュールをまだ決めていなければ決める
-    if today not in _boost_schedule:
-        morning_hour = random.randint(8, 11)
-        night_hour = random.randint(18, 22)
-        _boost_schedule[today] = [morning_hour, night_hour]
-        # 前日以前のスケジュールを削除
-        for key in list(_boost_schedule.keys()):
-            if key < today:
-                del _boost_schedule[key]
-        for key in list(_boost_fired.keys()):
-            if key.split("_")[0] < today:
-                del _boost_fired[key]
-
-    for hour in _boost_schedule[today]:
-        fire_key = f"{today}_{hour}"
-        if _boost_fired.get(fire_key):
-            continue
-        if now.hour == hour and now.minute == 0:
-            _boost_fired[fire_key] = True
-            multiplier = 3 if random.random() < 0.05 else 2
-
-            for guild in bot.guilds:
-                set_time_boost(guild.id, multiplier)
-                ch_id = get_level_channel_id(guild.id)
-                channel = guild.get_channel(ch_id) if ch_id else None
-                if channel:
-                    await channel.send(
-                        f"🔥 **XP BOOST START!**\n"
-                        f"XPが **{multiplier}倍** になりました！\n"
-                        f"1時間限定！"
-                    )
-
-            # 1時間後に終了
-            await asyncio.sleep(3600)
-
-            for guild in bot.guilds:
-                set_time_boost(guild.id, 1)
-                ch_id = get_level_channel_id(guild.id)
-                channel = guild.get_channel(ch_id) if ch_id else None
-                if channel:
-                    await channel.send("⏱ **XP BOOST 終了！**")
+def boost_plan(day):
+    """その日のブースト [(時, 倍率), (時, 倍率)]。日付から決まるので再起動しても同じ予定になる"""
+    rng = random.Random(f"xp-boost-{day.isoformat()}")
+    morning_hour = rng.randint(8, 11)
+    night_hour = rng.randint(18, 22)
+    return [(hour, 3 if rng.random() < 0.05 else 2) for hour in (morning_hour, night_hour)]
+
+def boost_times():
+    """ブースト開始時刻に発火する next_fire 関数"""
+    def next_fire(after):
+        after = after.astimezone(JST)
+        for d in range(2):
+            day = after.date() + timedelta(days=d)
+            for hour, _ in boost_plan(day):
+                t = jst_at(day, hour)
+                if t > after:
+                    return t
+    return next_fire
+
+async def xp_boost_start(fire_time):
+    multiplier = dict(boost_plan(fire_time.date()))[fire_time.hour]
+    # 1時間後に終了（終了通知はタイマーホイールから）
+    expires_at = fire_time.timestamp() + 3600
+
+    # 設定の書き込みは全サーバー分まとめて1回だけ（サーバーごとに保存すると全体のスナップショットを毎回取る）
+    for guild in bot.guilds:
+        set_boost(guild.id, "time", multiplier, expires_at, "⏱ **XP BOOST 終了！**", save=False)
+    save_config(load_config())
+
+    async def job(guild, run):
+        ch_id = get_level_channel_id(guild.id)
+        channel = guild.get_channel(ch_id) if ch_id else None
+        if channel:
+            await run.send(
+                channel,
+                f"🔥 **XP BOOST START!**\n"
+                f"XPが **{multiplier}倍** になりました！\n"
+                f"1時間限定！"
+            )
+
+    await guild_fanout.run(bot.guilds, job, "xp_boost_start")
 
 # =========================
 # 週間ランキング中間発表（全サーバー・毎日21時）
 # =========================
-@tasks.loop(minutes=1)
-async def weekly_mid_announcement():
-    now = datetime.now(JST)
-    today = now.strftime("%Y-%m-%d")
-
-    if not (now.hour == 21 and now.minute == 0):
-        return
-
-    for guild in bot.guilds:
+async def weekly_mid_announcement(fire_time):
+    async def job(guild, run):
         gid = guild.id
-        if _mid_announced_today.get(gid) == today:
-            continue
-        _mid_announced_today[gid] = today
-
-        data = load_data(gid)
+        data = await store.load(gid)
         if not data:
-            continue
+            return
 
         ch_id = get_level_channel_id(gid)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
 
-        sorted_users = sorted(
-            [(uid, info) for uid, info in data.items() if uid != LAST_DECAY_KEY],
-            key=lambda x: x[1].get("weekly_xp", 0),
-            reverse=True
-        )
-
         desc = ""
         medals = ["🥇", "🥈", "🥉", "④", "⑤"]
-        for i, (uid, info) in enumerate(sorted_users[:5]):
-            desc += f"{medals[i]} <@{uid}> - {info.get('weekly_xp', 0)} XP\n"
+        for i, (uid, weekly_xp) in enumerate(store.ranks(gid)["weekly"].top(5)):
+            desc += f"{medals[i]} <@{uid}> - {weekly_xp} XP\n"
 
         if notify_channel:
             embed = discord.Embed(
@@ -1442,44 +3590,45 @@ async def weekly_mid_announcement():
                 color=discord.Color.blue()
             )
             embed.set_footer(text="最終結果は月曜18:00に発表！")
-            await notify_channel.send(embed=embed)
+            await run.send(notify_channel, embed=embed)
+
+    await guild_fanout.run(bot.guilds, job, "weekly_mid_announcement")
 
 # =========================
 # イベントボス read/write
 # =========================
-def load_event_boss(guild_id):
-    path = event_boss_file(guild_id)
-    if not os.path.exists(path):
-        return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "name": "大魔王", "consecutive_clears": 0}
-    with open(path, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "name": "大魔王", "consecutive_clears": 0}
+def default_event_boss():
+    return {"active": False, "hp": 0, "max_hp": 0, "damage": {}, "name": "大魔王", "consecutive_clears": 0}
+
+async def load_event_boss(guild_id):
+    return await storage_io.read(("event_boss", guild_id), store.backend.load_event_boss, guild_id)
 
 def save_event_boss(guild_id, boss):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(event_boss_file(guild_id), "w") as f:
-        json.dump(boss, f, indent=4)
+    storage_io.write(
+        ("event_boss", guild_id), lambda b: store.backend.save_event_boss(guild_id, b), snapshot(boss)
+    )
 
 # =========================
 # イベントボス：自動発動チェック（通常ボスクリア時に呼ぶ）
 # =========================
 async def check_event_boss_trigger(guild, consecutive_clears):
     gid = guild.id
-    event_boss = load_event_boss(gid)
 
-    # すでにイベントボス発動中なら無視
-    if event_boss.get("active"):
-        return
+    def update(st):
+        # すでにイベントボス発動中なら無視
+        if st.event_boss.get("active"):
+            return None
+        # 連続クリア数を更新
+        st.update_event_boss(consecutive_clears=consecutive_clears)
+        return st.event_boss.get("name", "大魔王")
 
-    # 連続クリア数を更新
-    event_boss["consecutive_clears"] = consecutive_clears
-    save_event_boss(gid, event_boss)
+    boss_name = await guild_actor(gid).submit(update)
+    if boss_name is None:
+        return
 
     # トリガー条件チェック（累計クリア数が5の倍数に達したら発動）
     if consecutive_clears > 0 and consecutive_clears % EVENT_BOSS_CONSECUTIVE_CLEARS == 0:
-        await spawn_event_boss(guild, event_boss.get("name", "大魔王"))
+        await spawn_event_boss(guild, boss_name)
 
 async def spawn_event_boss(guild, boss_name, hp=None, days=None, boost_multiplier=None):
     gid = guild.id
@@ -1500,11 +3649,11 @@ async def spawn_event_boss(guild, boss_name, hp=None, days=None, boost_multiplie
         "boost_multiplier": boost_multi,
         "consecutive_clears": EVENT_BOSS_CONSECUTIVE_CLEARS
     }
-    save_event_boss(gid, event_boss)
+    await guild_actor(gid).submit(lambda st: st.set_event_boss(event_boss))
     event_boss_active[gid] = True
 
     # 限定ロールを作成（なければ）
-    role = discord.utils.get(guild.roles, name=EVENT_BOSS_CLEAR_ROLE)
+    role = get_role(guild, EVENT_BOSS_CLEAR_ROLE)
     if not role:
         try:
             role = await guild.create_role(
@@ -1530,7 +3679,7 @@ async def spawn_event_boss(guild, boss_name, hp=None, days=None, boost_multiplie
         embed.add_field(name="📅 開催期間", value=f"{boost_days}日間")
         embed.add_field(name="🎁 討伐報酬", value=f"`{EVENT_BOSS_CLEAR_ROLE}` ロール\nXP **{boost_multi}倍**（{boost_days}日間）", inline=False)
         embed.set_footer(text="全員で力を合わせて倒せ！")
-        await notify_channel.send("@everyone", embed=embed)
+        outbox_send(notify_channel, "@everyone", embed=embed, priority=PRIORITY_BOSS)
 
 # =========================
 # イベントボス：クリア処理
@@ -1541,7 +3690,7 @@ async def handle_event_boss_clear(guild, event_boss):
     notify_channel = guild.get_channel(ch_id) if ch_id else None
 
     # 討伐者全員に限定ロール付与
-    role = discord.utils.get(guild.roles, name=EVENT_BOSS_CLEAR_ROLE)
+    role = get_role(guild, EVENT_BOSS_CLEAR_ROLE)
     for uid, dmg in event_boss["damage"].items():
         if dmg <= 0:
             continue
@@ -1550,7 +3699,7 @@ async def handle_event_boss_clear(guild, event_boss):
             await member.add_roles(role)
 
     # MVPランキング
-    sorted_dmg = sorted(event_boss["damage"].items(), key=lambda x: x[1], reverse=True)
+    sorted_dmg = guild_actor(gid).damage_index(event_boss).top(3)
     mvp_text = ""
     medals = ["🥇", "🥈", "🥉"]
     for i, (uid, dmg) in enumerate(sorted_dmg[:3]):
@@ -1580,36 +3729,33 @@ async def handle_event_boss_clear(guild, event_boss):
                 f"🔥 XP **{boost_multi}倍ブースト** {boost_days}日間！"
             )
         )
-        await notify_channel.send(embed=embed)
+        outbox_send(notify_channel, embed=embed, priority=PRIORITY_BOSS)
 
         # MVPへの特別称号メッセージ
         if mvp_uid:
             mvp_dmg = sorted_dmg[0][1]
-            await notify_channel.send(
+            outbox_send(
+                notify_channel,
                 f"👑 **【伝説の討伐者】**\n"
                 f"<@{mvp_uid}> は今回のイベントボス討伐において **{mvp_dmg:,}ダメージ** を叩き出し、\n"
-                f"サーバー最強の討伐者として歴史に名を刻んだ！"
+                f"サーバー最強の討伐者として歴史に名を刻んだ！",
+                priority=PRIORITY_BOSS
             )
 
     # XPブーストを設定
-    asyncio.create_task(event_boss_boost(guild, notify_channel, boost_multi, boost_days))
+    event_boss_boost(guild, boost_multi, boost_days)
 
     # イベントボスをリセット・連続クリア数もリセット
-    reset_event = load_event_boss(gid)
-    reset_event["active"] = False
-    reset_event["consecutive_clears"] = 0
-    save_event_boss(gid, reset_event)
+    await guild_actor(gid).submit(lambda st: st.update_event_boss(active=False, consecutive_clears=0))
     event_boss_active[gid] = False
 
-async def event_boss_boost(guild, notify_channel, multiplier=None, days=None):
-    gid = guild.id
+def event_boss_boost(guild, multiplier=None, days=None):
     m = multiplier if multiplier else EVENT_BOSS_BOOST_MULTIPLIER
     d = days if days else EVENT_BOSS_BOOST_DAYS
-    set_boss_boost(gid, m)
-    await asyncio.sleep(d * 24 * 3600)
-    set_boss_boost(gid, 1)
-    if notify_channel:
-        await notify_channel.send(f"⏱ **イベント討伐ブースト終了！** XPが通常に戻りました。")
+    set_boost(
+        guild.id, "boss", m, time.time() + d * 24 * 3600,
+        "⏱ **イベント討伐ブースト終了！** XPが通常に戻りました。"
+    )
 
 # =========================
 # 週ボス：討伐成功処理
@@ -1619,7 +3765,7 @@ async def handle_boss_clear(guild, boss):
     ch_id = get_level_channel_id(gid)
     notify_channel = guild.get_channel(ch_id) if ch_id else None
 
-    role = discord.utils.get(guild.roles, name=BOSS_CLEAR_ROLE)
+    role = get_role(guild, BOSS_CLEAR_ROLE)
     for uid, dmg in boss["damage"].items():
         if dmg <= 0:
             continue
@@ -1627,7 +3773,7 @@ async def handle_boss_clear(guild, boss):
         if member and role:
             await member.add_roles(role)
 
-    sorted_dmg = sorted(boss["damage"].items(), key=lambda x: x[1], reverse=True)
+    sorted_dmg = guild_actor(gid).damage_index(boss).top(3)
     mvp_text = ""
     medals = ["🥇", "🥈", "🥉"]
     for i, (uid, dmg) in enumerate(sorted_dmg[:3]):
@@ -1643,23 +3789,27 @@ async def handle_boss_clear(guild, boss):
         )
         embed.add_field(name="報酬", value=f"🔥 **次のボス出現まで XP 2倍ブースト** 発動！\n`{BOSS_CLEAR_ROLE}` ロール付与！")
         embed.set_footer(text=f"次のボスHP: {next_hp:,}")
-        await notify_channel.send(embed=embed)
+        outbox_send(notify_channel, embed=embed, priority=PRIORITY_BOSS)
 
-    asyncio.create_task(boss_clear_boost(guild, notify_channel))
+    await boss_clear_boost(guild, notify_channel)
 
     # ボス討伐コイン付与（damage × 0.1）
-    data = load_data(gid)
-    coin_text = ""
-    for uid, dmg in boss["damage"].items():
-        if dmg <= 0:
-            continue
-        coin_reward = int(dmg * 0.1)
-        if coin_reward <= 0:
-            continue
-        info = ensure_user_data(data, uid)
-        info["coins"] = info.get("coins", 0) + coin_reward
-        coin_text += f"<@{uid}> +{coin_reward:,}コイン\n"
-    save_data(gid, data)
+    def grant_clear_coins(st):
+        rewards = []
+        for uid, dmg in boss["damage"].items():
+            if dmg <= 0:
+                continue
+            coin_reward = int(dmg * 0.1)
+            if coin_reward <= 0:
+                continue
+            info = st.user(uid)
+            info["coins"] = info.get("coins", 0) + coin_reward
+            store.mark_dirty(gid, uid, source="boss_clear")
+            rewards.append((uid, coin_reward))
+        return rewards
+
+    rewards = await guild_actor(gid).submit(grant_clear_coins)
+    coin_text = "".join(f"<@{uid}> +{coin_reward:,}コイン\n" for uid, coin_reward in rewards)
 
     if notify_channel and coin_text:
         embed_coin = discord.Embed(
@@ -1667,7 +3817,7 @@ async def handle_boss_clear(guild, boss):
             description=coin_text,
             color=discord.Color.yellow()
         )
-        await notify_channel.send(embed=embed_coin)
+        outbox_send(notify_channel, embed=embed_coin, priority=PRIORITY_BOSS)
 
     # イベントボストリガーチェック
     await check_event_boss_trigger(guild, boss.get("cleared", 0))
@@ -1676,79 +3826,74 @@ async def handle_boss_clear(guild, boss):
 # 週ボス：討伐ブースト
 # =========================
 async def boss_clear_boost(guild, notify_channel):
-    gid = guild.id
-    set_boss_boost(gid, 2)
+    # 次のボス出現（月曜6時）まで。出現時に boss_spawn_task が終了させる
+    next_spawn = weekly_at(0, 6)(datetime.now(JST))
+    set_boost(guild.id, "boss", 2, next_spawn.timestamp(), "⏱ **討伐ブースト終了！** 新しいボスが出現しました！")
     if notify_channel:
-        await notify_channel.send("🔥 **討伐記念 XP 2倍ブースト開始！** 次のボス出現まで継続！")
-
-    now = datetime.now(JST)
-    days_until_monday = (7 - now.weekday()) % 7 or 7
-    next_monday = (now + timedelta(days=days_until_monday)).replace(
-        hour=6, minute=0, second=0, microsecond=0
-    )
-    wait_seconds = (next_monday - now).total_seconds()
-    await asyncio.sleep(wait_seconds)
-
-    set_boss_boost(gid, 1)
-    if notify_channel:
-        await notify_channel.send("⏱ **討伐ブースト終了！** 新しいボスが出現しました！")
+        outbox_send(notify_channel, "🔥 **討伐記念 XP 2倍ブースト開始！** 次のボス出現まで継続！", priority=PRIORITY_BOSS)
 
 # =========================
 # 週ボス：出現タスク（全サーバー・月曜6時）
 # =========================
-@tasks.loop(minutes=1)
-async def boss_spawn_task():
-    now = datetime.now(JST)
-    today = now.strftime("%Y-%m-%d")
+def apply_boss_spawn(actor):
+    """新しい週ボスを出現させる（アクター内で呼ぶ）
+
+    (前のボスが生きていたか, 前のボスの残りHP, 回復量, 新しいボス) を返す。
+    """
+    boss = actor.boss
+    boss_was_alive = boss.get("active", False)
+    cleared = boss.get("cleared", 0)
+    remaining_hp = recover = 0
+
+    if boss_was_alive:
+        # 討伐失敗：残りHP + 最大HPの20%回復（最大HPを上限とする）
+        old_max_hp = boss.get("max_hp", int(BOSS_BASE_HP * (BOSS_HP_SCALE ** cleared)))
+        remaining_hp = boss.get("hp", old_max_hp)
+        recover = int(old_max_hp * 0.2)
+        new_hp = min(remaining_hp + recover, old_max_hp)
+        new_max_hp = old_max_hp  # スケールアップなし
+    else:
+        # 討伐成功 or 初回：通常スケール
+        new_max_hp = int(BOSS_BASE_HP * (BOSS_HP_SCALE ** cleared))
+        new_hp = new_max_hp
 
-    if not (now.weekday() == 0 and now.hour == 6 and now.minute <= 2):
-        return
+    new_boss = {
+        "active": True,
+        "hp": new_hp,
+        "max_hp": new_max_hp,
+        "damage": {},
+        "week": boss.get("week", 0) + 1,
+        "cleared": cleared
+    }
+    actor.set_boss(new_boss)
+    return boss_was_alive, remaining_hp, recover, new_boss
 
+async def boss_spawn_task(fire_time):
+    """毎週月曜6時：週ボス出現"""
+    # 前週のブーストを全サーバー分終了し、設定の書き込みは1回にまとめる
+    ended = False
     for guild in bot.guilds:
-        gid = guild.id
-        if _boss_spawn_announced.get(gid) == today:
-            continue
-        _boss_spawn_announced[gid] = today
+        for kind in ("boss", "time"):
+            ended = await end_boost(guild.id, kind, save=False) or ended
+    if ended:
+        save_config(load_config())
 
+    async def job(guild, run):
+        gid = guild.id
         ch_id = get_level_channel_id(gid)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
 
-        boss = load_boss(gid)
-        boss_was_alive = boss.get("active", False)
+        boss_was_alive, remaining_hp, recover, new_boss = await guild_actor(gid).submit(apply_boss_spawn)
+        new_hp = new_boss["hp"]
+        new_max_hp = new_boss["max_hp"]
 
-        set_boss_boost(gid, 1)
-        set_time_boost(gid, 1)
-
-        cleared = boss.get("cleared", 0)
-
-        if boss_was_alive:
-            # 討伐失敗：残りHP + 最大HPの20%回復（最大HPを上限とする）
-            old_max_hp = boss.get("max_hp", int(BOSS_BASE_HP * (BOSS_HP_SCALE ** cleared)))
-            remaining_hp = boss.get("hp", old_max_hp)
-            recover = int(old_max_hp * 0.2)
-            new_hp = min(remaining_hp + recover, old_max_hp)
-            new_max_hp = old_max_hp  # スケールアップなし
-
-            if notify_channel:
-                await notify_channel.send(
-                    f"💀 **ボスは討伐されませんでした...**\n"
-                    f"ボスが回復して再出現！ HP +{recover:,} 回復！\n"
-                    f"今週こそリベンジだ！"
-                )
-        else:
-            # 討伐成功 or 初回：通常スケール
-            new_max_hp = int(BOSS_BASE_HP * (BOSS_HP_SCALE ** cleared))
-            new_hp = new_max_hp
-
-        new_boss = {
-            "active": True,
-            "hp": new_hp,
-            "max_hp": new_max_hp,
-            "damage": {},
-            "week": boss.get("week", 0) + 1,
-            "cleared": cleared
-        }
-        save_boss(gid, new_boss)
+        if boss_was_alive and notify_channel:
+            await run.send(
+                notify_channel,
+                f"💀 **ボスは討伐されませんでした...**\n"
+                f"ボスが回復して再出現！ HP +{recover:,} 回復！\n"
+                f"今週こそリベンジだ！"
+            )
 
         if notify_channel:
             if boss_was_alive:
@@ -1779,42 +3924,25 @@ async def boss_spawn_task():
             embed.add_field(name="⚔️ 攻撃方法", value="メッセージ送信 or VC参加で自動攻撃！")
             embed.add_field(name="🎁 討伐報酬", value="次のボス出現まで XP 2倍ブースト ＋ 特別ロール")
             embed.set_footer(text="6時間ごとにダメージ報告あり")
-            await notify_channel.send(embed=embed)
+            await run.send(notify_channel, embed=embed)
+
+    await guild_fanout.run(bot.guilds, job, "boss_spawn")
 
 # =========================
 # 週ボス：ダメージ報告（0時・6時・12時・18時）
 # =========================
-_boss_report_fired = {}  # { "YYYY-MM-DD_HH": True }
-
-@tasks.loop(minutes=1)
-async def boss_damage_report():
-    await bot.wait_until_ready()
-
-    now = datetime.now(JST)
-    if now.hour not in [0, 6, 12, 18] or now.minute != 0:
-        return
-
-    fire_key = now.strftime("%Y-%m-%d_%H")
-    if _boss_report_fired.get(fire_key):
-        return
-    _boss_report_fired[fire_key] = True
-
-    # 古いフラグを削除
-    today = now.strftime("%Y-%m-%d")
-    for key in list(_boss_report_fired.keys()):
-        if key.split("_")[0] < today:
-            del _boss_report_fired[key]
-
-    for guild in bot.guilds:
+async def boss_damage_report(fire_time):
+    async def job(guild, run):
         gid = guild.id
-        boss = load_boss(gid)
+        state = await guild_state(gid)
+        boss = state.boss
         if not boss.get("active"):
-            continue
+            return
 
         ch_id = get_level_channel_id(gid)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
         if not notify_channel:
-            continue
+            return
 
         max_hp = boss.get("max_hp", 1)
         current_hp = boss.get("hp", 0)
@@ -1823,7 +3951,7 @@ async def boss_damage_report():
         bar = "█" * filled + "░" * (20 - filled)
         percent = int(progress * 100)
 
-        sorted_dmg = sorted(boss["damage"].items(), key=lambda x: x[1], reverse=True)
+        sorted_dmg = state.boss_index.top(3)
         top_text = ""
         medals = ["🥇", "🥈", "🥉"]
         for i, (uid, dmg) in enumerate(sorted_dmg[:3]):
@@ -1840,13 +3968,17 @@ async def boss_damage_report():
         )
         embed.add_field(name="🏆 ダメージTOP3", value=top_text, inline=False)
         embed.set_footer(text="メッセージを送って攻撃しよう！")
-        await notify_channel.send(embed=embed)
+        await run.send(notify_channel, embed=embed)
+
+    await guild_fanout.run(bot.guilds, job, "boss_damage_report")
 
 
 # =========================
 # /chest（ランダム宝箱）
 # =========================
-chest_cooldowns = {}  # { "guild_id:user_id": timestamp }
+CHEST_COOLDOWN_SECONDS = 3600
+# { "guild_id:user_id": timestamp }（クールダウンが明けたキーは自動で消える）
+chest_cooldowns = TtlMap("chest_cooldowns", CHEST_COOLDOWN_SECONDS, STATE_MAP_MAX_KEYS)
 
 @bot.tree.command(name="chest", description="ランダム宝箱を開ける（1時間に1回）")
 async def chest(interaction: discord.Interaction):
@@ -1856,8 +3988,9 @@ async def chest(interaction: discord.Interaction):
     now = time.time()
 
     # 1時間クールダウン
-    if ck in chest_cooldowns and now - chest_cooldowns[ck] < 3600:
-        remaining = int(3600 - (now - chest_cooldowns[ck]))
+    last_opened = chest_cooldowns.get(ck)
+    if last_opened is not None and now - last_opened < CHEST_COOLDOWN_SECONDS:
+        remaining = int(CHEST_COOLDOWN_SECONDS - (now - last_opened))
         mins = remaining // 60
         secs = remaining % 60
         await interaction.response.send_message(
@@ -1867,24 +4000,28 @@ async def chest(interaction: discord.Interaction):
         return
 
     chest_cooldowns[ck] = now
-    data = load_data(guild_id)
-    info = ensure_user_data(data, user_id)
 
-    # 当日獲得上限チェック
-    today_earned = info.get("coin_daily_earned", 0)
-    if today_earned >= COIN_DAILY_CAP:
+    def open_chest(st):
+        info = st.user(user_id)
+        # 当日獲得上限チェック
+        today_earned = info.get("coin_daily_earned", 0)
+        if today_earned >= COIN_DAILY_CAP:
+            return 0
+        coin_gain = random.randint(10, 100)
+        coin_gain = min(coin_gain, COIN_DAILY_CAP - today_earned)
+        info["coins"] = info.get("coins", 0) + coin_gain
+        info["coin_daily_earned"] = today_earned + coin_gain
+        store.mark_dirty(guild_id, user_id, source="chest")
+        return coin_gain
+
+    coin_gain = await guild_actor(guild_id).submit(open_chest)
+    if coin_gain <= 0:
         await interaction.response.send_message(
             f"💸 今日のコイン獲得上限（{COIN_DAILY_CAP:,}コイン）に達しています。明日またどうぞ！",
             ephemeral=True
         )
         return
 
-    coin_gain = random.randint(10, 100)
-    coin_gain = min(coin_gain, COIN_DAILY_CAP - today_earned)
-    info["coins"] = info.get("coins", 0) + coin_gain
-    info["coin_daily_earned"] = today_earned + coin_gain
-    save_data(guild_id, data)
-
     embed = discord.Embed(
         title="📦 宝箱を開けた！",
         description=f"{interaction.user.mention} が宝箱を開けました！\n💰 **+{coin_gain:,}コイン** 獲得！",
@@ -1900,8 +4037,7 @@ async def chest(interaction: discord.Interaction):
 async def dailymission(interaction: discord.Interaction):
     guild_id = interaction.guild.id
     user_id = str(interaction.user.id)
-    data = load_data(guild_id)
-    info = ensure_user_data(data, user_id)
+    info = await store.load_user(guild_id, user_id)
 
     today = datetime.now(JST).strftime("%Y-%m-%d")
     mission_claimed = info.get("daily_mission_claimed", "")
@@ -1934,20 +4070,26 @@ async def dailymission(interaction: discord.Interaction):
         return
 
     # 達成済み（今日デイリーボーナスを受け取っている = ログイン済み）
-    today_earned = info.get("coin_daily_earned", 0)
-    if today_earned >= COIN_DAILY_CAP:
+    def claim_mission(st):
+        info = st.user(user_id)
+        today_earned = info.get("coin_daily_earned", 0)
+        if today_earned >= COIN_DAILY_CAP or info.get("daily_mission_claimed") == today:
+            return 0
+        mission_coins = min(200, COIN_DAILY_CAP - today_earned)
+        info["coins"] = info.get("coins", 0) + mission_coins
+        info["coin_daily_earned"] = today_earned + mission_coins
+        info["daily_mission_claimed"] = today
+        store.mark_dirty(guild_id, user_id, source="mission")
+        return mission_coins
+
+    mission_coins = await guild_actor(guild_id).submit(claim_mission)
+    if mission_coins <= 0:
         await interaction.response.send_message(
             f"💸 今日のコイン獲得上限（{COIN_DAILY_CAP:,}コイン）に達しています。",
             ephemeral=True
         )
         return
 
-    mission_coins = min(200, COIN_DAILY_CAP - today_earned)
-    info["coins"] = info.get("coins", 0) + mission_coins
-    info["coin_daily_earned"] = today_earned + mission_coins
-    info["daily_mission_claimed"] = today
-    save_data(guild_id, data)
-
     embed = discord.Embed(
         title="🎯 デイリーミッション達成！",
         description=f"今日のログインミッション達成！\n💰 **+{mission_coins}コイン** 獲得！",
@@ -2072,6 +4214,52 @@ async def set_getchannel(
         )
         await interaction.response.send_message(embed=embed)
 
+@set_group.command(name="digest", description="レベルアップ・クリティカル通知をまとめて送るダイジェストモード（管理者用）")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.describe(
+    action="on=有効 / off=無効 / status=現在の設定",
+    seconds="まとめる間隔（秒・on 時に指定。省略時は既定値）"
+)
+@discord.app_commands.choices(action=[
+    discord.app_commands.Choice(name="on - ダイジェストモードを有効にする", value="on"),
+    discord.app_commands.Choice(name="off - 1件ずつ通知に戻す", value="off"),
+    discord.app_commands.Choice(name="status - 現在の設定を確認", value="status"),
+])
+async def set_digest(
+    interaction: discord.Interaction,
+    action: str,
+    seconds: int = None
+):
+    guild_id = interaction.guild.id
+
+    if action == "on":
+        seconds = DIGEST_SECONDS if seconds is None else seconds
+        if not 10 <= seconds <= 3600:
+            await interaction.response.send_message("❌ 間隔は10〜3600秒で指定してください。", ephemeral=True)
+            return
+        set_digest_seconds(guild_id, seconds)
+        embed = discord.Embed(
+            title="✅ ダイジェストモードを有効にしました",
+            description=f"レベルアップ・クリティカルの通知を **{seconds}秒** ごとに1つにまとめて送ります。",
+            color=discord.Color.green()
+        )
+        await interaction.response.send_message(embed=embed)
+
+    elif action == "off":
+        set_digest_seconds(guild_id, 0)
+        embed = discord.Embed(
+            title="🔔 ダイジェストモードを無効にしました",
+            description="レベルアップ・クリティカルの通知を1件ずつ送ります。",
+            color=discord.Color.orange()
+        )
+        await interaction.response.send_message(embed=embed)
+
+    elif action == "status":
+        current = get_guild_config(guild_id).digest_seconds
+        desc = f"有効（**{current}秒** ごとにまとめて通知）" if current else "無効（1件ずつ通知）"
+        embed = discord.Embed(title="📋 ダイジェストモード", description=desc, color=discord.Color.blue())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 bot.tree.add_command(set_group)
 
 
@@ -2104,7 +4292,7 @@ async def setuproles(interaction: discord.Interaction):
     skipped_roles = []
 
     for role_data in roles_to_create:
-        if discord.utils.get(guild.roles, name=role_data["name"]):
+        if get_role(guild, role_data["name"]):
             skipped_roles.append(role_data["name"])
             continue
         try:
@@ -2130,7 +4318,7 @@ async def setuproles(interaction: discord.Interaction):
         max_pos = bot_role.position - 1
         positions = {}
         for i, role_name in enumerate(role_order):
-            role = discord.utils.get(guild.roles, name=role_name)
+            role = get_role(guild, role_name)
             if role:
                 positions[role] = max_pos - i
         if positions:
@@ -2189,7 +4377,8 @@ async def setuproles_error(interaction: discord.Interaction, error):
 # =========================
 @bot.tree.command(name="boss", description="今週のボス状況を確認")
 async def boss_status(interaction: discord.Interaction):
-    boss = load_boss(interaction.guild.id)
+    state = await guild_state(interaction.guild.id)
+    boss = state.boss
 
     if not boss.get("active"):
         await interaction.response.send_message("現在ボスは出現していません。月曜6時に出現します！")
@@ -2205,7 +4394,7 @@ async def boss_status(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
     my_dmg = boss["damage"].get(user_id, 0)
 
-    sorted_dmg = sorted(boss["damage"].items(), key=lambda x: x[1], reverse=True)
+    sorted_dmg = state.boss_index.top(3)
     top_text = ""
     medals = ["🥇", "🥈", "🥉"]
     for i, (uid, dmg) in enumerate(sorted_dmg[:3]):
@@ -2237,7 +4426,7 @@ async def eventboss_start(
     boost: int = 3
 ):
     gid = interaction.guild.id
-    event_boss = load_event_boss(gid)
+    event_boss = (await guild_state(gid)).event_boss
     if event_boss.get("active"):
         await interaction.response.send_message("⚠️ すでにイベントボスが出現中です！", ephemeral=True)
         return
@@ -2249,7 +4438,8 @@ async def eventboss_start(
 
 @eventboss_group.command(name="status", description="イベントボスの状況を確認")
 async def eventboss_status(interaction: discord.Interaction):
-    event_boss = load_event_boss(interaction.guild.id)
+    state = await guild_state(interaction.guild.id)
+    event_boss = state.event_boss
     if not event_boss.get("active"):
         clears = event_boss.get("consecutive_clears", 0)
         await interaction.response.send_message(
@@ -2269,7 +4459,7 @@ async def eventboss_status(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
     my_dmg = event_boss["damage"].get(user_id, 0)
 
-    sorted_dmg = sorted(event_boss["damage"].items(), key=lambda x: x[1], reverse=True)
+    sorted_dmg = state.event_boss_index.top(3)
     top_text = ""
     medals = ["🥇", "🥈", "🥉"]
     for i, (uid, dmg) in enumerate(sorted_dmg[:3]):
@@ -2291,9 +4481,7 @@ async def eventboss_status(interaction: discord.Interaction):
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def eventboss_setname(interaction: discord.Interaction, name: str):
     gid = interaction.guild.id
-    event_boss = load_event_boss(gid)
-    event_boss["name"] = name
-    save_event_boss(gid, event_boss)
+    await guild_actor(gid).submit(lambda st: st.update_event_boss(name=name))
     await interaction.response.send_message(f"✅ 次のイベントボス名を **{name}** に設定しました！", ephemeral=True)
 
 bot.tree.add_command(eventboss_group)
@@ -2303,6 +4491,8 @@ bot.tree.add_command(eventboss_group)
 # =========================
 @bot.event
 async def on_guild_join(guild):
+    # 参加したサーバーのデータを先に読み込んでおく（以降の同期アクセスでイベントループを止めない）
+    await store.load(guild.id)
     roles_to_create = [
         {"name": "MEMBER Lite",  "color": discord.Color.from_rgb(153, 153, 153)},
         {"name": "MEMBER",       "color": discord.Color.from_rgb(59,  165,  93)},
@@ -2322,7 +4512,7 @@ async def on_guild_join(guild):
 
     created_roles = []
     for role_data in roles_to_create:
-        if discord.utils.get(guild.roles, name=role_data["name"]):
+        if get_role(guild, role_data["name"]):
             continue
         try:
             await guild.create_role(
@@ -2351,7 +4541,7 @@ async def on_guild_join(guild):
 
         positions = {}
         for i, role_name in enumerate(role_order):
-            role = discord.utils.get(guild.roles, name=role_name)
+            role = get_role(guild, role_name)
             if role:
                 positions[role] = max_pos - i
 
@@ -2592,10 +4782,8 @@ async def announce(
     embed.timestamp = datetime.now(JST)
 
     prefix = "@everyone\n" if mention_everyone else ""
-    success = 0
-    failed = 0
 
-    for guild in bot.guilds:
+    async def job(guild, run):
         channels_to_send = []
 
         if target in ("notify", "both"):
@@ -2610,16 +4798,15 @@ async def announce(
                 channels_to_send.append(desc_ch)
 
         for ch in channels_to_send:
-            try:
-                await ch.send(prefix, embed=embed)
-                success += 1
-            except Exception:
-                failed += 1
+            await run.send(ch, prefix, embed=embed)
+
+    run = await guild_fanout.run(bot.guilds, job, "announce")
 
     await interaction.followup.send(
         f"✅ アナウンス送信完了！\n"
-        f"・成功: {success}チャンネル\n"
-        f"・失敗: {failed}チャンネル",
+        f"・成功: {run.success}チャンネル\n"
+        f"・失敗: {run.failed}チャンネル"
+        + (f"\n・エラー: {run.errors}サーバー（途中で処理が止まりました）" if run.errors else ""),
         ephemeral=True
     )
 
@@ -2634,24 +4821,14 @@ async def announce_error(interaction: discord.Interaction, error):
 # =========================
 # 全サーバー対抗戦（週間XP合計ランキング）
 # =========================
-_server_ranking_announced = {}  # { date_str: True }
-
 def get_server_weekly_xp(guild):
-    """サーバーの今週の総XPを返す"""
-    data = load_data(guild.id)
-    total = sum(
-        info.get("weekly_xp", 0)
-        for uid, info in data.items()
-        if uid != LAST_DECAY_KEY
-    )
-    active_members = sum(
-        1 for uid, info in data.items()
-        if uid != LAST_DECAY_KEY and info.get("weekly_xp", 0) > 0
-    )
-    return total, active_members
+    """サーバーの今週の (総XP, 参加人数) を返す（GuildStore が差分で保っている値）"""
+    return store.weekly_totals(guild.id)
 
-def build_server_ranking_embed(bot, title="🌐 全サーバー週間XPランキング", color=discord.Color.gold()):
+async def build_server_ranking_embed(bot, title="🌐 全サーバー週間XPランキング", color=discord.Color.gold()):
     """全サーバーのランキングEmbedを生成"""
+    # 未読み込みのサーバー（起動後に参加したサーバーなど）はI/Oスレッドで読んでおく
+    await asyncio.gather(*(store.load(guild.id) for guild in bot.guilds))
     results = []
     for guild in bot.guilds:
         total_xp, active = get_server_weekly_xp(guild)
@@ -2672,21 +4849,11 @@ def build_server_ranking_embed(bot, title="🌐 全サーバー週間XPランキ
     embed.set_footer(text="集計期間：今週（月曜リセット）")
     return embed, results
 
-@tasks.loop(minutes=1)
-async def server_ranking_task():
-    await bot.wait_until_ready()
-    now = datetime.now(JST)
-
-    # 毎週水曜（weekday=2）15:00に発表
-    if not (now.weekday() == 2 and now.hour == 15 and now.minute == 0):
-        return
-
-    date_key = now.strftime("%Y-%m-%d")
-    if _server_ranking_announced.get(date_key):
-        return
-    _server_ranking_announced[date_key] = True
+async def server_ranking_task(fire_time):
+    """毎週水曜15時：全サーバー対抗戦の戦況レポート"""
+    now = fire_time
 
-    embed, results = build_server_ranking_embed(
+    embed, results = await build_server_ranking_embed(
         bot,
         title="🏆 今週の全サーバー対抗戦 戦況レポート！",
         color=discord.Color.gold()
@@ -2700,19 +4867,19 @@ async def server_ranking_task():
         top_guild, top_xp, _ = results[0]
         top_msg = f"\n🎉 今週の首位は **{top_guild.name}**！ 総XP **{top_xp:,}**"
 
-    for guild in bot.guilds:
+    async def job(guild, run):
         ch_id = get_level_channel_id(guild.id)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
         if notify_channel:
-            try:
-                await notify_channel.send(content=top_msg if top_msg else None, embed=embed)
-            except (discord.Forbidden, discord.HTTPException):
-                pass
+            await run.send(notify_channel, content=top_msg if top_msg else None, embed=embed)
+
+    await guild_fanout.run(bot.guilds, job, "server_ranking")
 
 @bot.tree.command(name="serverranking", description="全サーバーの今週のXPランキングを表示")
 async def serverranking(interaction: discord.Interaction):
-    embed, _ = build_server_ranking_embed(bot)
-    await interaction.response.send_message(embed=embed)
+    await interaction.response.defer()
+    embed, _ = await build_server_ranking_embed(bot)
+    await interaction.followup.send(embed=embed)
 
 
 # =========================
@@ -2726,21 +4893,15 @@ async def startbattle(interaction: discord.Interaction):
 
     await interaction.response.defer(ephemeral=True)
 
-    reset_count = 0
-    for guild in bot.guilds:
-        data = load_data(guild.id)
-        for uid in data:
-            if uid == LAST_DECAY_KEY:
-                continue
-            data[uid]["weekly_xp"] = 0
-            data[uid]["weekly_chat_xp"] = 0
-            data[uid]["weekly_vc_xp"] = 0
-            data[uid]["weekly_active_days"] = []
-        save_data(guild.id, data)
-        reset_count += 1
+    def reset_weekly(st):
+        store.reset_weekly_counters(st.guild_id)
 
-    # 発表済みフラグもリセット（今週の水曜レポートを再送できるように）
-    _server_ranking_announced.clear()
+    async def reset_job(guild, run):
+        await guild_actor(guild.id).submit(reset_weekly)
+
+    # リセットはAPIを呼ばないので、例外で止まったサーバー（errors）以外はリセット済み
+    reset_run = await guild_fanout.run(bot.guilds, reset_job, "startbattle_reset")
+    reset_count = len(bot.guilds) - reset_run.errors
 
     now_str = datetime.now(JST).strftime("%Y/%m/%d %H:%M")
 
@@ -2757,20 +4918,235 @@ async def startbattle(interaction: discord.Interaction):
     )
     announce_embed.set_footer(text=f"スタート時刻：{now_str} JST")
 
-    for guild in bot.guilds:
+    async def job(guild, run):
         ch_id = get_level_channel_id(guild.id)
         notify_channel = guild.get_channel(ch_id) if ch_id else None
         if notify_channel:
-            try:
-                await notify_channel.send(embed=announce_embed)
-            except (discord.Forbidden, discord.HTTPException):
-                pass
+            await run.send(notify_channel, embed=announce_embed)
+
+    await guild_fanout.run(bot.guilds, job, "startbattle")
 
     await interaction.followup.send(
-        f"✅ {reset_count}サーバーのXPをリセットし、対抗戦をスタートしました！",
+        f"✅ {reset_count}サーバーのXPをリセットし、対抗戦をスタートしました！"
+        + (f"\n⚠️ リセット失敗: {reset_run.errors}サーバー" if reset_run.errors else ""),
+        ephemeral=True
+    )
+
+
+# =========================
+# GuildStore 定期書き戻し
+# =========================
+@tasks.loop(seconds=STORE_FLUSH_INTERVAL)
+async def store_flush_task():
+    flush_guild_actors()
+    store.flush_all()
+    # ジャーナルが大きくなったサーバーは間隔を待たずにスナップショット化
+    if isinstance(store.backend, JournalBackend):
+        for gid in store.loaded_guilds():
+            if await storage_io.run(store.backend.needs_compaction, gid):
+                store.compact(gid)
+
+@tasks.loop(minutes=JOURNAL_COMPACT_INTERVAL)
+async def journal_compact_task():
+    for gid in store.loaded_guilds():
+        store.compact(gid)
+
+# =========================
+# 期限つきマップの掃除と統計
+# =========================
+@tasks.loop(seconds=TTL_SWEEP_SECONDS)
+async def ttl_sweep_task():
+    for ttl_map in ttl_maps:
+        ttl_map.sweep()
+
+@bot.tree.command(name="cachestats", description="【bot管理者専用】メモリ上の期限つきマップの状態を表示")
+async def cachestats(interaction: discord.Interaction):
+    if not is_bot_admin(interaction.user.id):
+        await interaction.response.send_message("❌ このコマンドはbot管理者のみ使用できます。", ephemeral=True)
+        return
+
+    lines = []
+    for ttl_map in ttl_maps:
+        st = ttl_map.stats
+        lines.append(
+            f"**{ttl_map.name}** {len(ttl_map):,} / {ttl_map.max_size:,}件（TTL {ttl_map.ttl}秒）\n"
+            f"ヒット {st['hits']:,} ／ ミス {st['misses']:,} ／ 期限切れ {st['expired']:,} ／ 上限超え {st['evicted']:,}"
+        )
+    embed = discord.Embed(title="🧮 期限つきマップ", description="\n".join(lines), color=discord.Color.blue())
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# =========================
+# ランクロールのバックグラウンド整合
+# =========================
+# 同時に処理するサーバー数（ロール変更のレート制限はサーバー単位なので、1サーバーは1ワーカーで順に処理）
+ROLE_RECONCILE_WORKERS = int(os.environ.get("ROLE_RECONCILE_WORKERS", "2"))
+# 同じサーバーでロールを変更したあとに空ける間隔（秒）
+ROLE_RECONCILE_SPACING = float(os.environ.get("ROLE_RECONCILE_SPACING", "0.5"))
+# 完了済みのサーバーをもう一度見直すまでの時間
+ROLE_RECONCILE_REFRESH_HOURS = int(os.environ.get("ROLE_RECONCILE_REFRESH_HOURS", "24"))
+# この人数ごとにチェックポイントを保存
+ROLE_RECONCILE_CHECKPOINT_EVERY = 50
+
+def role_checkpoint_file():
+    return f"{DATA_DIR}/role_reconcile.json"
+
+class RoleReconciler:
+    """全メンバーのランクロールを、起動処理を止めずにバックグラウンドで目標に合わせる
+
+    ・サーバー単位のキューを ROLE_RECONCILE_WORKERS 個のワーカーで処理
+    ・user_id 順に進み、どこまで済んだかをチェックポイントファイルに保存
+      （再接続・再起動後は続きから。完了済みのサーバーは REFRESH_HOURS 経つまで飛ばす）
+    ・429 が返ったら retry_after だけ待って同じメンバーをやり直す
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.progress = {}     # { guild_id: {"state", "done", "total", "changed", "failed"} }
+        self.checkpoint = None  # { "guild_id": {"cursor": user_id, "completed": ISO時刻 or None} }
+        self._workers = []
+
+    async def start(self, guilds):
+        if self.checkpoint is None:
+            self.checkpoint = await storage_io.run(read_json, role_checkpoint_file(), {})
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(max(1, ROLE_RECONCILE_WORKERS))]
+
+        now = datetime.now(timezone.utc)
+        for guild in guilds:
+            if self.progress.get(guild.id, {}).get("state") in ("queued", "running"):
+                continue
+            completed = self.checkpoint.get(str(guild.id), {}).get("completed")
+            if completed and now - datetime.fromisoformat(completed) < timedelta(hours=ROLE_RECONCILE_REFRESH_HOURS):
+                self.progress.setdefault(guild.id, {"state": "done", "done": 0, "total": 0, "changed": 0, "failed": 0})
+                continue
+            if completed:
+                # 見直しの時期なので最初からやり直す
+                self.checkpoint[str(guild.id)] = {"cursor": None, "completed": None}
+            self.progress[guild.id] = {"state": "queued", "done": 0, "total": 0, "changed": 0, "failed": 0}
+            self.queue.put_nowait(guild.id)
+
+    def _save_checkpoint(self):
+        storage_io.write(
+            ("role_checkpoint",), lambda c: write_json_atomic(role_checkpoint_file(), c), snapshot(self.checkpoint)
+        )
+
+    async def _worker(self):
+        while True:
+            guild_id = await self.queue.get()
+            try:
+                await self._reconcile_guild(guild_id)
+            except Exception as e:
+                self.progress[guild_id]["state"] = "error"
+                print(f"[role reconcile] guild {guild_id}: {e}")
+
+    async def _reconcile_guild(self, guild_id):
+        guild = bot.get_guild(guild_id)
+        progress = self.progress[guild_id]
+        if guild is None:
+            progress["state"] = "skipped"
+            return
+        if not guild.me.guild_permissions.manage_roles:
+            progress["state"] = "forbidden"
+            return
+        progress["state"] = "running"
+
+        entry = self.checkpoint.setdefault(str(guild_id), {"cursor": None, "completed": None})
+        users = await store.load(guild_id)
+        user_ids = sorted(users)
+        start = bisect.bisect_right(user_ids, entry["cursor"]) if entry["cursor"] else 0
+        progress["total"] = len(user_ids)
+        progress["done"] = start
+
+        for i in range(start, len(user_ids)):
+            user_id = user_ids[i]
+            member = guild.get_member(int(user_id))
+            if member:
+                try:
+                    await self._reconcile_member(member, users[user_id].get("level", 1), progress)
+                except discord.Forbidden:
+                    # 途中で「ロールの管理」権限が外された：残りのメンバーも全員失敗するので打ち切る
+                    # （cursor は進めないので、権限が付いたあとの再接続でこのメンバーから続ける）
+                    progress["state"] = "forbidden"
+                    self._save_checkpoint()
+                    return
+            elif i % 500 == 0:
+                await asyncio.sleep(0)
+            progress["done"] = i + 1
+            entry["cursor"] = user_id
+            if progress["done"] % ROLE_RECONCILE_CHECKPOINT_EVERY == 0:
+                self._save_checkpoint()
+
+        entry["completed"] = datetime.now(timezone.utc).isoformat()
+        progress["state"] = "done"
+        self._save_checkpoint()
+
+    async def _reconcile_member(self, member, level, progress):
+        while True:
+            try:
+                changed = await update_rank_role(member, level)
+            except discord.RateLimited as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except discord.Forbidden:
+                # 権限自体がなければサーバーごと打ち切る（ロール階層で触れないメンバーだけなら失敗扱い）
+                if not member.guild.me.guild_permissions.manage_roles:
+                    raise
+                progress["failed"] += 1
+                return
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    await asyncio.sleep(5)
+                    continue
+                progress["failed"] += 1
+                return
+            break
+        if changed:
+            progress["changed"] += 1
+            await asyncio.sleep(ROLE_RECONCILE_SPACING)
+        else:
+            # ロールが合っているメンバーはAPIを呼ばないので、たまにイベントループへ譲るだけ
+            await asyncio.sleep(0)
+
+role_reconciler = RoleReconciler()
+
+@bot.tree.command(name="rolesync", description="ランクロール整合の進捗を確認（管理者用）")
+@discord.app_commands.checks.has_permissions(administrator=True)
+async def rolesync(interaction: discord.Interaction):
+    progress = role_reconciler.progress.get(interaction.guild.id)
+    if not progress:
+        await interaction.response.send_message("ランクロールの整合はまだ始まっていません。", ephemeral=True)
+        return
+
+    state_names = {
+        "queued": "⏳ 待機中", "running": "🔄 実行中", "done": "✅ 完了",
+        "skipped": "⏭ スキップ", "error": "⚠️ エラー",
+        "forbidden": "🚫 中断（botに「ロールの管理」権限がありません）",
+    }
+    total = progress["total"]
+    percent = int(progress["done"] / total * 100) if total else 100
+    await interaction.response.send_message(
+        f"**ランクロール整合** {state_names.get(progress['state'], progress['state'])}\n"
+        f"進捗: {progress['done']:,} / {total:,}（{percent}%）\n"
+        f"変更: {progress['changed']:,}人 ／ 失敗: {progress['failed']:,}人",
         ephemeral=True
     )
 
+@rolesync.error
+async def rolesync_error(interaction: discord.Interaction, error):
+    if isinstance(error, discord.app_commands.MissingPermissions):
+        await interaction.response.send_message("❌ このコマンドは管理者権限が必要です！", ephemeral=True)
+
+# =========================
+# 定期処理の登録
+# =========================
+# grace: 停止中に過ぎた回を起動後に実行してよい猶予
+scheduler.add("weekly_ranking", weekly_at(0, 18), weekly_ranking_task, grace=timedelta(days=6))
+scheduler.add("weekly_mid_announcement", daily_at(21), weekly_mid_announcement, grace=timedelta(hours=1))
+scheduler.add("decay", daily_at(0), decay_task, grace=timedelta(days=1))
+scheduler.add("xp_boost_start", boost_times(), xp_boost_start, grace=timedelta(minutes=50))
+scheduler.add("boss_spawn", weekly_at(0, 6), boss_spawn_task, grace=timedelta(days=6))
+scheduler.add("boss_damage_report", daily_at(0, 6, 12, 18), boss_damage_report, grace=timedelta(minutes=30))
+scheduler.add("server_ranking", weekly_at(2, 15), server_ranking_task, grace=timedelta(hours=6))
 
 # =========================
 # 起動時
@@ -2781,22 +5157,22 @@ async def on_ready():
     print(f"{len(synced)} commands synced | Logged in as {bot.user}")
     print(f"接続中のサーバー: {[g.name for g in bot.guilds]}")
 
-    if not weekly_ranking_task.is_running():
-        weekly_ranking_task.start()
-    if not weekly_mid_announcement.is_running():
-        weekly_mid_announcement.start()
-    if not decay_task.is_running():
-        decay_task.start()
-    if not xp_boost_scheduler.is_running():
-        xp_boost_scheduler.start()
-    if not boss_spawn_task.is_running():
-        boss_spawn_task.start()
-    if not boss_damage_report.is_running():
-        boss_damage_report.start()
-    if not server_ranking_task.is_running():
-        server_ranking_task.start()
-
-    # 既存サーバーのconfig確認・ランクロール更新
+    # 設定と全サーバーのデータをI/Oスレッドで先読みしておく
+    await preload_config()
+    await asyncio.gather(*(store.load(g.id) for g in bot.guilds))
+
+    await scheduler.start()
+    start_boost_timers()
+    if not vc_xp_tick.is_running():
+        vc_xp_tick.start()
+    if not store_flush_task.is_running():
+        store_flush_task.start()
+    if isinstance(store.backend, JournalBackend) and not journal_compact_task.is_running():
+        journal_compact_task.start()
+    if not ttl_sweep_task.is_running():
+        ttl_sweep_task.start()
+
+    # 既存サーバーのconfig確認
     for guild in bot.guilds:
         # config未登録のサーバーはチャンネルを探して登録
         if not get_level_channel_id(guild.id):
@@ -2805,22 +5181,35 @@ async def on_ready():
                 set_level_channel_id(guild.id, existing.id)
                 print(f"[{guild.name}] レベル通知チャンネルを自動登録しました (ID: {existing.id})")
 
-        data = load_data(guild.id)
-        for user_id, info in data.items():
-            if user_id == LAST_DECAY_KEY:
-                continue
-            member = guild.get_member(int(user_id))
-            if member:
-                await update_rank_role(member, info.get("level", 1))
-                await asyncio.sleep(0.5)
+    # ランクロールの整合はバックグラウンドで（再接続時は済んだ分を飛ばす）
+    await role_reconciler.start(bot.guilds)
 
 # =========================
 # Run
 # =========================
+def _handle_sigterm(signum, frame):
+    # bot.run() は KeyboardInterrupt で正常終了するので、SIGTERMも同じ扱いにする
+    raise KeyboardInterrupt
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        # python main.py migrate [旧levels.jsonを取り込むサーバーID]
+        migrate_json_to_sqlite(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        sys.exit(0)
+
     keep_alive()
     token = os.environ.get("TOKEN")
     if token:
-        bot.run(token)
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+        try:
+            bot.run(token)
+        finally:
+            # 終了時に未保存の変更を書き戻し、I/Oスレッドの書き込み完了を待つ
+            # （アクターに積まれた変更 → その後に溜まったXP の順に適用してから書き出す）
+            drain_guild_actors()
+            flush_xp_accumulators()
+            flush_guild_actors()
+            store.flush_all()
+            storage_io.shutdown()
     else:
         print("Error: TOKEN not set")
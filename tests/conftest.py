@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """DATA_DIR を一時ディレクトリに向ける"""
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def storage_io(monkeypatch):
+    """テストごとのI/Oスレッド（終了時に書き込みの完了を待って止める）"""
+    executor = main.StorageExecutor()
+    monkeypatch.setattr(main, "storage_io", executor)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def store(data_dir):
+    """I/Oを伴わないように、読み込み済み・自動フラッシュなしの空のサーバー(1)を持つ GuildStore"""
+    st = main.GuildStore(main.JsonBackend(), dirty_threshold=10**9)
+    st._set_loaded(1, {}, {})
+    return st
+
+
+@pytest.fixture
+def actors(data_dir, storage_io, monkeypatch):
+    """一時ディレクトリの JsonBackend を使う GuildStore と、空のアクター表"""
+    st = main.GuildStore(main.JsonBackend(), dirty_threshold=10**9)
+    monkeypatch.setattr(main, "store", st)
+    monkeypatch.setattr(main, "guild_actors", {})
+    return st
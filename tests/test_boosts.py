@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+def test_timer_wheel_runs_past_expiries_scheduled_before_start():
+    async def scenario():
+        wheel = main.TimerWheel(tick=0.01, slots=64)
+        fired = []
+
+        async def callback():
+            fired.append(time.time())
+
+        wheel.schedule(time.time() - 30, callback)
+        wheel.schedule(time.time() - 0.5, callback)
+        wheel.start()
+        await asyncio.sleep(0.1)
+        return wheel, fired
+
+    wheel, fired = asyncio.run(scenario())
+    assert len(fired) == 2
+    assert wheel.count == 0
+
+
+def test_timer_wheel_runs_past_expiries_scheduled_while_running():
+    async def scenario():
+        wheel = main.TimerWheel(tick=0.01, slots=64)
+        fired = []
+
+        async def callback():
+            fired.append("past")
+
+        wheel.start()
+        await asyncio.sleep(0.03)
+        wheel.schedule(time.time() - 30, callback)
+        await asyncio.sleep(0.05)
+        return fired
+
+    assert asyncio.run(scenario()) == ["past"]
+
+
+@pytest.fixture
+def boost_config(monkeypatch):
+    """メモリ上の設定だけを使い、save_config() の呼び出しを記録する"""
+    saves = []
+    monkeypatch.setattr(main, "_config_cache", {})
+    monkeypatch.setattr(main, "_guild_config_cache", {})
+    monkeypatch.setattr(main, "save_config", lambda config, guild_id=None: saves.append(guild_id))
+    monkeypatch.setattr(main, "boost_timers", main.TimerWheel())
+    return saves
+
+
+def test_startup_drops_expired_boosts_without_notice(boost_config, monkeypatch):
+    ended = []
+
+    async def end_boost(guild_id, kind, expires_at=None, save=True):
+        ended.append((guild_id, kind))
+
+    monkeypatch.setattr(main, "end_boost", end_boost)
+    now = time.time()
+    main._config_cache.update({
+        "1": {"boosts": {
+            "time": {"multiplier": 2, "expires_at": now - 3 * 86400, "end_message": "end"},
+            "boss": {"multiplier": 2, "expires_at": now + 3600, "end_message": "end"},
+        }},
+    })
+
+    async def scenario():
+        main.start_boost_timers()
+        await asyncio.sleep(0.05)
+        main.boost_timers._task.cancel()
+
+    asyncio.run(scenario())
+    assert list(main._config_cache["1"]["boosts"]) == ["boss"]
+    assert main.boost_timers.count == 1
+    assert ended == []
+    assert boost_config == [None]
+
+
+def test_boosts_can_be_set_and_ended_with_one_save(boost_config):
+    async def scenario():
+        for gid in (1, 2, 3):
+            main.set_boost(gid, "time", 2, time.time() + 3600, save=False)
+        assert main.get_boost(2)["multiplier"] == 2
+        ended = [await main.end_boost(gid, "time", save=False) for gid in (1, 2, 3, 4)]
+        return ended
+
+    assert asyncio.run(scenario()) == [True, True, True, False]
+    assert main.get_boost(2)["multiplier"] == 1
+    assert boost_config == []
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000]
+    monkeypatch.setattr(main, "now_ts", lambda: now[0])
+    return now
+
+
+def test_buff_engine_caches_until_next_expiry(clock):
+    info = main.UserRecord()
+    engine = main.BuffEngine()
+    assert engine.effects("10", info) is main.NO_BUFFS
+    assert "10" not in engine._effects  # バフのないユーザーは持たない
+
+    main.add_timed_buff(info, "xp_multiplier", 2.0, 60, "potion")
+    main.add_timed_buff(info, "crit_bonus", True, 30, "charm")
+    engine.invalidate("10")
+    effects = engine.effects("10", info)
+    assert (effects.xp_multiplier, effects.crit_bonus, effects.next_expiry) == (2.0, True, clock[0] + 30)
+    assert engine.effects("10", info) is effects
+
+    # 一番早い期限を過ぎたら作り直す
+    clock[0] += 30
+    effects = engine.effects("10", info)
+    assert (effects.xp_multiplier, effects.crit_bonus) == (2.0, False)
+    clock[0] += 30
+    assert engine.effects("10", info) is main.NO_BUFFS
+    assert "10" not in engine._effects and info.buffs == {}
+
+
+def test_add_timed_buff_extends_active_buff(clock):
+    info = main.UserRecord()
+    first = main.add_timed_buff(info, "xp_multiplier", 2.0, 60, "potion")
+    clock[0] += 10
+    assert main.add_timed_buff(info, "xp_multiplier", 2.0, 60, "potion") == first + 60
+
+
+def test_expiry_heap_notifies_in_expiry_order(actors, monkeypatch):
+    notified = []
+    monkeypatch.setattr(main, "notify_buff_end", lambda *args: notified.append(args[1]))
+
+    async def go():
+        heap = main.BuffExpiryHeap()
+        now = time.time()
+        heap.push(now + 0.05, 1, "late", "xp_multiplier", "", "")
+        # 先頭より早い期限を入れると、眠っているタスクを起こしてそちらを先に通知する
+        heap.push(now + 0.01, 1, "early", "xp_multiplier", "", "")
+        await asyncio.sleep(0.03)
+        assert notified == ["early"]
+        await asyncio.sleep(0.05)
+        heap._task.cancel()
+
+    asyncio.run(go())
+    assert notified == ["early", "late"]
+
+
+def test_notify_buff_end_skips_extended_buff(actors, monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "outbox_send", lambda channel, content=None, **kwargs: sent.append(content))
+    monkeypatch.setattr(main, "get_level_channel_id", lambda guild_id: 5)
+    channel = SimpleNamespace(id=5)
+    monkeypatch.setattr(main.bot, "get_guild", lambda guild_id: SimpleNamespace(get_channel=lambda ch_id: channel))
+
+    actors._set_loaded(1, {"10": {"buffs": {"xp_multiplier": {"value": 2.0, "expires_at": 200, "item_id": "p"}}}}, {})
+    main.notify_buff_end(1, "10", "xp_multiplier", 100, "name", "potion")  # 買い足しで延びた
+    assert sent == []
+    main.notify_buff_end(1, "10", "xp_multiplier", 200, "name", "potion")
+    assert len(sent) == 1 and "potion" in sent[0]
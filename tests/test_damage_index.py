@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import main
+
+
+def test_ranked_damage_sorts_copy_by_damage_then_user_id():
+    boss = {"hp": 10, "damage": {"3": 5, "1": 5, "2": 9}}
+    ranked = main.ranked_damage(boss)
+    assert list(ranked["damage"].items()) == [("2", 9), ("1", 5), ("3", 5)]
+    assert list(boss["damage"]) == ["3", "1", "2"]  # 元のボスはそのまま
+
+
+def test_json_backend_writes_damage_in_rank_order(data_dir):
+    main.JsonBackend().save_boss(1, {**main.default_boss(), "damage": {"a": 1, "b": 3, "c": 2}})
+    with open(main.boss_file(1)) as f:
+        assert list(json.load(f)["damage"]) == ["b", "c", "a"]
+
+
+def test_damage_index_is_shared_and_follows_boss_changes(actors):
+    async def go():
+        actor = main.guild_actor(1)
+        await actor.ensure_loaded()
+        actor.set_boss({**main.default_boss(), "active": True, "hp": 100, "max_hp": 100})
+        actor.set_event_boss({**main.default_event_boss(), "active": True, "hp": 100, "max_hp": 100})
+        return actor
+
+    actor = asyncio.run(go())
+    actor.damage_boss("1", 10)
+    actor.damage_boss("2", 30)
+    actor.damage_event_boss("1", 5)
+
+    assert actor.damage_index(actor.boss) is actor.boss_index
+    assert actor.damage_index(actor.event_boss) is actor.event_boss_index
+    assert actor.boss_index.top() == [("2", 30), ("1", 10)]
+    assert actor.event_boss_index.top() == [("1", 5)]
+
+    # damage を差し替えたらインデックスも作り直す
+    actor.update_boss(damage={"3": 1})
+    assert actor.damage_index(actor.boss).top() == [("3", 1)]
+
+    # 現在のボス以外はその場で作る
+    other = {"damage": {"9": 2, "8": 4}}
+    assert actor.damage_index(other).top() == [("8", 4), ("9", 2)]
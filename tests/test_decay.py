@@ -0,0 +1,67 @@
+import main
+from main import DECAY_EPOCH_KEY, DECAY_PERCENT
+
+
+def record(**fields):
+    info = main.UserRecord()
+    for key, value in fields.items():
+        setattr(info, key, value)
+    return info
+
+
+def test_decay_is_settled_on_read(store):
+    info = store.user(1, "10")
+    info.xp = 1000
+    store.meta(1)[DECAY_EPOCH_KEY] = 2
+
+    info = store.user(1, "10")
+    assert info.xp == int(1000 * (1 - DECAY_PERCENT) ** 2)
+    assert info.decay_epoch == 2
+    assert "10" in store._dirty[1]
+
+    # 追いついたあとは何度読んでも減らない
+    assert store.user(1, "10").xp == int(1000 * (1 - DECAY_PERCENT) ** 2)
+
+
+def test_apply_decay_advances_epoch_once_per_day(store, monkeypatch):
+    monkeypatch.setattr(main, "store", store)
+    actor = main.GuildActor(1)
+    for _ in range(2):
+        main.apply_decay(actor, "2026-10-18")
+    assert store.meta(1)[DECAY_EPOCH_KEY] == 1
+    assert 1 in store._meta_dirty
+
+    main.apply_decay(actor, "2026-10-19")
+    assert store.meta(1)[DECAY_EPOCH_KEY] == 2
+
+
+def test_rank_order_is_unchanged_by_unsettled_decay(store):
+    for uid, xp in (("1", 900), ("2", 300), ("3", 600)):
+        store.user(1, uid).xp = xp
+        store.mark_dirty(1, uid)
+    total = store.ranks(1)["total"]
+
+    # 減衰を進めて一部のユーザーだけ読む（読んだユーザーだけXPが減る）
+    store.meta(1)[DECAY_EPOCH_KEY] = 3
+    store.user(1, "1")
+    assert store.ranks(1)["total"] is total
+    assert [uid for uid, _ in total.top()] == ["1", "3", "2"]
+
+
+def test_rank_index_total_xp_key_with_float_keys():
+    users = {
+        "1": record(level=5, xp=120),
+        "2": record(level=5, xp=0),
+        "3": record(level=6, xp=1, decay_epoch=3),
+        "4": record(level=5, xp=120, decay_epoch=1),
+    }
+    index = main.RankIndex(main.total_xp_key, users)
+    # 同じレベルなら減衰を正規化したXPで比べる（減衰1回分のXPを持つ4が1より上）
+    assert [uid for uid, _ in index.top()] == ["3", "4", "1", "2"]
+
+    users["2"].xp = 500
+    index.update("2", users["2"])
+    users["4"].xp = 0
+    index.update("4", users["4"])
+    assert [uid for uid, _ in index.top()] == ["3", "2", "1", "4"]
+    assert len(index) == 4
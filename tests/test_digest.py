@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """outbox_send の呼び出しを [(channel, kwargs)] に記録する"""
+    calls = []
+    monkeypatch.setattr(main, "outbox_send", lambda channel, content=None, **kwargs: calls.append((channel, kwargs)))
+    return calls
+
+
+def test_flush_counts_unique_users_and_crits(sent):
+    digest = main.NotificationDigest(SimpleNamespace(id=1), 60)
+    digest.level_ups = [("10", "a Lv2"), ("10", "a Lv3"), ("20", "b Lv5")]
+    digest.crits = ["crit"]
+    digest.flush()
+
+    (_, kwargs), = sent
+    embed = kwargs["embed"]
+    assert embed.title == "📣 2人がレベルアップ・クリティカル1回"
+    assert embed.fields[0].value == "a Lv2\na Lv3\nb Lv5\n"
+    assert kwargs["priority"] == main.PRIORITY_LEVEL
+
+    # 空のときは送らない
+    digest.flush()
+    assert len(sent) == 1
+
+
+def test_digest_sends_once_per_window(sent):
+    async def go():
+        digest = main.NotificationDigest(SimpleNamespace(id=1), 0.01)
+        digest.add_crit("c1")
+        digest.add_crit("c2")
+        await asyncio.sleep(0.05)
+        digest.add_crit("c3")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(go())
+    assert [kwargs["embed"].title for _, kwargs in sent] == ["📣 クリティカル2回", "📣 クリティカル1回"]
+    assert all(kwargs["priority"] == main.PRIORITY_CRIT for _, kwargs in sent)
+
+
+def test_digest_lines_fit_field_limit():
+    lines = [f"line {i:03}" for i in range(200)]
+    text = main.digest_lines(lines, limit=100)
+    assert len(text) <= 100
+    shown = text.count("line ")
+    assert text.endswith(f"…ほか{200 - shown}件")
+    assert main.digest_lines(["a", "b"]) == "a\nb\n"
+
+
+def test_get_digest_only_for_digest_guilds(monkeypatch):
+    monkeypatch.setattr(main, "_config_cache", {"1": {"digest_seconds": 30}})
+    monkeypatch.setattr(main, "_guild_config_cache", {})
+    monkeypatch.setattr(main, "digests", {})
+    channel = SimpleNamespace(id=5)
+
+    assert main.get_digest(2, channel) is None
+    digest = main.get_digest(1, channel)
+    assert digest.window == 30
+    assert main.get_digest(1, channel) is digest
@@ -0,0 +1,58 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+import main
+
+
+def guilds(n):
+    return [SimpleNamespace(id=i) for i in range(n)]
+
+
+def test_fanout_counts_calls_and_job_errors_separately():
+    async def ok():
+        return "sent"
+
+    async def broken():
+        raise RuntimeError("send failed")
+
+    async def job(guild, run):
+        if guild.id == 0:
+            raise RuntimeError("job failed")
+        await run.call(("channel", guild.id), ok)
+        if guild.id == 1:
+            assert await run.call(("channel", guild.id), broken) is None
+
+    run = asyncio.run(main.GuildFanout(concurrency=4).run(guilds(3), job, "test"))
+    assert (run.success, run.failed, run.errors) == (2, 1, 1)
+
+
+def test_fanout_limits_concurrency():
+    active = 0
+    peak = 0
+
+    async def job(guild, run):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    asyncio.run(main.GuildFanout(concurrency=2).run(guilds(6), job))
+    assert peak == 2
+
+
+def test_call_on_route_waits_and_retries_after_429(monkeypatch):
+    monkeypatch.setattr(main, "route_resume", {})
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise discord.RateLimited(0.01)
+        return "ok"
+
+    assert asyncio.run(main.call_on_route(("channel", 1), flaky)) == "ok"
+    assert len(attempts) == 2
+    assert ("channel", 1) in main.route_resume
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def test_actor_applies_functions_in_order(actors):
+    async def scenario():
+        actor = main.guild_actor(1)
+        seen = []
+
+        def step(n):
+            def fn(st):
+                seen.append(n)
+                return n * 10
+            return fn
+
+        results = await asyncio.gather(*(actor.submit(step(n)) for n in range(5)))
+        return seen, results
+
+    seen, results = asyncio.run(scenario())
+    assert seen == [0, 1, 2, 3, 4]
+    assert results == [0, 10, 20, 30, 40]
+
+
+def test_actor_keeps_running_after_an_error(actors):
+    def broken(st):
+        raise ValueError("boom")
+
+    async def scenario():
+        actor = main.guild_actor(1)
+        with pytest.raises(ValueError):
+            await actor.submit(broken)
+        return await actor.submit(lambda st: st.user("10").xp)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_actor_shares_state_with_the_store(actors):
+    async def scenario():
+        actor = main.guild_actor(1)
+
+        def gain(st):
+            st.user("10").coins += 5
+            main.store.mark_dirty(st.guild_id, "10")
+
+        await asyncio.gather(*(actor.submit(gain) for _ in range(3)))
+        return actor
+
+    actor = asyncio.run(scenario())
+    assert actors.user(1, "10").coins == 15
+    assert actor.users is actors.users(1)
+
+
+def test_damage_boss_tracks_ranking_and_clear(actors):
+    async def scenario():
+        actor = main.guild_actor(1)
+        await actor.ensure_loaded()
+        actor.set_boss({**main.default_boss(), "active": True, "hp": 10, "max_hp": 10})
+        assert not actor.damage_boss("10", 3)
+        assert not actor.damage_boss("11", 5)
+        cleared = actor.damage_boss("10", 4)
+        return actor, cleared
+
+    actor, cleared = asyncio.run(scenario())
+    assert cleared
+    assert actor.boss["hp"] == 0 and not actor.boss["active"]
+    assert actor.boss_index.top() == [("10", 7), ("11", 5)]
+    assert not actor.damage_boss("11", 1)  # 討伐後は受け付けない
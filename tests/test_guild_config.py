@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def config(data_dir, storage_io, monkeypatch):
+    """空の設定から始め、書き込みは一時ディレクトリへ"""
+    monkeypatch.setattr(main, "store", main.GuildStore(main.JsonBackend()))
+    monkeypatch.setattr(main, "_config_cache", None)
+    monkeypatch.setattr(main, "_guild_config_cache", {})
+    return storage_io
+
+
+def test_xp_channels_are_unrestricted_until_set(config):
+    assert main.is_xp_channel(1, 100)
+    main.add_xp_channel_id(1, 100)
+    assert main.is_xp_channel(1, 100)
+    assert not main.is_xp_channel(1, 200)
+    assert main.is_xp_channel(2, 200)  # 他のサーバーには影響しない
+
+    assert main.remove_xp_channel_id(1, 100)
+    assert not main.remove_xp_channel_id(1, 100)
+    assert main.is_xp_channel(1, 200)
+
+
+def test_guild_config_is_cached_until_saved(config):
+    main.set_level_channel_id(1, 55)
+    cfg = main.get_guild_config(1)
+    assert cfg.level_channel_id == 55
+    assert main.get_guild_config(1) is cfg
+
+    main.set_level_channel_id(1, 66)
+    assert main.get_level_channel_id(1) == 66
+
+
+def test_config_is_written_through_the_io_thread(config):
+    main.set_level_channel_id(1, 55)
+    main.add_xp_channel_id(1, 100)
+    config.shutdown()
+    assert json.load(open(main.config_file())) == {"1": {"level_channel_id": 55, "xp_channels": [100]}}
@@ -0,0 +1,70 @@
+import json
+
+import main
+from main import DECAY_EPOCH_KEY, WEEK_EPOCH_KEY
+
+
+def user_dict(**fields):
+    info = main.UserRecord()
+    for key, value in fields.items():
+        setattr(info, key, value)
+    return info.to_dict()
+
+
+def test_journal_replays_on_load(data_dir):
+    backend = main.JournalBackend()
+    backend.save_users(5, {"10": user_dict(xp=10)}, {WEEK_EPOCH_KEY: 1}, {"10": {"message"}})
+    backend.save_users(5, {"10": user_dict(xp=25), "11": user_dict(xp=3)}, None, {"10": {"vc"}, "11": {"vc"}})
+
+    users, meta = backend.load_users(5)
+    assert users["10"]["xp"] == 25
+    assert users["11"]["xp"] == 3
+    assert meta == {WEEK_EPOCH_KEY: 1}
+
+    # meta が None の書き込みは meta の行を追記しない
+    lines = [json.loads(line) for line in open(main.journal_file(main.data_file(5)))]
+    assert [entry["op"] for entry in lines] == ["user", "meta", "user", "user"]
+
+
+def test_journal_compaction_folds_into_snapshot(data_dir):
+    backend = main.JournalBackend()
+    backend.save_users(5, {"10": user_dict(xp=10)}, {DECAY_EPOCH_KEY: 2}, {"10": {"message"}})
+    backend.save_users(5, {"11": user_dict(xp=7)}, None, {"11": {"message"}})
+    before = backend.load_users(5)
+
+    backend.compact(5)
+    assert open(main.journal_file(main.data_file(5))).read() == ""
+    assert backend.load_users(5) == before
+
+    # 畳み込み後の追記も読み込まれる
+    backend.save_users(5, {"11": user_dict(xp=8)}, None, {"11": {"message"}})
+    users, meta = backend.load_users(5)
+    assert (users["10"]["xp"], users["11"]["xp"], meta) == (10, 8, {DECAY_EPOCH_KEY: 2})
+
+
+def test_journal_boss_diffs_and_compaction(data_dir):
+    backend = main.JournalBackend()
+    boss = {**main.default_boss(), "active": True, "damage": {"10": 4, "11": 6}}
+    backend.save_boss(1, boss)
+    backend.save_boss(1, {**boss, "damage": {"10": 4, "11": 9}})
+    assert main.JournalBackend().load_boss(1)["damage"] == {"10": 4, "11": 9}
+
+    backend.compact(1)
+    assert open(main.journal_file(main.boss_file(1))).read() == ""
+    # スナップショットはダメージ順に並べて書かれる
+    assert list(json.load(open(main.boss_file(1)))["damage"]) == ["11", "10"]
+
+
+def test_store_compaction_keeps_writes_queued_before_it(data_dir, storage_io):
+    store = main.GuildStore(main.JournalBackend())
+    store.user(1, "10").xp = 3
+    store.mark_dirty(1, "10")
+    store.flush(1)
+    store.user(1, "10").xp = 7
+    store.mark_dirty(1, "10")
+    store.compact(1)
+    storage_io.shutdown()
+
+    users, _ = main.JournalBackend().load_users(1)
+    assert users["10"]["xp"] == 7
+    assert open(main.journal_file(main.data_file(1))).read() == ""
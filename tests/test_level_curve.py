@@ -0,0 +1,52 @@
+import random
+
+import main
+
+
+def old_level_ups(level, xp, coins):
+    """旧実装の1レベルずつ上げるループ"""
+    while xp >= level * 100:
+        xp -= level * 100
+        level += 1
+        coins += min(100 + level * 10, 500)
+    return level, xp, coins
+
+
+def test_level_total_xp_matches_iterative_sum():
+    total = 0
+    for level in range(1, 300):
+        assert main.level_total_xp(level) == total
+        total += level * 100
+
+
+def test_level_for_total_xp_is_inverse_at_every_boundary():
+    for level in range(1, 300):
+        start = main.level_total_xp(level)
+        assert main.level_for_total_xp(start) == level
+        assert main.level_for_total_xp(start + level * 100 - 1) == level
+    assert main.level_for_total_xp(0) == 1
+
+
+def test_level_coins_total_matches_iterative_sum():
+    coins = 0
+    for level in range(1, 120):
+        if level > 1:
+            coins += min(100 + level * 10, 500)
+        assert main.level_coins_total(level) == coins
+
+
+def test_apply_level_ups_matches_old_loop():
+    rng = random.Random(0)
+    for _ in range(2000):
+        level = rng.randrange(1, 80)
+        xp = rng.choice([rng.randrange(0, 200), rng.randrange(0, 500_000)])
+        info = main.UserRecord()
+        info.level, info.xp, info.coins = level, xp, 7
+
+        result = main.apply_level_ups(info)
+        expected = old_level_ups(level, xp, 7)
+        assert (info.level, info.xp, info.coins) == expected
+        if expected[0] == level:
+            assert result is None
+        else:
+            assert result == (level, expected[0], expected[2] - 7)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fixed_roll(monkeypatch):
+    """メッセージXPを毎回10・クリティカルなしにする"""
+    monkeypatch.setattr(main.random, "randint", lambda a, b: 10)
+    monkeypatch.setattr(main, "calc_crit", lambda base_xp, has_crit_buff: (base_xp, None, 1))
+
+
+def test_message_applies_login_xp_level_and_boss_in_one_pass(actors, fixed_roll, monkeypatch):
+    async def go():
+        actor = main.guild_actor(1)
+        await actor.ensure_loaded()
+        actor.set_boss({**main.default_boss(), "active": True, "hp": 10**6, "max_hp": 10**6})
+
+        # 読み込み後のメッセージ処理はストレージを読み直さない
+        def no_reload(*args, **kwargs):
+            raise AssertionError("reloaded")
+        monkeypatch.setattr(actors, "load", no_reload)
+
+        first = await actor.submit(lambda st: main.apply_message(st, "10", 2))
+        second = await actor.submit(lambda st: main.apply_message(st, "10", 2))
+        return actor, first, second
+
+    actor, first, second = asyncio.run(go())
+
+    assert first["login"]["bonus"] > 0 and second["login"] is None
+    assert (first["xp_gain"], first["boss_damage"]) == (20, 20)
+    assert first["level_up"] is not None  # ログボXPで Lv2 に上がる
+
+    info = actor.user("10")
+    assert info.weekly_chat_xp == 40 and info.weekly_vc_xp == 0
+    assert info.weekly_xp == 40 + first["login"]["bonus"]
+    # ログボのXPもボスへのダメージになる
+    damage = 40 + first["login"]["bonus"]
+    assert actor.boss["hp"] == 10**6 - damage
+    assert actor.boss_index.top() == [("10", damage)]
+    assert "10" in actors._dirty[1]
+
+
+def test_vc_xp_counts_separately_from_chat(actors):
+    async def go():
+        actor = main.guild_actor(1)
+        await actor.submit(lambda st: main.apply_xp(st, "10", 150, "vc"))
+        return actor
+
+    info = asyncio.run(go()).user("10")
+    assert (info.weekly_vc_xp, info.weekly_chat_xp, info.weekly_xp) == (150, 0, 150)
+    assert info.level == 2 and info.xp == 50
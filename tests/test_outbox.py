@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from main import PRIORITY_BONUS, PRIORITY_BOSS, PRIORITY_CRIT, PRIORITY_LEVEL
+
+
+class Channel:
+    id = 1
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(main, "route_resume", {})
+
+
+def held(channel):
+    """送信タスクを止めたままの ChannelOutbox（pending の中身を見るため）"""
+    outbox = main.ChannelOutbox(channel)
+    outbox._task = SimpleNamespace()
+    return outbox
+
+
+def drain(outbox):
+    outbox._task = None
+    asyncio.run(outbox._drain())
+    return outbox.channel.sent
+
+
+def test_sends_by_priority_then_push_order(monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_COALESCE_AT", 100)
+    outbox = held(Channel())
+    for priority, content in [
+        (PRIORITY_CRIT, "crit"), (PRIORITY_BONUS, "bonus"), (PRIORITY_BOSS, "boss1"),
+        (PRIORITY_LEVEL, "level"), (PRIORITY_BOSS, "boss2"),
+    ]:
+        outbox.push(priority, content, {})
+    assert drain(outbox) == ["boss1", "boss2", "level", "bonus", "crit"]
+
+
+def test_coalesces_only_low_priority_text_when_backed_up(monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_COALESCE_AT", 2)
+    outbox = held(Channel())
+    outbox.push(PRIORITY_CRIT, "c1", {})
+    outbox.push(PRIORITY_CRIT, "c2", {})
+    outbox.push(PRIORITY_CRIT, "c3", {})  # 2件たまったので c2 に追記
+    outbox.push(PRIORITY_LEVEL, "l1", {})  # 高優先度はまとめない
+    outbox.push(PRIORITY_LEVEL, "l2", {})
+    outbox.push(PRIORITY_CRIT, None, {"embed": "e"})  # Embed つきもまとめない
+    assert drain(outbox) == ["l1", "l2", "c1", "c2\nc3", None]
+
+
+def test_drops_newest_low_priority_when_full(monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_COALESCE_AT", 100)
+    monkeypatch.setattr(main, "OUTBOX_MAX_PENDING", 3)
+    outbox = held(Channel())
+    outbox.push(PRIORITY_BONUS, "b1", {})
+    outbox.push(PRIORITY_CRIT, "c1", {})
+    outbox.push(PRIORITY_CRIT, "c2", {})
+
+    outbox.push(PRIORITY_CRIT, "c3", {})  # 満杯で同じ優先度 → 新しいほうを捨てる
+    outbox.push(PRIORITY_BOSS, "boss", {})  # 一番低い優先度の一番新しい c2 を押し出す
+    outbox.push(PRIORITY_LEVEL, "level", {})  # c1 を押し出す
+    outbox.push(PRIORITY_LEVEL, "level2", {})  # b1 を押し出す
+    outbox.push(PRIORITY_LEVEL, "level3", {})  # 捨てられるものがなければ上限を超えても積む
+    assert outbox.dropped == 4
+    assert drain(outbox) == ["boss", "level", "level2", "level3"]
+
+
+def test_outbox_send_keeps_one_queue_per_channel(monkeypatch):
+    monkeypatch.setattr(main, "outboxes", {})
+    channel = Channel()
+
+    async def go():
+        main.outbox_send(channel, "a", priority=PRIORITY_CRIT)
+        main.outbox_send(channel, "b", priority=PRIORITY_BOSS)
+        await main.outboxes[channel.id]._task
+
+    asyncio.run(go())
+    # 送信タスクが動く前に積んだ分は優先度順に並び替わる
+    assert channel.sent == ["b", "a"]
+    assert list(main.outboxes) == [channel.id]
@@ -0,0 +1,59 @@
+import main
+
+
+# =========================
+# RankIndex
+# =========================
+def test_rank_index_orders_by_key_desc_then_user_id():
+    index = main.RankIndex(int, {"3": 10, "1": 30, "2": 10, "4": 0})
+    assert index.top() == [("1", 30), ("2", 10), ("3", 10), ("4", 0)]
+    assert [index.rank(uid) for uid in ("1", "2", "3", "4")] == [1, 2, 3, 4]
+    assert index.rank("missing") is None
+
+
+def test_rank_index_update_and_remove():
+    index = main.RankIndex(int, {"1": 30, "2": 20, "3": 10})
+    index.update("3", 40)
+    index.update("1", 30)  # 変わらないキーは何もしない
+    assert index.top(2) == [("3", 40), ("1", 30)]
+    index.remove("1")
+    index.remove("missing")
+    assert index.top() == [("3", 40), ("2", 20)]
+    assert list(index.iter_top()) == index.top()
+    assert len(index) == 2
+
+
+# =========================
+# GuildStore のインデックス更新
+# =========================
+def set_xp(store, user_id, xp):
+    store.user(1, user_id).xp = xp
+    store.mark_dirty(1, user_id)
+
+
+def test_store_updates_rank_index_in_place(store):
+    for uid in ("1", "2", "3"):
+        set_xp(store, uid, int(uid) * 10)
+    total = store.ranks(1)["total"]
+    assert total.rank("3") == 1
+
+    set_xp(store, "1", 99)
+    assert store.ranks(1)["total"] is total
+    assert [uid for uid, _ in total.top()] == ["1", "3", "2"]
+
+
+def test_store_rebuilds_index_after_bulk_change(store, monkeypatch):
+    monkeypatch.setattr(main, "RANK_REBUILD_MIN", 2)
+    for uid in ("1", "2", "3", "4"):
+        set_xp(store, uid, int(uid) * 10)
+    total = store.ranks(1)["total"]
+
+    # 大半の並びが変わる一括更新はインデックスを捨て、次に使うときに作り直す
+    for uid in ("1", "2", "3", "4"):
+        store.user(1, uid).xp = 100 - int(uid)
+    store.mark_dirty(1, "1", "2", "3", "4")
+    assert "total" not in store._ranks[1]
+
+    rebuilt = store.ranks(1)["total"]
+    assert rebuilt is not total
+    assert [uid for uid, _ in rebuilt.top()] == ["1", "2", "3", "4"]
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+import main
+
+
+@pytest.fixture
+def reconcile(actors, monkeypatch):
+    """3人のサーバー(1)と、呼び出しを記録する update_rank_role"""
+    actors._set_loaded(1, {uid: {"level": 5} for uid in ("10", "20", "30")}, {})
+    guild = SimpleNamespace(
+        id=1,
+        me=SimpleNamespace(guild_permissions=SimpleNamespace(manage_roles=True)),
+        get_member=lambda member_id: SimpleNamespace(id=member_id, guild=guild),
+    )
+    monkeypatch.setattr(main.bot, "get_guild", lambda guild_id: guild if guild_id == 1 else None)
+    monkeypatch.setattr(main, "ROLE_RECONCILE_SPACING", 0)
+
+    log = SimpleNamespace(guild=guild, calls=[], fail={})  # fail: { member_id: 例外を作る関数 }（1回だけ）
+
+    async def update_rank_role(member, level):
+        log.calls.append(member.id)
+        fail = log.fail.pop(member.id, None)
+        if fail:
+            raise fail(member)
+        return True
+
+    monkeypatch.setattr(main, "update_rank_role", update_rank_role)
+    return log
+
+
+def forbidden(member):
+    member.guild.me.guild_permissions.manage_roles = False
+    return discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Missing Permissions")
+
+
+def run_guild(reconciler, guild_id=1):
+    reconciler.checkpoint = reconciler.checkpoint or {}
+    reconciler.progress[guild_id] = {"state": "queued", "done": 0, "total": 0, "changed": 0, "failed": 0}
+    asyncio.run(reconciler._reconcile_guild(guild_id))
+    return reconciler.progress[guild_id]
+
+
+def test_reconcile_walks_members_and_completes(reconcile):
+    reconciler = main.RoleReconciler()
+    progress = run_guild(reconciler)
+    assert reconcile.calls == [10, 20, 30]
+    assert (progress["state"], progress["done"], progress["changed"]) == ("done", 3, 3)
+    assert reconciler.checkpoint["1"]["cursor"] == "30"
+    assert reconciler.checkpoint["1"]["completed"]
+
+
+def test_reconcile_stops_on_lost_permission_and_resumes_at_same_member(reconcile):
+    reconciler = main.RoleReconciler()
+    # 2人目で「ロールの管理」権限が外される
+    reconcile.fail[20] = forbidden
+    progress = run_guild(reconciler)
+    assert progress["state"] == "forbidden"
+    assert reconcile.calls == [10, 20]
+    assert reconciler.checkpoint["1"] == {"cursor": "10", "completed": None}
+
+    # 権限が戻ったら 20 から続ける
+    reconcile.guild.me.guild_permissions.manage_roles = True
+    reconcile.calls.clear()
+    progress = run_guild(reconciler)
+    assert reconcile.calls == [20, 30]
+    assert progress["state"] == "done"
+
+
+def test_reconcile_counts_hierarchy_failures_and_continues(reconcile):
+    # 権限はあるがロール階層で触れないメンバーだけ失敗扱い
+    reconcile.fail[20] = lambda member: discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "")
+    progress = run_guild(main.RoleReconciler())
+    assert reconcile.calls == [10, 20, 30]
+    assert (progress["state"], progress["changed"], progress["failed"]) == ("done", 2, 1)
+
+
+def test_start_skips_recently_completed_guilds(reconcile):
+    async def go():
+        reconciler = main.RoleReconciler()
+        reconciler.checkpoint = {"1": {"cursor": "30", "completed": main.datetime.now(main.timezone.utc).isoformat()}}
+        reconciler._workers = [None]  # ワーカーは起動しない
+        await reconciler.start([reconcile.guild, SimpleNamespace(id=2)])
+        return reconciler
+
+    reconciler = asyncio.run(go())
+    assert reconciler.progress[1]["state"] == "done"
+    assert reconciler.progress[2]["state"] == "queued"
+    assert reconciler.queue.qsize() == 1
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class Guild:
+    def __init__(self, guild_id, names):
+        self.id = guild_id
+        self.roles = [SimpleNamespace(id=i + 1, name=name, guild=self) for i, name in enumerate(names)]
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+
+@pytest.fixture(autouse=True)
+def role_ids(monkeypatch):
+    monkeypatch.setattr(main, "guild_role_ids", {})
+
+
+def old_rank_role_name(level):
+    """旧実装の線形探索"""
+    for min_lv, max_lv, role_name in main.rank_roles:
+        if min_lv <= level <= max_lv:
+            return role_name
+    return None
+
+
+def test_rank_role_name_matches_linear_scan():
+    top = main.rank_roles[-1][1]
+    for level in range(0, top + 10):
+        assert main.rank_role_name(level) == old_rank_role_name(level)
+
+
+def test_role_index_prefers_first_duplicate_and_follows_events():
+    guild = Guild(1, ["a", "b", "a"])
+    assert main.get_role(guild, "a").id == 1
+    assert main.get_role(guild, "missing") is None
+
+    role = SimpleNamespace(id=9, name="c", guild=guild)
+    guild.roles.append(role)
+    asyncio.run(main.on_guild_role_create(role))
+    assert main.get_role(guild, "c") is role
+
+    # 削除されたらそのサーバーだけ作り直す
+    del guild.roles[0]
+    asyncio.run(main.on_guild_role_delete(role))
+    assert 1 not in main.guild_role_ids
+    assert main.get_role(guild, "a").id == 3
+
+
+def test_rank_role_diff_only_touches_rank_roles():
+    names = [role_name for _, _, role_name in main.rank_roles]
+    guild = Guild(1, names + ["other"])
+    roles = {role.name: role for role in guild.roles}
+    level = main.rank_roles[1][0]
+    target = roles[main.rank_role_name(level)]
+    member = SimpleNamespace(guild=guild, roles=[roles[names[0]], roles["other"]])
+
+    to_add, to_remove = main.rank_role_diff(member, level)
+    assert to_add is target and to_remove == [roles[names[0]]]
+
+    member.roles = [target, roles["other"]]
+    assert main.rank_role_diff(member, level) == (None, [])
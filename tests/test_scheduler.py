@@ -0,0 +1,100 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def now(monkeypatch):
+    """main の datetime.now() を固定する（now[0] を書き換えて進める）"""
+    current = [main.JST.localize(datetime(2026, 10, 14, 12, 3))]  # 水曜 12:03 JST
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return current[0].astimezone(tz) if tz else current[0].replace(tzinfo=None)
+
+    monkeypatch.setattr(main, "datetime", FakeDatetime)
+    return current
+
+
+def write_log(log):
+    with open(main.scheduler_log_file(), "w") as f:
+        json.dump(log, f)
+
+
+def read_log():
+    with open(main.scheduler_log_file()) as f:
+        return json.load(f)
+
+
+def start(scheduler, settle=False):
+    """start() してヒープの先頭を返す。settle なら発火済みのジョブが走るまで待つ"""
+    async def go():
+        await scheduler.start()
+        if settle:
+            for _ in range(5):
+                await asyncio.sleep(0)
+        head = scheduler._heap[0][0]
+        scheduler._task.cancel()
+        return head
+    return asyncio.run(go())
+
+
+def noon(day):
+    return main.jst_at(datetime(2026, 10, day).date(), 12)
+
+
+def test_first_start_does_not_backfill(data_dir, storage_io, now):
+    scheduler = main.Scheduler()
+    scheduler.add("noon", main.daily_at(12), None)
+    assert start(scheduler) == noon(15)
+
+
+def test_missed_run_within_grace_fires_once(data_dir, storage_io, now):
+    write_log({"noon": noon(13).isoformat()})
+    fired = []
+
+    async def job(fire_time):
+        fired.append(fire_time)
+
+    scheduler = main.Scheduler()
+    scheduler.add("noon", main.daily_at(12), job)
+    # 12:00 の回を3分過ぎて起動（猶予5分以内）
+    assert start(scheduler, settle=True) == noon(15)
+    assert fired == [noon(14)]
+
+    # 実行前に発火ログを書くので、再起動しても同じ回は実行しない
+    fired.clear()
+    scheduler = main.Scheduler()
+    scheduler.add("noon", main.daily_at(12), job)
+    assert start(scheduler, settle=True) == noon(15)
+    assert fired == []
+    storage_io.shutdown()
+    assert read_log() == {"noon": noon(14).isoformat()}
+
+
+def test_missed_run_past_grace_is_skipped(data_dir, storage_io, now):
+    write_log({"noon": noon(10).isoformat()})
+    now[0] += timedelta(minutes=10)
+    fired = []
+
+    async def job(fire_time):
+        fired.append(fire_time)
+
+    scheduler = main.Scheduler()
+    scheduler.add("noon", main.daily_at(12), job)
+    # 何日分過ぎていても、猶予を過ぎた回はさかのぼらず次の回を待つ
+    assert start(scheduler, settle=True) == noon(15)
+    assert fired == []
+
+
+def test_per_job_grace(data_dir, storage_io, now):
+    write_log({"noon": noon(13).isoformat()})
+    now[0] += timedelta(minutes=10)
+    scheduler = main.Scheduler()
+    scheduler.add("noon", main.daily_at(12), None, grace=timedelta(minutes=30))
+    assert start(scheduler) == noon(14)
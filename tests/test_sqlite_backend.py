@@ -0,0 +1,74 @@
+import main
+from main import WEEK_EPOCH_KEY
+
+
+def user(**fields):
+    info = main.UserRecord()
+    for key, value in fields.items():
+        setattr(info, key, value)
+    return info.to_dict()
+
+
+def test_users_round_trip_with_columns_and_extra(data_dir):
+    backend = main.SqliteBackend()
+    users = {"10": user(xp=50, level=3, coins=9, login_streak=2), "11": user(xp=1)}
+    backend.save_users(1, users, {WEEK_EPOCH_KEY: 4}, users.keys())
+    backend.save_users(2, {"10": user(xp=999)}, None, ["10"])
+
+    loaded, meta = main.SqliteBackend().load_users(1)
+    assert loaded == users
+    assert meta == {WEEK_EPOCH_KEY: 4}
+
+
+def test_only_dirty_users_are_written(data_dir):
+    backend = main.SqliteBackend()
+    backend.save_users(1, {"10": user(xp=1), "11": user(xp=1)}, None, ["10", "11"])
+    backend.save_users(1, {"10": user(xp=2), "11": user(xp=2)}, None, ["10"])
+    loaded, _ = backend.load_users(1)
+    assert (loaded["10"]["xp"], loaded["11"]["xp"]) == (2, 1)
+
+
+def test_boss_damage_is_saved_as_diff(data_dir):
+    backend = main.SqliteBackend()
+    boss = {**main.default_boss(), "active": True, "hp": 90, "max_hp": 100, "damage": {"10": 4, "11": 6}}
+    backend.save_boss(1, boss)
+    backend.save_boss(1, {**boss, "hp": 80, "damage": {"11": 16}})
+
+    loaded = main.SqliteBackend().load_boss(1)
+    assert (loaded["active"], loaded["hp"], loaded["damage"]) == (True, 80, {"11": 16})
+    assert main.SqliteBackend().load_boss(2) == main.default_boss()
+
+
+def test_event_boss_keeps_name_and_defaults(data_dir):
+    backend = main.SqliteBackend()
+    backend.save_event_boss(1, {"active": False, "damage": {}})
+    loaded = backend.load_event_boss(1)
+    assert loaded["name"] == ""
+    backend.save_event_boss(1, {**main.default_event_boss(), "name": "魔王"})
+    assert main.SqliteBackend().load_event_boss(1)["name"] == "魔王"
+
+
+def test_config_save_removes_deleted_guilds(data_dir):
+    backend = main.SqliteBackend()
+    backend.save_config({"1": {"level_channel_id": 5}, "2": {}})
+    backend.save_config({"2": {"xp_channels": [7]}})
+    assert main.SqliteBackend().load_config() == {"2": {"xp_channels": [7]}}
+
+
+def test_migrate_json_to_sqlite_is_idempotent(data_dir, capsys):
+    json_backend = main.JsonBackend()
+    json_backend.save_users(1, {"10": user(xp=5)}, {WEEK_EPOCH_KEY: 2}, None)
+    json_backend.save_boss(1, {**main.default_boss(), "damage": {"10": 3}})
+    json_backend.save_config({"1": {"level_channel_id": 9}})
+    legacy = data_dir / "levels.json"
+    legacy.write_text('{"10": {"xp": 777}, "20": {"xp": 8, "level": 1}}')
+
+    for _ in range(2):
+        main.migrate_json_to_sqlite(1, str(legacy))
+
+    backend = main.SqliteBackend()
+    users, meta = backend.load_users(1)
+    # 移行済みのユーザーは旧 levels.json で上書きしない
+    assert (users["10"]["xp"], users["20"]["xp"], meta) == (5, 8, {WEEK_EPOCH_KEY: 2})
+    assert backend.load_boss(1)["damage"] == {"10": 3}
+    assert backend.load_config() == {"1": {"level_channel_id": 9}}
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+
+def block_io_thread(executor):
+    """I/Oスレッドを止めておき、その間の書き込みを実行待ちのまま溜める"""
+    gate = threading.Event()
+    executor.write(("gate",), lambda _: gate.wait(), None)
+    return gate
+
+
+def test_storage_executor_coalesces_pending_writes(storage_io):
+    written = []
+    gate = block_io_thread(storage_io)
+    first = storage_io.write(("k",), written.append, 1)
+    second = storage_io.write(("k",), written.append, 2)
+    assert first is second
+    assert storage_io.pending_value(("k",)) == 2
+
+    gate.set()
+    first.result()
+    assert written == [2]
+
+
+def test_storage_executor_merges_pending_writes(storage_io):
+    written = []
+    gate = block_io_thread(storage_io)
+    storage_io.write(("k",), written.append, {"a": 1}, lambda old, new: {**old, **new})
+    storage_io.write(("k",), written.append, {"b": 2}, lambda old, new: {**old, **new})
+    gate.set()
+    storage_io.shutdown()
+    assert written == [{"a": 1, "b": 2}]
+
+
+def test_read_returns_pending_write_without_reading(storage_io):
+    gate = block_io_thread(storage_io)
+    storage_io.write(("k",), lambda _: None, {"v": 1})
+
+    def read_file():
+        raise AssertionError("should not read")
+
+    assert asyncio.run(storage_io.read(("k",), read_file)) == {"v": 1}
+    assert storage_io.read_sync(("k",), read_file) == {"v": 1}
+    gate.set()
@@ -0,0 +1,33 @@
+import json
+
+import main
+
+
+def test_store_writes_back_dirty_users(data_dir, storage_io):
+    store = main.GuildStore(main.JsonBackend())
+    store.user(1, "10").xp = 50
+    store.user(1, "11").coins = 7
+    store.mark_dirty(1, "10", "11", source="test")
+    assert store.dirty_count() == 2
+
+    store.flush_all()
+    assert store.dirty_count() == 0
+    storage_io.shutdown()
+
+    saved = json.load(open(main.data_file(1)))
+    assert (saved["10"]["xp"], saved["11"]["coins"]) == (50, 7)
+    reloaded = main.GuildStore(main.JsonBackend())
+    assert reloaded.user(1, "10").xp == 50
+
+
+def test_store_flushes_at_dirty_threshold(data_dir, storage_io):
+    store = main.GuildStore(main.JsonBackend(), dirty_threshold=3)
+    for uid in ("10", "11"):
+        store.user(1, uid).xp = 1
+        store.mark_dirty(1, uid)
+    assert store.dirty_count() == 2
+    store.user(1, "12").xp = 1
+    store.mark_dirty(1, "12")
+    assert store.dirty_count() == 0
+    storage_io.shutdown()
+    assert set(json.load(open(main.data_file(1)))) == {"10", "11", "12"}
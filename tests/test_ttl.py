@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """main の time.time() を手で進める時計"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    return now
+
+
+def test_ttl_map_expires_untouched_keys(clock):
+    ttl = main.TtlMap("test", 10, 100)
+    ttl["a"] = 1
+    ttl["b"] = 2
+    clock[0] += 6
+    assert ttl.get("a") == 1  # 読むと期限が延びる
+    clock[0] += 6
+    ttl.sweep()
+    assert "a" in ttl and "b" not in ttl
+    assert ttl.stats["expired"] == 1
+
+    # スイープ前でも期限切れのキーは見えない
+    clock[0] += 11
+    assert ttl.get("a") is None
+    assert len(ttl) == 0
+
+
+def test_ttl_map_evicts_least_recently_touched(clock):
+    ttl = main.TtlMap("test", 10, 2)
+    ttl["a"] = 1
+    ttl["b"] = 2
+    ttl.get("a")
+    ttl["c"] = 3
+    assert "b" not in ttl and "a" in ttl and "c" in ttl
+    assert ttl.stats["evicted"] == 1
+
+
+def test_ttl_map_touch_extends_without_counting(clock):
+    ttl = main.TtlMap("test", 10, 100)
+    ttl["a"] = 1
+    for _ in range(5):
+        clock[0] += 6
+        ttl.touch("a")
+        ttl.touch("missing")
+    ttl.sweep()
+    assert ttl.pop("a") == 1
+    assert (ttl.stats["hits"], ttl.stats["misses"]) == (0, 0)
+
+
+def test_sliding_window_counter(clock):
+    counter = main.SlidingWindowCounter("test", 10, 3, 100)
+    assert [counter.hit("u") for _ in range(4)] == [1, 2, 3, 3]
+    clock[0] += 11
+    assert counter.hit("u") == 1
+
+
+def test_afk_flag_survives_while_alone_in_vc(clock, monkeypatch):
+    for name in ("vc_users", "vc_afk_flags", "vc_last_xp_time"):
+        monkeypatch.setattr(main, name, main.TtlMap(name, main.VC_STATE_TTL, 100))
+    monkeypatch.setattr(main, "get_boost", lambda guild_id: {"multiplier": 1, "active": False})
+
+    applied = []
+
+    def apply_xp_batch(st, entries):
+        applied.extend(entries)
+        return [None] * len(entries)
+
+    async def handle_xp_result(member, result):
+        pass
+
+    class Actor:
+        async def submit(self, fn):
+            return fn(self)
+
+    monkeypatch.setattr(main, "apply_xp_batch", apply_xp_batch)
+    monkeypatch.setattr(main, "handle_xp_result", handle_xp_result)
+    monkeypatch.setattr(main, "guild_actor", lambda guild_id: Actor())
+
+    def member(member_id):
+        return SimpleNamespace(id=member_id, bot=False, voice=SimpleNamespace(self_mute=False, mute=False))
+
+    sleeper = member(2)
+    channel = SimpleNamespace(members=[sleeper])
+    guild = SimpleNamespace(id=1, voice_channels=[channel], stage_channels=[])
+    main.vc_users["1:2"] = 0
+    main.vc_afk_flags["1:2"] = True
+
+    # 寝落ち判定のあと1人きりで2時間（TTLより長く）過ごす
+    for _ in range(2 * main.VC_STATE_TTL // main.VC_TICK_SECONDS):
+        clock[0] += main.VC_TICK_SECONDS
+        asyncio.run(main.vc_tick_guild(guild))
+        main.vc_afk_flags.sweep()
+    assert main.vc_afk_flags.get("1:2")
+
+    # 誰かが来ても /return するまで寝落ちしたメンバーにXPは付かない
+    channel.members.append(member(3))
+    asyncio.run(main.vc_tick_guild(guild))
+    assert [uid for uid, _, _ in applied] == ["3"]
@@ -0,0 +1,70 @@
+from datetime import date, datetime
+
+import main
+from main import DECAY_EPOCH_KEY, WEEK_EPOCH_KEY
+
+LEGACY_USER = {
+    "xp": 1234,
+    "level": 12,
+    "last_daily": "2026-10-17",
+    "weekly_xp": 300,
+    "login_streak": 4,
+    "weekly_chat_xp": 200,
+    "weekly_vc_xp": 100,
+    "weekly_active_days": ["2026-10-12", "2026-10-14", "2026-10-19"],
+    "last_weekly_xp": 250,
+    "last_weekly_rank": 2,
+    "coins": 900,
+    "buffs": {"xp_multiplier": {"value": 1.5, "expires_at": 1_800_000_000, "item_id": "xp_boost"}},
+    "coin_daily_earned": 50,
+    "coin_total_spent": 400,
+    "custom_field": {"kept": True},
+}
+
+
+def test_user_record_round_trips_legacy_dict():
+    info = main.UserRecord.from_dict(LEGACY_USER)
+    assert info.xp == 1234
+    assert info["custom_field"] == {"kept": True}
+    # 月曜18時区切りの週では両方の月曜が別の日として数えられる
+    assert info.active_day_count() == 3
+
+    raw = info.to_dict()
+    assert raw["weekly_active_days"] == LEGACY_USER["weekly_active_days"]
+    assert {k: v for k, v in raw.items() if k not in (DECAY_EPOCH_KEY, WEEK_EPOCH_KEY)} == LEGACY_USER
+    assert (raw[DECAY_EPOCH_KEY], raw[WEEK_EPOCH_KEY]) == (0, 0)
+
+
+def test_user_record_fills_defaults_for_old_data():
+    info = main.UserRecord.from_dict({"xp": 5, "level": 1})
+    raw = info.to_dict()
+    assert raw["buffs"] == {}
+    assert raw["weekly_active_days"] == []
+    assert raw["coins"] == 0
+    assert info.get("missing", "default") == "default"
+    assert "xp" in info and "missing" not in info
+
+
+def test_mark_active_day():
+    info = main.UserRecord()
+    assert info.mark_active_day(date(2026, 10, 12))
+    assert not info.mark_active_day("2026-10-12")
+    assert info.mark_active_day(date(2026, 10, 19))
+    assert info.active_day_count() == 2
+    assert info.to_dict()["weekly_active_days"] == ["2026-10-12", "2026-10-19"]
+
+
+def test_current_week_start_switches_on_monday_evening():
+    assert main.current_week_start(main.JST.localize(datetime(2026, 10, 19, 17, 59))) == date(2026, 10, 12)
+    assert main.current_week_start(main.JST.localize(datetime(2026, 10, 19, 18, 0))) == date(2026, 10, 19)
+    assert main.current_week_start(main.JST.localize(datetime(2026, 10, 25, 23, 0))) == date(2026, 10, 19)
+
+
+def test_weekday_mask_format_is_read_as_this_week():
+    # 曜日だけの7ビットマスク（月・水・日）は今の週の日付に戻す
+    now = main.JST.localize(datetime(2026, 10, 22, 12, 0))
+    value = main.decode_active_days(0b1000101, now)
+    assert main.encode_active_days(value) == ["2026-10-19", "2026-10-21", "2026-10-25"]
+    assert main.decode_active_days(0, now) == 0
+    # 日付を持つ新しい値はそのまま
+    assert main.decode_active_days(value, now) == value
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+def member(member_id, muted=False, bot=False):
+    return SimpleNamespace(id=member_id, bot=bot, voice=SimpleNamespace(self_mute=muted, mute=False))
+
+
+def guild(*channels):
+    return SimpleNamespace(
+        id=1,
+        voice_channels=[SimpleNamespace(members=list(members)) for members in channels],
+        stage_channels=[],
+    )
+
+
+@pytest.fixture
+def tick(monkeypatch):
+    """vc_tick_guild のアクター適用・通知・AFKチェックを記録に置き換える"""
+    for name in ("vc_users", "vc_afk_flags", "vc_last_xp_time"):
+        monkeypatch.setattr(main, name, main.TtlMap(name, main.VC_STATE_TTL, 100))
+    monkeypatch.setattr(main, "vc_afk_checking", set())
+    monkeypatch.setattr(main, "get_boost", lambda guild_id: {"multiplier": 2, "active": True})
+
+    log = SimpleNamespace(batches=[], afk_checks=[])
+
+    class Actor:
+        async def submit(self, fn):
+            return fn(self)
+
+    def apply_xp_batch(st, entries):
+        log.batches.append(list(entries))
+        return [None] * len(entries)
+
+    async def handle_xp_result(member, result):
+        pass
+
+    async def afk_check_task(member, ck):
+        log.afk_checks.append(ck)
+
+    monkeypatch.setattr(main, "guild_actor", lambda guild_id: Actor())
+    monkeypatch.setattr(main, "apply_xp_batch", apply_xp_batch)
+    monkeypatch.setattr(main, "handle_xp_result", handle_xp_result)
+    monkeypatch.setattr(main, "afk_check_task", afk_check_task)
+    return log
+
+
+def test_tick_applies_whole_guild_in_one_batch(tick):
+    g = guild(
+        [member(1), member(2, muted=True), member(9, bot=True)],
+        [member(3), member(4)],
+        [member(5)],  # 1人だけのVCはXPなし
+    )
+    asyncio.run(main.vc_tick_guild(g))
+    assert tick.batches == [[("1", "vc", 30), ("2", "vc", 4), ("3", "vc", 30), ("4", "vc", 30)]]
+    assert main.vc_users.get("1:1") == main.VC_TICK_SECONDS
+    assert "1:9" not in main.vc_users
+
+
+def test_tick_starts_afk_check_and_skips_xp(tick):
+    g = guild([member(1), member(2)])
+    main.vc_users["1:1"] = main.VC_AFK_CHECK_SECONDS - main.VC_TICK_SECONDS
+
+    async def go():
+        await main.vc_tick_guild(g)
+        await asyncio.sleep(0)  # AFKチェックのタスクを走らせる
+        # 応答待ちの間もXPは付かない
+        await main.vc_tick_guild(g)
+
+    asyncio.run(go())
+    assert tick.afk_checks == ["1:1"]
+    assert [[uid for uid, _, _ in batch] for batch in tick.batches] == [["2"], ["2"]]
+    assert main.vc_users.get("1:1") == main.VC_TICK_SECONDS
@@ -0,0 +1,73 @@
+from datetime import date
+
+import pytest
+
+from main import DECAY_EPOCH_KEY, WEEK_EPOCH_KEY
+
+
+def test_new_user_starts_at_current_epochs(store):
+    store.meta(1)[DECAY_EPOCH_KEY] = 4
+    store.meta(1)[WEEK_EPOCH_KEY] = 7
+    info = store.user(1, "10")
+    assert (info.decay_epoch, info.week_epoch) == (4, 7)
+
+
+def test_advance_week_moves_counters_to_last_week(store):
+    for uid, xp in (("10", 300), ("11", 500), ("12", 0)):
+        info = store.user(1, uid)
+        info.weekly_xp = xp
+        info.coin_daily_earned = 40
+        info.mark_active_day(date(2026, 10, 12))
+        store.mark_dirty(1, uid)
+    assert store.weekly_totals(1) == (800, 2)
+
+    store.advance_week(1)
+    assert store.weekly_totals(1) == (0, 0)
+    assert store.ranks(1)["last_week"].top(2) == [("11", 500), ("10", 300)]
+
+    info = store.user(1, "10")
+    assert (info.last_weekly_xp, info.last_weekly_rank) == (300, 2)
+    assert (info.weekly_xp, info.coin_daily_earned, info.active_day_count()) == (0, 0, 0)
+    assert info.week_epoch == 1
+
+
+def test_week_settle_after_two_weeks_clears_last_week(store):
+    info = store.user(1, "10")
+    info.weekly_xp = 300
+    store.mark_dirty(1, "10")
+    store.advance_week(1)
+    store.advance_week(1)
+
+    info = store.user(1, "10")
+    assert (info.weekly_xp, info.last_weekly_xp, info.week_epoch) == (0, 0, 2)
+
+
+def test_reset_weekly_counters_keeps_last_week(store):
+    info = store.user(1, "10")
+    info.weekly_xp = 300
+    info.last_weekly_xp = 120
+    info.last_weekly_rank = 3
+    info.coin_daily_earned = 40
+    store.mark_dirty(1, "10")
+
+    store.reset_weekly_counters(1)
+    info = store.user(1, "10")
+    assert (info.weekly_xp, info.last_weekly_xp, info.last_weekly_rank, info.coin_daily_earned) == (0, 120, 3, 40)
+    assert store.weekly_totals(1) == (0, 0)
+
+
+@pytest.mark.parametrize("rebuild_before_advance", [False, True])
+def test_rankings_always_hold_every_user(store, rebuild_before_advance):
+    store.ranks(1)
+    for uid, xp in (("10", 300), ("11", 0)):
+        store.user(1, uid).weekly_xp = xp
+        store.mark_dirty(1, uid)
+    store.user(1, "12")  # 読んだだけの新規ユーザーも入る
+    if rebuild_before_advance:
+        store._ranks.pop(1)
+
+    store.advance_week(1)
+    ranks = store.ranks(1)
+    assert {name: len(index) for name, index in ranks.items()} == {"total": 3, "weekly": 3, "last_week": 3}
+    assert ranks["last_week"].top() == [("10", 300), ("11", 0), ("12", 0)]
+    assert store.user(1, "12").last_weekly_rank == 3
@@ -0,0 +1,37 @@
+import random
+
+import main
+
+
+def record(weekly_xp, week_epoch=0):
+    info = main.UserRecord()
+    info.weekly_xp = weekly_xp
+    info.week_epoch = week_epoch
+    return info
+
+
+def test_weekly_totals_counts_only_current_week():
+    users = {"1": record(100), "2": record(0), "3": record(50, week_epoch=-1)}
+    totals = main.WeeklyTotals(users, 0)
+    assert (totals.total, totals.active) == (100, 1)
+
+    totals.update("2", record(30))
+    totals.update("1", record(0))
+    totals.update("4", record(5))
+    assert (totals.total, totals.active) == (35, 2)
+
+    totals.update("4", None)  # 削除されたユーザー
+    assert (totals.total, totals.active) == (30, 1)
+
+
+def test_store_weekly_totals_match_full_scan(store):
+    rng = random.Random(0)
+    for _ in range(300):
+        uid = str(rng.randrange(20))
+        info = store.user(1, uid)
+        info.weekly_xp = max(0, info.weekly_xp + rng.randrange(-30, 60))
+        store.mark_dirty(1, uid)
+
+    users = store.users(1).values()
+    expected = (sum(u.weekly_xp for u in users), sum(1 for u in users if u.weekly_xp > 0))
+    assert store.weekly_totals(1) == expected
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def batching(actors, monkeypatch):
+    """XP_BATCH_MS を有効にし、apply_xp の呼び出しを記録する"""
+    monkeypatch.setattr(main, "XP_BATCH_MS", 20)
+    monkeypatch.setattr(main, "xp_accumulators", {})
+    calls = []
+    apply_xp = main.apply_xp
+
+    def counting_apply_xp(actor, user_id, gain, source, boss_damage=None):
+        calls.append((user_id, source, gain))
+        return apply_xp(actor, user_id, gain, source, boss_damage=boss_damage)
+
+    monkeypatch.setattr(main, "apply_xp", counting_apply_xp)
+    return calls
+
+
+def test_batch_applies_once_per_user_and_source(batching):
+    async def go():
+        futures = [
+            main.submit_xp(1, "10", "vc", 60),
+            main.submit_xp(1, "20", "vc", 5),
+            main.submit_xp(1, "10", "vc", 60),
+            main.submit_xp(1, "10", "vc", 60),
+        ]
+        return await asyncio.gather(*futures)
+
+    results = asyncio.run(go())
+    assert sorted(batching) == [("10", "vc", 180), ("20", "vc", 5)]
+
+    # レベルアップは同じユーザーの最後のエントリにだけ載る
+    assert [r["level_up"] is not None for r in results] == [False, False, False, True]
+    info = main.guild_actor(1).user("10")
+    assert (info.level, info.xp, info.weekly_vc_xp) == (2, 80, 180)
+
+
+def test_flush_applies_pending_entries_at_shutdown(batching):
+    async def go():
+        main.submit_xp(1, "10", "vc", 30)
+        main.submit_xp(1, "10", "vc", 30)
+        # コミット前に終了する
+        main.flush_xp_accumulators()
+
+    asyncio.run(go())
+    assert batching == [("10", "vc", 60)]
+    assert main.guild_actor(1).user("10").xp == 60
+    assert main.xp_accumulators[1].entries == []
+
+
+def test_drain_applies_mailbox_left_at_shutdown(actors):
+    def gain_coin(st):
+        st.user("10").coins += 1
+        st.mark_dirty("10")
+
+    async def go():
+        actor = main.guild_actor(1)
+        for _ in range(3):
+            actor.submit(gain_coin)
+
+    # ループが止まって _run が一度も動かなくても、drain で全件適用される
+    asyncio.run(go())
+    main.drain_guild_actors()
+    assert main.guild_actor(1).user("10").coins == 3
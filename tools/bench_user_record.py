@@ -0,0 +1,74 @@
+# =========================
+# ユーザーデータのメモリ比較（従来の dict vs UserRecord）
+# python tools/bench_user_record.py [ユーザー数]
+# =========================
+# どちらも同じ作成済みの dict から作る（dict 側は deepcopy、UserRecord 側は deepcopy してから変換）ので、
+# 文字列・数値の共有のされ方も作成時間の条件も同じ。
+import copy
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import UserRecord  # noqa: E402
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+WEEK_START = date(2026, 10, 12)
+
+def legacy_user(rng):
+    """従来の ensure_user_data() が作っていたのと同じ形の dict"""
+    days = rng.sample(range(7), rng.randint(0, 7))
+    return {
+        "xp": rng.randint(0, 5000),
+        "level": rng.randint(1, 80),
+        "last_daily": "2026-10-17",
+        "weekly_xp": rng.randint(0, 3000),
+        "login_streak": rng.randint(0, 30),
+        "weekly_chat_xp": rng.randint(0, 2000),
+        "weekly_vc_xp": rng.randint(0, 1000),
+        "weekly_active_days": [(WEEK_START + timedelta(days=d)).isoformat() for d in sorted(days)],
+        "last_weekly_xp": rng.randint(0, 3000),
+        "last_weekly_rank": rng.randint(0, 500),
+        "coins": rng.randint(0, 20000),
+        "buffs": {},
+        "coin_daily_earned": rng.randint(0, 1500),
+        "coin_total_spent": rng.randint(0, 50000),
+    }
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    users = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return users, size, elapsed
+
+def access_time(users, read):
+    start = time.perf_counter()
+    for info in users.values():
+        read(info)
+    return time.perf_counter() - start
+
+def main():
+    raw = {str(i): legacy_user(random.Random(i)) for i in range(N)}
+
+    dicts, dict_bytes, dict_build = measure(lambda: {uid: copy.deepcopy(info) for uid, info in raw.items()})
+    records, record_bytes, record_build = measure(
+        lambda: {uid: UserRecord.from_dict(copy.deepcopy(info)) for uid, info in raw.items()}
+    )
+
+    dict_read = access_time(dicts, lambda info: info["xp"] + info["weekly_xp"] + info["level"])
+    record_read = access_time(records, lambda info: info.xp + info.weekly_xp + info.level)
+
+    print(f"ユーザー数: {N:,}")
+    print(f"dict       : {dict_bytes / 2**20:8.1f} MiB（1人 {dict_bytes / N:6.0f} B） 複製 {dict_build:.2f}s  読み取り {dict_read * 1000:.1f}ms")
+    print(f"UserRecord : {record_bytes / 2**20:8.1f} MiB（1人 {record_bytes / N:6.0f} B） 変換 {record_build:.2f}s  読み取り {record_read * 1000:.1f}ms")
+    print(f"削減率     : {1 - record_bytes / dict_bytes:.0%}")
+
+if __name__ == "__main__":
+    main()